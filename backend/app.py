@@ -1,10 +1,28 @@
 
+from contextlib import asynccontextmanager
 from fastapi import FastAPI, File, UploadFile, Form
 from fastapi.middleware.cors import CORSMiddleware
-from backend.lease_chain import run_rag_pipeline, evaluate_general_risks, load_lease_docs
-import shutil, os
+from starlette.concurrency import run_in_threadpool
+from backend.lease_chain import answer_question, evaluate_general_risks, load_lease_docs, run_startup_warmup, start_background_migration, maintain_document_store, get_document_lineage, _STARTUP_REPORT
+import shutil, os, threading, tempfile
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Warm heavy imports and recent documents. By default this runs in the
+    # background so the worker starts accepting requests immediately; set
+    # LEASE_WARM_BLOCKING=1 to finish warm-up before serving.
+    if os.getenv("LEASE_WARM_BLOCKING", "0") == "1":
+        run_startup_warmup()
+    else:
+        threading.Thread(target=run_startup_warmup, name="startup-warmup", daemon=True).start()
+    # Upgrade documents built by an older ingest pipeline, one at a time
+    if os.getenv("LEASE_MIGRATE_ON_STARTUP", "1") == "1":
+        threading.Thread(target=start_background_migration, name="migration-scan", daemon=True).start()
+    # Measure unsized documents and bring the store under LEASE_STORE_QUOTA
+    threading.Thread(target=maintain_document_store, name="store-maintenance", daemon=True).start()
+    yield
+
+app = FastAPI(lifespan=lifespan)
 
 from fastapi.middleware.cors import CORSMiddleware
 
@@ -24,66 +42,140 @@ app.add_middleware(
 def test_cors():
     return {"message": "CORS is working"}
 
+@app.get("/healthz")
+async def healthz():
+    # Runs on the event loop itself (not the threadpool), so its latency
+    # shows when something is blocking the loop
+    return {"status": "ok"}
+
+@app.get("/startup-report")
+def startup_report():
+    return {"report": _STARTUP_REPORT or {"status": "warm-up in progress"}}
+
+@app.get("/admin/store")
+def admin_store():
+    from backend.doc_store import store_report
+    return store_report()
+
+@app.get("/admin/llm")
+def admin_llm():
+    # Per worker: dispatcher queues and budgets, plus per-chain token usage,
+    # cached-token ratio and per-call overhead
+    from backend.llm_dispatch import chain_stats, dispatch_stats
+    return {"pid": os.getpid(), "dispatchers": dispatch_stats(), "chains": chain_stats()}
+
 @app.post("/upload")
-async def upload_file(file: UploadFile = File(...)):
+async def upload_file(file: UploadFile = File(...), index_mode: str | None = Form(default=None)):
     import os
-    from backend.lease_chain import _compute_doc_id_for_file, _doc_dir
-    os.makedirs("temp", exist_ok=True)
-    # Save to a temp path first
-    tmp_path = "temp/lease.pdf"
-    with open(tmp_path, "wb") as f:
-        shutil.copyfileobj(file.file, f)
-    # Compute doc_id and move to permanent location
-    doc_id = _compute_doc_id_for_file(tmp_path)
-    target_dir = _doc_dir(doc_id)
-    target_path = str(target_dir / "lease.pdf")
-    if not os.path.exists(target_path):
-        shutil.copy(tmp_path, target_path)
-    risks = evaluate_general_risks(target_path)
-    return {"message": "File uploaded successfully.", "doc_id": doc_id, "risks": risks}
+    from backend.lease_chain import _compute_doc_id_for_file, _doc_dir, _temp_root, _atomic_copy_file
+    from backend.lease_chain import set_doc_index_mode
+    # Save to a unique temp path first so concurrent uploads don't clobber each other
+    fd, tmp_path = tempfile.mkstemp(dir=str(_temp_root()), prefix=".upload-", suffix=".pdf")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            shutil.copyfileobj(file.file, f)
+        # Compute doc_id and move to permanent location
+        doc_id = _compute_doc_id_for_file(tmp_path)
+        target_dir = _doc_dir(doc_id)
+        target_path = target_dir / "lease.pdf"
+        if not target_path.exists():
+            _atomic_copy_file(tmp_path, target_path)
+    finally:
+        os.unlink(tmp_path)
+    if index_mode is not None:
+        try:
+            set_doc_index_mode(doc_id, index_mode)
+        except ValueError as e:
+            return {"message": str(e), "doc_id": doc_id}
+    # Blocking work runs in the threadpool so other requests keep flowing;
+    # concurrent builds of the same doc are deduplicated in lease_chain.
+    risks = await run_in_threadpool(evaluate_general_risks, str(target_path))
+    # Set when the upload is a near-duplicate (re-save, re-scan, amendment) of
+    # an earlier document: which one, and which pages differ from it
+    lineage = get_document_lineage(doc_id)
+    return {"message": "File uploaded successfully.", "doc_id": doc_id, "risks": risks, "lineage": lineage}
 
 @app.post("/ask")
 async def ask_question(question: str = Form(...), doc_id: str | None = Form(default=None)):
     import os
-    from backend.lease_chain import _LATEST_DOC_ID, _doc_dir
-    effective_doc_id = doc_id or _LATEST_DOC_ID
+    from backend.lease_chain import get_latest_doc_id, _doc_dir
+    effective_doc_id = doc_id or get_latest_doc_id()
     if not effective_doc_id:
         return {"answer": "No document loaded yet. Please upload a PDF first."}
     pdf_path = str(_doc_dir(effective_doc_id) / "lease.pdf")
     if not os.path.exists(pdf_path):
         return {"answer": "Document not found on server. Please upload again."}
-    answer = run_rag_pipeline(pdf_path, question)
-    return {"answer": answer}
+    # Served from the partial index while a large lease is still being
+    # ingested; "coverage" says how many pages the answer could draw on
+    result = await run_in_threadpool(answer_question, pdf_path, question)
+    return {"answer": result["answer"], "coverage": result["coverage"]}
     
 from fastapi import Body
+from fastapi.responses import StreamingResponse
+import json
+
+@app.post("/ask-batch")
+async def ask_batch(
+    questions: list[str] = Form(...),
+    doc_id: str | None = Form(default=None),
+    stream: bool = Form(default=False),
+):
+    import os
+    from backend.lease_chain import get_latest_doc_id, _doc_dir, answer_questions_batch, iter_batch_answers
+    # Accept either repeated "questions" fields or a single JSON array
+    if len(questions) == 1 and questions[0].lstrip().startswith("["):
+        try:
+            questions = [str(q) for q in json.loads(questions[0])]
+        except ValueError:
+            pass
+    questions = [q for q in questions if q.strip()]
+    max_questions = int(os.getenv("LEASE_BATCH_MAX_QUESTIONS", "100"))
+    if not questions:
+        return {"answers": [], "message": "No questions provided."}
+    if len(questions) > max_questions:
+        return {"answers": [], "message": f"Too many questions; the limit is {max_questions} per batch."}
+    effective_doc_id = doc_id or get_latest_doc_id()
+    if not effective_doc_id:
+        return {"answers": [], "message": "No document loaded yet. Please upload a PDF first."}
+    pdf_path = str(_doc_dir(effective_doc_id) / "lease.pdf")
+    if not os.path.exists(pdf_path):
+        return {"answers": [], "message": "Document not found on server. Please upload again."}
+    if stream:
+        # One NDJSON line per answer, in completion order
+        def _lines():
+            for index, answer in iter_batch_answers(pdf_path, questions):
+                yield json.dumps({"index": index, "question": questions[index], "answer": answer}) + "\n"
+        return StreamingResponse(_lines(), media_type="application/x-ndjson")
+    answers = await run_in_threadpool(answer_questions_batch, pdf_path, questions)
+    return {"answers": [{"question": q, "answer": a} for q, a in zip(questions, answers)]}
 
 from backend.lease_chain import get_clauses_for_topic, detect_abnormalities
 
 @app.post("/abnormalities")
 async def fetch_abnormalities(doc_id: str | None = Form(default=None)):
     import os
-    from backend.lease_chain import _LATEST_DOC_ID, _doc_dir
-    effective_doc_id = doc_id or _LATEST_DOC_ID
+    from backend.lease_chain import get_latest_doc_id, _doc_dir
+    effective_doc_id = doc_id or get_latest_doc_id()
     if not effective_doc_id:
         return {"abnormalities": ["No document loaded yet. Please upload a PDF first."]}
     pdf_path = str(_doc_dir(effective_doc_id) / "lease.pdf")
     if not os.path.exists(pdf_path):
         return {"abnormalities": ["Document not found on server. Please upload again."]}
-    abnormalities = detect_abnormalities(pdf_path)
+    abnormalities = await run_in_threadpool(detect_abnormalities, pdf_path)
     print(abnormalities)
     return {"abnormalities": abnormalities}
 
 @app.post("/clauses")
 async def fetch_clauses(topic: str = Form(...), doc_id: str | None = Form(default=None)):
     import os
-    from backend.lease_chain import _LATEST_DOC_ID, _doc_dir
-    effective_doc_id = doc_id or _LATEST_DOC_ID
+    from backend.lease_chain import get_latest_doc_id, _doc_dir
+    effective_doc_id = doc_id or get_latest_doc_id()
     if not effective_doc_id:
         return {"clauses": ["No document loaded yet. Please upload a PDF first."]}
     pdf_path = str(_doc_dir(effective_doc_id) / "lease.pdf")
     if not os.path.exists(pdf_path):
         return {"clauses": ["Document not found on server. Please upload again."]}
     print("Topic:\n", topic)
-    clauses = get_clauses_for_topic(pdf_path, topic)
+    clauses = await run_in_threadpool(get_clauses_for_topic, pdf_path, topic)
     print(clauses)
     return {"clauses": clauses}
@@ -0,0 +1,149 @@
+"""Exercise backend.llm_dispatch against the local OpenAI stand-in.
+
+Starts the mock server in-process with 429 injection and checks, failing
+with a non-zero exit if any check does not hold:
+
+1. a burst of duplicate and distinct chat/embedding calls at both
+   priorities all succeed, and duplicates are coalesced into fewer model
+   requests;
+2. with a backlog of background calls queued, interactive calls submitted
+   afterwards finish first on average, and a queued background call that
+   an interactive caller joins (same key) is raised to interactive
+   priority instead of waiting out the backlog.
+
+    python -m backend.bench.dispatch_check --fail-rate 0.3 --burst 40
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+def _start_mock(port: int, fail_rate: float, retry_after: float, latency: float = 0.0):
+    from backend.bench.mock_openai import MockConfig, serve_in_thread
+
+    return serve_in_thread(MockConfig(fail_rate=fail_rate, retry_after=retry_after, latency=latency), port=port)
+
+
+def _run_jobs(jobs: list) -> tuple[list, list]:
+    """Run (level, fn) jobs on their own threads, in order; returns (finish times, errors)."""
+    from backend.llm_dispatch import priority
+
+    finished = [0.0] * len(jobs)
+
+    def run(i: int) -> None:
+        level, fn = jobs[i]
+        with priority(level):
+            fn()
+        finished[i] = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=len(jobs)) as pool:
+        futures = [pool.submit(run, i) for i in range(len(jobs))]
+        errors = [f.exception() for f in futures if f.exception() is not None]
+    return finished, errors
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8101)
+    parser.add_argument("--fail-rate", type=float, default=0.3)
+    parser.add_argument("--retry-after", type=float, default=0.2)
+    parser.add_argument("--latency", type=float, default=0.05, help="mock seconds per response")
+    parser.add_argument("--burst", type=int, default=40, help="calls per priority class")
+    parser.add_argument("--distinct", type=int, default=5, help="distinct prompts among the duplicate burst")
+    args = parser.parse_args()
+
+    os.environ["OPENAI_BASE_URL"] = f"http://127.0.0.1:{args.port}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-mock")
+    os.environ.setdefault("LEASE_CHAT_CONCURRENCY", "2")
+    server = _start_mock(args.port, args.fail_rate, args.retry_after, args.latency)
+
+    import httpx
+    from langchain_core.prompts import ChatPromptTemplate
+    from langchain_openai import ChatOpenAI, OpenAIEmbeddings
+    from backend.llm_dispatch import BACKGROUND, INTERACTIVE, DispatchedEmbeddings, dispatch_stats, dispatched_chat, get_dispatcher
+
+    prompt = ChatPromptTemplate.from_messages([("system", "You are a contract analyst."), ("human", "{q}")])
+    chain = prompt | dispatched_chat(ChatOpenAI(model="gpt-4o", temperature=0, max_retries=0), "gpt-4o")
+    # Token-id inputs would need tiktoken data; plain strings keep this offline
+    embeddings = DispatchedEmbeddings(
+        OpenAIEmbeddings(model="text-embedding-3-small", max_retries=0, check_embedding_ctx_length=False),
+        "text-embedding-3-small",
+    )
+    failures: list[str] = []
+
+    def mock_stats() -> dict:
+        return httpx.get(f"http://127.0.0.1:{args.port}/stats").json()
+
+    # 1. Duplicates, at both priorities, share one model request per key
+    def duplicate(i: int, level: int):
+        def fn() -> None:
+            chain.invoke({"q": f"question {i % args.distinct} (priority {level})"})
+            embeddings.embed_query(f"query {i % args.distinct}")
+        return level, fn
+
+    before = mock_stats()
+    started = time.perf_counter()
+    jobs = [duplicate(i, BACKGROUND) for i in range(args.burst)] + [duplicate(i, INTERACTIVE) for i in range(args.burst)]
+    _, errors = _run_jobs(jobs)
+    after = mock_stats()
+    served = {kind: after[kind] - before[kind] for kind in ("chat", "embeddings")}
+    retried = after["rate_limited"] - before["rate_limited"]
+    print(f"duplicates: {len(jobs)} jobs in {time.perf_counter() - started:.2f}s, {len(errors)} errors, "
+          f"mock served {served} (+{retried} rate limited)")
+    if errors:
+        failures.append(f"duplicate burst raised {errors[0]!r}")
+    if served["chat"] + served["embeddings"] - retried >= 2 * len(jobs):
+        failures.append("duplicates were not coalesced")
+
+    # 2. Interactive calls overtake a queued background backlog
+    chat = get_dispatcher("chat")
+    calls_before, boosted_before = chat.stats()["calls"], chat.stats()["boosted"]
+
+    def ask(text: str, level: int):
+        return level, lambda: chain.invoke({"q": text})
+
+    backlog = [ask(f"background {i}", BACKGROUND) for i in range(args.burst)] + [ask("shared", BACKGROUND)]
+    queued = threading.Thread(target=lambda: backlog_result.append(_run_jobs(backlog)))
+    backlog_result: list = []
+    submitted = time.perf_counter()
+    queued.start()
+    # Every backlog call, "shared" included, has reached the dispatcher
+    while chat.stats()["calls"] - calls_before < len(backlog) and time.perf_counter() - submitted < 10:
+        time.sleep(0.001)
+    interactive_submitted = time.perf_counter()
+    interactive, errors = _run_jobs([ask("shared", INTERACTIVE)] + [ask(f"interactive {i}", INTERACTIVE) for i in range(args.burst)])
+    queued.join()
+    background, background_errors = backlog_result[0]
+    errors += background_errors
+    # Background calls already running when the interactive ones arrived finish
+    # first regardless; compare against the ones that were still queued
+    late = [t for t in background[:-1] if t > interactive_submitted]
+    mean_interactive = sum(interactive) / len(interactive) - interactive_submitted
+    mean_background = sum(late) / max(1, len(late)) - interactive_submitted
+    shared_rank = sum(1 for t in late if t < background[-1])
+    print(f"backlog: {len(errors)} errors; after the interactive calls arrived, mean completion "
+          f"interactive {mean_interactive:.2f}s, queued background {mean_background:.2f}s")
+    boosted = chat.stats()["boosted"] - boosted_before
+    print(f"shared key: the joined background call finished ahead of {len(late) - shared_rank} "
+          f"of {len(late)} queued background calls (boosted {boosted})")
+    if errors:
+        failures.append(f"backlog raised {errors[0]!r}")
+    if mean_interactive >= mean_background:
+        failures.append("interactive calls did not finish ahead of queued background calls")
+    if boosted < 1 or shared_rank > len(late) // 2:
+        failures.append("joined background call was not raised to interactive priority")
+
+    print("dispatcher:", dispatch_stats())
+    print("mock server:", mock_stats())
+    server.should_exit = True
+    if failures:
+        raise SystemExit("FAILED: " + "; ".join(failures))
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,397 @@
+"""End-to-end HTTP load test of the API against the local OpenAI stand-in.
+
+Starts the mock server (backend.bench.mock_openai) in-process and the app
+under uvicorn as a subprocess, with a throwaway document store. It uploads
+a few generated leases, then drives mixed /upload, /ask, /clauses and
+/abnormalities traffic from --concurrency clients for --duration seconds.
+
+It reports:
+- per-endpoint p50/p95/p99 latency and throughput;
+- the RSS of every app worker, sampled from /proc;
+- the latency of /healthz, probed on a fixed interval. /healthz runs on the
+  event loop, so stalls there mean a handler is blocking the loop;
+- per-chain token usage, cached-token ratio and per-call overhead, from the
+  app's /admin/llm.
+
+    python -m backend.bench.load_test --concurrency 16 --duration 60
+    python -m backend.bench.load_test --workers 2 --latency 0.5 --tokens-per-sec 60 \\
+        --mix upload=1,ask=6,clauses=2,abnormalities=1 --json report.json
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+ENDPOINTS = ("upload", "ask", "clauses", "abnormalities")
+
+QUESTIONS = (
+    "What is the monthly base rent?",
+    "Who is responsible for roof repairs?",
+    "Can the tenant sublease the premises?",
+    "What are the renewal options?",
+    "What insurance must the tenant carry?",
+    "How much is the security deposit?",
+)
+TOPICS = ("rent", "insurance", "assignment", "Section 2.01", "maintenance", "default")
+
+_WORDS = (
+    "tenant landlord rent premises lease term renewal option insurance default notice assignment "
+    "sublease maintenance repair taxes operating expenses security deposit guarantor commencement"
+).split()
+
+
+def make_lease_pdf(path: Path, pages: int, seed: int) -> None:
+    """A synthetic lease with numbered clauses, distinct per seed."""
+    import pymupdf
+
+    rng = random.Random(seed)
+    doc = pymupdf.open()
+    for p in range(pages):
+        text = f"COMMERCIAL LEASE AGREEMENT {seed}\n"
+        for s in range(3):
+            body = " ".join(rng.choice(_WORDS) for _ in range(70))
+            text += f"\n{p + 1}.{s + 1:02d} {rng.choice(_WORDS).title()} Provisions\n{body}.\n"
+        text += f"\nPage {p + 1} of {pages}\n"
+        doc.new_page().insert_textbox(pymupdf.Rect(40, 40, 560, 800), text, fontsize=8)
+    doc.save(str(path))
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix: Dict[str, float] = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name.strip() not in ENDPOINTS:
+            raise argparse.ArgumentTypeError(f"unknown endpoint '{name}'; expected one of {', '.join(ENDPOINTS)}")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+
+def _rss_bytes(pid: int) -> Optional[int]:
+    try:
+        with open(f"/proc/{pid}/status") as fh:
+            for line in fh:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        return None
+    return None
+
+
+def _process_tree(root: int) -> List[int]:
+    """`root` and all its descendants, from /proc (Linux only)."""
+    parents: Dict[int, int] = {}
+    for entry in os.listdir("/proc") if os.path.isdir("/proc") else ():
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as fh:
+                # The command name may contain spaces; fields resume after ')'
+                parents[int(entry)] = int(fh.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    tree, frontier = [root], [root]
+    while frontier:
+        children = [pid for pid, ppid in parents.items() if ppid in frontier]
+        tree += children
+        frontier = children
+    return tree
+
+
+class MemorySampler(threading.Thread):
+    """Peak and last RSS of every process in the app's process tree."""
+
+    def __init__(self, root_pid: int, interval: float = 0.5):
+        super().__init__(name="rss-sampler", daemon=True)
+        self.root_pid = root_pid
+        self.interval = interval
+        self.peak: Dict[int, int] = {}
+        self.last: Dict[int, int] = {}
+        # Not `_stop`: that would shadow Thread._stop(), which join() calls
+        self._stop_event = threading.Event()
+
+    def sample(self) -> None:
+        for pid in _process_tree(self.root_pid):
+            rss = _rss_bytes(pid)
+            if rss is not None:
+                self.last[pid] = rss
+                self.peak[pid] = max(rss, self.peak.get(pid, 0))
+
+    def run(self) -> None:
+        while not self._stop_event.wait(self.interval):
+            self.sample()
+
+    def stop(self) -> Dict[str, Any]:
+        self._stop_event.set()
+        # No sample may land while the report is being read
+        self.join()
+        mb = 1024 * 1024
+        return {
+            str(pid): {
+                # With --workers > 1 the main process only supervises the workers
+                "role": "main" if pid == self.root_pid else "child",
+                "peak_mb": round(self.peak[pid] / mb, 1),
+                "last_mb": round(self.last.get(pid, 0) / mb, 1),
+            }
+            for pid in sorted(self.peak)
+        }
+
+
+def summarize(latencies: List[float]) -> Dict[str, Any]:
+    if not latencies:
+        return {"count": 0}
+    values = np.asarray(latencies)
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {
+        "count": int(values.size),
+        "mean_s": round(float(values.mean()), 4),
+        "p50_s": round(float(p50), 4),
+        "p95_s": round(float(p95), 4),
+        "p99_s": round(float(p99), 4),
+        "max_s": round(float(values.max()), 4),
+    }
+
+
+class LoadTest:
+    def __init__(self, args: argparse.Namespace, base_url: str, pdf_dir: Path):
+        self.args = args
+        self.base_url = base_url
+        self.pdf_dir = pdf_dir
+        self.rng = random.Random(args.seed)
+        self.doc_ids: List[str] = []
+        self.next_pdf = 0
+        self.results: Dict[str, List[float]] = {name: [] for name in ENDPOINTS}
+        self.errors: Dict[str, int] = {name: 0 for name in ENDPOINTS}
+        self.probe: List[float] = []
+
+    def _pdf(self) -> Path:
+        # Fresh documents until the pool is used up, then re-uploads
+        path = self.pdf_dir / f"lease-{self.next_pdf % self.args.upload_pool}.pdf"
+        self.next_pdf += 1
+        return path
+
+    async def request(self, client, name: str) -> None:
+        doc_id = self.rng.choice(self.doc_ids) if self.doc_ids else None
+        if name == "upload":
+            path = self._pdf()
+            call = client.post("/upload", files={"file": (path.name, path.read_bytes(), "application/pdf")})
+        elif name == "ask":
+            call = client.post("/ask", data={"question": self.rng.choice(QUESTIONS), "doc_id": doc_id})
+        elif name == "clauses":
+            call = client.post("/clauses", data={"topic": self.rng.choice(TOPICS), "doc_id": doc_id})
+        else:
+            call = client.post("/abnormalities", data={"doc_id": doc_id})
+        started = time.perf_counter()
+        try:
+            response = await call
+            ok = response.status_code == 200
+            if ok and name == "upload":
+                self.doc_ids.append(response.json()["doc_id"])
+        except Exception as e:
+            print(f"{name} failed: {e!r}")
+            ok = False
+        if ok:
+            self.results[name].append(time.perf_counter() - started)
+        else:
+            self.errors[name] += 1
+
+    async def client_loop(self, client, deadline: float) -> None:
+        names = list(self.args.mix)
+        weights = [self.args.mix[n] for n in names]
+        while time.perf_counter() < deadline:
+            await self.request(client, self.rng.choices(names, weights)[0])
+
+    async def probe_loop(self, client, deadline: float) -> None:
+        while time.perf_counter() < deadline:
+            started = time.perf_counter()
+            try:
+                await client.get("/healthz")
+                self.probe.append(time.perf_counter() - started)
+            except Exception:
+                pass
+            await asyncio.sleep(self.args.probe_interval)
+
+    async def run(self) -> Dict[str, Any]:
+        import httpx
+
+        limits = httpx.Limits(max_connections=self.args.concurrency + 2)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=self.args.timeout, limits=limits) as client:
+            # Setup: the docs that /ask, /clauses and /abnormalities target
+            setup_started = time.perf_counter()
+            await asyncio.gather(*(self.request(client, "upload") for _ in range(self.args.docs)))
+            setup = {"uploads": summarize(self.results["upload"]), "seconds": round(time.perf_counter() - setup_started, 2)}
+            if not self.doc_ids:
+                raise SystemExit("Setup uploads failed; is the app healthy?")
+            self.results["upload"].clear()
+            self.errors["upload"] = 0
+
+            started = time.perf_counter()
+            deadline = started + self.args.duration
+            await asyncio.gather(
+                self.probe_loop(client, deadline),
+                *(self.client_loop(client, deadline) for _ in range(self.args.concurrency)),
+            )
+            elapsed = time.perf_counter() - started
+            # From whichever worker answers; with --workers 1 that is all traffic
+            llm = (await client.get("/admin/llm")).json()
+        total = sum(len(v) for v in self.results.values())
+        stalls = sum(1 for v in self.probe if v > self.args.block_threshold)
+        return {
+            "setup": setup,
+            "duration_s": round(elapsed, 2),
+            "concurrency": self.args.concurrency,
+            "throughput_rps": round(total / elapsed, 2),
+            "endpoints": {
+                name: {**summarize(self.results[name]), "errors": self.errors[name], "rps": round(len(self.results[name]) / elapsed, 2)}
+                for name in self.args.mix
+            },
+            "llm_chains": llm.get("chains", {}),
+            "event_loop": {
+                **summarize(self.probe),
+                "threshold_s": self.args.block_threshold,
+                "stalls": stalls,
+                "blocking_suspected": stalls > 0,
+            },
+        }
+
+
+def _start_app(args: argparse.Namespace, store_dir: Path, mock_url: str) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "OPENAI_BASE_URL": mock_url,
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-mock"),
+        "LEASE_STORE_DIR": str(store_dir),
+        "LEASE_STATE_DB": str(store_dir / "state.sqlite3"),
+        # Keeps the run offline: no tiktoken encoding download
+        "LEASE_EMBED_CHECK_CTX": "0",
+    }
+    command = [
+        sys.executable, "-m", "uvicorn", "backend.app:app",
+        "--host", "127.0.0.1", "--port", str(args.port),
+        "--workers", str(args.workers), "--log-level", "warning",
+    ]
+    stdout = None if args.app_logs else subprocess.DEVNULL
+    return subprocess.Popen(command, cwd=str(Path(__file__).resolve().parents[2]), env=env, stdout=stdout)
+
+
+def _wait_until_up(url: str, proc: subprocess.Popen, timeout: float = 60.0) -> None:
+    import httpx
+
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"App exited with code {proc.returncode} during startup")
+        try:
+            if httpx.get(f"{url}/healthz", timeout=1.0).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise SystemExit(f"App did not come up within {timeout:.0f}s")
+
+
+def print_report(report: Dict[str, Any]) -> None:
+    print(f"\nSetup: {report['setup']['uploads'].get('count', 0)} uploads in {report['setup']['seconds']}s")
+    print(f"Load: {report['concurrency']} clients for {report['duration_s']}s, {report['throughput_rps']} req/s")
+    print(f"{'endpoint':<15}{'count':>7}{'errors':>8}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for name, s in report["endpoints"].items():
+        if not s["count"]:
+            print(f"{name:<15}{0:>7}{s['errors']:>8}")
+            continue
+        print(f"{name:<15}{s['count']:>7}{s['errors']:>8}{s['rps']:>8}{s['p50_s']:>9.3f}{s['p95_s']:>9.3f}{s['p99_s']:>9.3f}")
+    loop = report["event_loop"]
+    if loop.get("count"):
+        verdict = "BLOCKING SUSPECTED" if loop["blocking_suspected"] else "ok"
+        print(
+            f"Event loop (/healthz): p50 {loop['p50_s']:.4f}s p99 {loop['p99_s']:.4f}s max {loop['max_s']:.4f}s, "
+            f"{loop['stalls']} probe(s) over {loop['threshold_s']}s -> {verdict}"
+        )
+    for label, c in report.get("llm_chains", {}).items():
+        ratio = "n/a" if c["cached_ratio"] is None else f"{c['cached_ratio']:.0%}"
+        print(
+            f"chain {label}: {c['calls']} calls, {c['input_tokens']} input tokens ({ratio} cached), "
+            f"overhead {c['overhead_ms']:.2f} ms/call, model {c['model_ms']:.0f} ms/call"
+        )
+    for pid, mem in report.get("memory", {}).items():
+        print(f"{mem['role']} process {pid}: peak RSS {mem['peak_mb']} MB, last {mem['last_mb']} MB")
+    if "mock" in report:
+        print("mock server:", report["mock"])
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--port", type=int, default=8110, help="app port")
+    parser.add_argument("--mock-port", type=int, default=8111)
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn workers")
+    parser.add_argument("--concurrency", type=int, default=8, help="concurrent clients")
+    parser.add_argument("--duration", type=float, default=30.0, help="seconds of mixed traffic")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("upload=1,ask=6,clauses=2,abnormalities=1"))
+    parser.add_argument("--docs", type=int, default=3, help="documents uploaded before the load phase")
+    parser.add_argument("--pages", type=int, default=12, help="pages per generated lease")
+    parser.add_argument("--upload-pool", type=int, default=20, help="distinct leases to upload before repeating")
+    parser.add_argument("--latency", type=float, default=0.3, help="mock: seconds added to every model call")
+    parser.add_argument("--tokens-per-sec", type=float, default=80.0, help="mock: chat generation speed")
+    parser.add_argument("--embed-tokens-per-sec", type=float, default=0.0, help="mock: embedding input speed")
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="mock: probability of a 429")
+    parser.add_argument("--probe-interval", type=float, default=0.1)
+    parser.add_argument("--block-threshold", type=float, default=0.1, help="/healthz latency counted as a stall")
+    parser.add_argument("--timeout", type=float, default=300.0, help="per-request timeout")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--app-logs", action="store_true", help="show the app's output")
+    parser.add_argument("--json", help="also write the report to this file")
+    args = parser.parse_args()
+    args.upload_pool = max(args.upload_pool, args.docs)
+
+    from backend.bench.mock_openai import MockConfig, serve_in_thread
+
+    mock = serve_in_thread(
+        MockConfig(
+            fail_rate=args.fail_rate, retry_after=0.2, latency=args.latency,
+            tokens_per_sec=args.tokens_per_sec, embed_tokens_per_sec=args.embed_tokens_per_sec,
+        ),
+        port=args.mock_port,
+    )
+    mock_url = f"http://127.0.0.1:{args.mock_port}"
+    app_url = f"http://127.0.0.1:{args.port}"
+    with tempfile.TemporaryDirectory(prefix="lease-load-") as workdir:
+        store_dir, pdf_dir = Path(workdir) / "store", Path(workdir) / "pdfs"
+        store_dir.mkdir()
+        pdf_dir.mkdir()
+        for i in range(args.upload_pool):
+            make_lease_pdf(pdf_dir / f"lease-{i}.pdf", args.pages, seed=args.seed * 1000 + i)
+        proc = _start_app(args, store_dir, f"{mock_url}/v1")
+        try:
+            _wait_until_up(app_url, proc)
+            sampler = MemorySampler(proc.pid)
+            sampler.sample()
+            sampler.start()
+            report = asyncio.run(LoadTest(args, app_url, pdf_dir).run())
+            report["memory"] = sampler.stop()
+        finally:
+            proc.terminate()
+            try:
+                proc.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                proc.kill()
+    import httpx
+
+    report["mock"] = httpx.get(f"{mock_url}/stats").json()
+    mock.should_exit = True
+    print_report(report)
+    if args.json:
+        Path(args.json).write_text(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,230 @@
+"""Local stand-in for the OpenAI chat completions and embeddings APIs.
+
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:8100/v1 and any
+OPENAI_API_KEY. It can inject 429s, either randomly (--fail-rate) or by
+enforcing its own requests-per-minute limit (--rpm), to exercise the retry
+and pacing logic in backend.llm_dispatch. --latency and --tokens-per-sec
+make responses take roughly as long as the real API's, for load tests.
+
+    python -m backend.bench.mock_openai --port 8100 --fail-rate 0.2
+    python -m backend.bench.mock_openai --latency 0.4 --tokens-per-sec 80
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import random
+import threading
+import time
+import uuid
+from collections import deque
+from hashlib import sha256
+from typing import Any, Dict
+
+import numpy as np
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+EMBEDDING_DIM = 1536
+
+_RISK_REPLY = {
+    key: {"score": 7, "explanation": "Mock assessment."}
+    for key in (
+        "cash_flow_adjustments",
+        "future_cash_flow",
+        "inflation/interest_rate_exposure",
+        "use_and_exclusivity_clauses",
+        "default_and_termination_clauses",
+        "collateral_and_insurance",
+    )
+}
+_ABNORMALITY_REPLY = [{"text": "Mock: landlord bears roof replacement costs.", "impact": "harmful"}]
+
+
+class MockConfig:
+    def __init__(
+        self,
+        fail_rate: float = 0.0,
+        rpm: int = 0,
+        retry_after: float = 1.0,
+        latency: float = 0.0,
+        tokens_per_sec: float = 0.0,
+        embed_tokens_per_sec: float = 0.0,
+    ):
+        self.fail_rate = fail_rate
+        self.rpm = rpm
+        self.retry_after = retry_after
+        # Seconds before any response, then generation time for chat output
+        # and processing time for embedding input (0 = instant)
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.embed_tokens_per_sec = embed_tokens_per_sec
+
+    def delay(self, tokens: int, rate: float) -> float:
+        return self.latency + (tokens / rate if rate > 0 else 0.0)
+
+
+def _approx_tokens(value: Any) -> int:
+    if isinstance(value, str):
+        return max(1, len(value) // 4)
+    if isinstance(value, list):
+        # Pre-tokenized input (langchain sends token ids for embeddings)
+        if value and isinstance(value[0], int):
+            return len(value)
+        return sum(_approx_tokens(v) for v in value)
+    return 1
+
+
+def _embedding_for(item: Any) -> np.ndarray:
+    seed = int.from_bytes(sha256(json.dumps(item).encode("utf-8")).digest()[:8], "little")
+    vec = np.random.default_rng(seed).normal(size=EMBEDDING_DIM).astype(np.float32)
+    return vec / np.linalg.norm(vec)
+
+
+def _chat_reply(messages: list) -> str:
+    system = " ".join(m.get("content", "") for m in messages if m.get("role") == "system")
+    if "score the lease" in system:
+        return json.dumps(_RISK_REPLY)
+    if "unusual, uncommon, or non-standard" in system:
+        return json.dumps(_ABNORMALITY_REPLY)
+    return "Mock answer based on the provided lease context."
+
+
+def create_app(config: MockConfig) -> FastAPI:
+    app = FastAPI()
+    lock = threading.Lock()
+    recent: deque[float] = deque()
+    stats: Dict[str, int] = {"chat": 0, "embeddings": 0, "rate_limited": 0}
+
+    def _rate_limited() -> JSONResponse | None:
+        now = time.monotonic()
+        with lock:
+            while recent and now - recent[0] > 60:
+                recent.popleft()
+            limited = random.random() < config.fail_rate or (config.rpm and len(recent) >= config.rpm)
+            if limited:
+                stats["rate_limited"] += 1
+            else:
+                recent.append(now)
+        if not limited:
+            return None
+        return JSONResponse(
+            status_code=429,
+            headers={"retry-after": str(config.retry_after)},
+            content={"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+        )
+
+    # Prompt-cache simulation: like OpenAI, a request whose first 1024+
+    # tokens repeat an earlier request's reports the longest repeated prefix,
+    # in 128-token steps, as cached
+    seen_prefixes: set[str] = set()
+
+    def _cached_tokens(messages: list) -> int:
+        text = json.dumps([(m.get("role"), m.get("content", "")) for m in messages])
+        steps = [n for n in range(1024, len(text) // 4 + 1, 128)]
+        keys = [sha256(text[:n * 4].encode("utf-8")).hexdigest() for n in steps]
+        with lock:
+            cached = max((n for n, key in zip(steps, keys) if key in seen_prefixes), default=0)
+            seen_prefixes.update(keys)
+        return cached
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        limited = _rate_limited()
+        if limited is not None:
+            return limited
+        body = await request.json()
+        with lock:
+            stats["chat"] += 1
+        content = _chat_reply(body.get("messages", []))
+        prompt_tokens = _approx_tokens([m.get("content", "") for m in body.get("messages", [])])
+        completion_tokens = _approx_tokens(content)
+        cached_tokens = _cached_tokens(body.get("messages", []))
+        await asyncio.sleep(config.delay(completion_tokens, config.tokens_per_sec))
+        return {
+            "id": f"chatcmpl-{uuid.uuid4().hex[:12]}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": content}, "finish_reason": "stop"}],
+            "usage": {
+                "prompt_tokens": prompt_tokens,
+                "completion_tokens": completion_tokens,
+                "total_tokens": prompt_tokens + completion_tokens,
+                "prompt_tokens_details": {"cached_tokens": min(cached_tokens, prompt_tokens)},
+            },
+        }
+
+    @app.post("/v1/embeddings")
+    async def embeddings(request: Request):
+        limited = _rate_limited()
+        if limited is not None:
+            return limited
+        body = await request.json()
+        with lock:
+            stats["embeddings"] += 1
+        inputs = body.get("input")
+        if isinstance(inputs, str) or (isinstance(inputs, list) and inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        data = []
+        for i, item in enumerate(inputs or []):
+            vec = _embedding_for(item)
+            if body.get("encoding_format") == "base64":
+                embedding: Any = base64.b64encode(vec.tobytes()).decode("ascii")
+            else:
+                embedding = vec.tolist()
+            data.append({"object": "embedding", "index": i, "embedding": embedding})
+        tokens = _approx_tokens(inputs or [])
+        await asyncio.sleep(config.delay(tokens, config.embed_tokens_per_sec))
+        return {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "mock"),
+            "usage": {"prompt_tokens": tokens, "total_tokens": tokens},
+        }
+
+    @app.get("/stats")
+    def get_stats():
+        with lock:
+            return dict(stats)
+
+    return app
+
+
+def serve_in_thread(config: MockConfig, host: str = "127.0.0.1", port: int = 8100):
+    """Run the mock in a daemon thread; returns the uvicorn server once it is up."""
+    import uvicorn
+
+    server = uvicorn.Server(uvicorn.Config(create_app(config), host=host, port=port, log_level="warning"))
+    thread = threading.Thread(target=server.run, name="mock-openai", daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"Mock OpenAI server failed to start on {host}:{port}")
+        time.sleep(0.05)
+    return server
+
+
+def main() -> None:
+    import uvicorn
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--fail-rate", type=float, default=0.0, help="probability of answering 429")
+    parser.add_argument("--rpm", type=int, default=0, help="server-side requests/minute before 429 (0 = unlimited)")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After seconds sent with 429s")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every response")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0, help="chat generation speed (0 = instant)")
+    parser.add_argument("--embed-tokens-per-sec", type=float, default=0.0, help="embedding input speed (0 = instant)")
+    args = parser.parse_args()
+    app = create_app(MockConfig(
+        args.fail_rate, args.rpm, args.retry_after, args.latency, args.tokens_per_sec, args.embed_tokens_per_sec,
+    ))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,193 @@
+"""Latency of HybridRetriever against the langchain ensemble it replaced.
+
+Both retrievers get the same FAISS store and the same queries. The
+ensemble is rebuilt exactly as lease_chain used to build it: MMR FAISS and
+BM25 run one after the other, then EnsembleRetriever fuses them and
+EmbeddingsFilter re-embeds every fused chunk. Embeddings come from a
+deterministic local model. --embed-latency adds a simulated network
+round-trip per embedding call, which the hybrid retriever overlaps with
+BM25. Chunks come from a synthetic lease corpus, or from stored documents
+with --doc-id.
+
+    python -m backend.bench.retrieval_benchmark --chunks 400 --queries 100
+    python -m backend.bench.retrieval_benchmark --embed-latency 0.05 --doc-id <md5>
+"""
+from __future__ import annotations
+
+import argparse
+import random
+import threading
+import time
+from hashlib import blake2b
+from typing import List
+
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from backend.hybrid_retrieval import BM25_K, DENSE_K, FETCH_K, FILTER_K, FILTER_THRESHOLD, WEIGHTS, HybridRetriever
+
+_WORDS = (
+    "tenant landlord rent premises lease term renewal option insurance default notice assignment sublease "
+    "maintenance repair taxes operating expenses security deposit guarantor commencement roof hvac "
+    "structure escalation cpi percent annual base additional utilities parking signage exclusive use"
+).split()
+_QUESTIONS = (
+    "What is the annual base rent escalation?",
+    "Who pays for roof and hvac repairs?",
+    "Can the tenant assign or sublease the premises?",
+    "What insurance must the tenant maintain?",
+    "How large is the security deposit and is there a guarantor?",
+    "What renewal options does the tenant have?",
+    "Which operating expenses and taxes does the tenant pay?",
+    "What are the default and notice provisions?",
+)
+
+
+class LocalEmbeddings(Embeddings):
+    """Deterministic bag-of-words embeddings: texts sharing words point the same way."""
+
+    def __init__(self, dim: int = 1536, latency: float = 0.0):
+        self.dim = dim
+        self.latency = latency
+        self.calls = 0
+        self.texts = 0
+        self._lock = threading.Lock()
+        self._word_vectors: dict[str, np.ndarray] = {}
+
+    def _word(self, word: str) -> np.ndarray:
+        vec = self._word_vectors.get(word)
+        if vec is None:
+            seed = int.from_bytes(blake2b(word.encode("utf-8"), digest_size=8).digest(), "little")
+            vec = np.random.default_rng(seed).normal(size=self.dim).astype(np.float32)
+            self._word_vectors[word] = vec
+        return vec
+
+    def _embed(self, text: str) -> List[float]:
+        words = [w.strip(".,?;:").lower() for w in text.split()] or [""]
+        vec = np.sum([self._word(w) for w in words], axis=0)
+        return (vec / (np.linalg.norm(vec) or 1.0)).tolist()
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        with self._lock:
+            self.calls += 1
+            self.texts += len(texts)
+        time.sleep(self.latency)
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def synthetic_chunks(count: int, seed: int) -> List[str]:
+    # Each chunk leans towards one question's topic so the similarity filter
+    # keeps something, as it does on real leases
+    rng = random.Random(seed)
+    chunks = []
+    for i in range(count):
+        topic = rng.choice(_QUESTIONS).rstrip("?").split()
+        words = [rng.choice(topic if rng.random() < 0.4 else _WORDS) for _ in range(rng.randint(80, 160))]
+        chunks.append(f"{i // 3 + 1}.{i % 3 + 1:02d} " + " ".join(words))
+    return chunks
+
+
+def stored_chunks(doc_ids: List[str]) -> List[str]:
+    from backend.lease_chain import _load_chunks_json
+
+    texts: List[str] = []
+    for doc_id in doc_ids:
+        texts += [d.page_content for d in _load_chunks_json(doc_id) or []]
+    return texts
+
+
+def langchain_ensemble(vs, docs, embeddings):
+    """The retriever lease_chain built before HybridRetriever."""
+    from langchain_community.retrievers import BM25Retriever
+    from langchain.retrievers.ensemble import EnsembleRetriever
+    from langchain.retrievers.document_compressors import EmbeddingsFilter
+    from langchain.retrievers.contextual_compression import ContextualCompressionRetriever
+
+    emb_retriever = vs.as_retriever(search_type="mmr", search_kwargs={"k": DENSE_K, "fetch_k": FETCH_K})
+    bm25 = BM25Retriever.from_documents(docs)
+    bm25.k = BM25_K
+    ensemble = EnsembleRetriever(retrievers=[emb_retriever, bm25], weights=list(WEIGHTS))
+    filter = EmbeddingsFilter(embeddings=embeddings, k=FILTER_K, similarity_threshold=FILTER_THRESHOLD)
+    return ContextualCompressionRetriever(base_compressor=filter, base_retriever=ensemble)
+
+
+def timed(retriever, queries: List[str], embeddings: LocalEmbeddings) -> dict:
+    latencies, results = [], []
+    calls, texts = embeddings.calls, embeddings.texts
+    for query in queries:
+        started = time.perf_counter()
+        docs = retriever.invoke(query)
+        latencies.append(time.perf_counter() - started)
+        results.append([d.page_content for d in docs])
+    ms = np.asarray(latencies) * 1000
+    return {
+        "p50": float(np.percentile(ms, 50)),
+        "p95": float(np.percentile(ms, 95)),
+        "mean": float(ms.mean()),
+        "calls": (embeddings.calls - calls) / len(queries),
+        "texts": (embeddings.texts - texts) / len(queries),
+        "results": results,
+    }
+
+
+def main() -> None:
+    from langchain.schema import Document
+    from langchain_community.vectorstores import FAISS
+
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--doc-id", action="append", default=[], help="use stored document chunks (repeatable)")
+    parser.add_argument("--chunks", type=int, default=400, help="synthetic chunks")
+    parser.add_argument("--queries", type=int, default=100)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="simulated seconds per embedding call")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    texts = stored_chunks(args.doc_id) if args.doc_id else synthetic_chunks(args.chunks, args.seed)
+    rng = random.Random(args.seed)
+    queries = [rng.choice(_QUESTIONS) + f" ({i})" for i in range(args.queries)]
+
+    embeddings = LocalEmbeddings(args.dim, latency=0.0)
+    docs = [Document(page_content=t, metadata={"chunk": i}) for i, t in enumerate(texts)]
+    vs = FAISS.from_documents(docs, embeddings)
+    embeddings.latency = args.embed_latency
+
+    built = time.perf_counter()
+    ensemble = langchain_ensemble(vs, docs, embeddings)
+    ensemble_build = time.perf_counter() - built
+    built = time.perf_counter()
+    hybrid = HybridRetriever.from_vectorstore(vs, embeddings)
+    hybrid_build = time.perf_counter() - built
+
+    # Warm both (imports, BM25 caches) before timing
+    ensemble.invoke(queries[0])
+    hybrid.invoke(queries[0])
+    old = timed(ensemble, queries, embeddings)
+    new = timed(hybrid, queries, embeddings)
+    batch_started = time.perf_counter()
+    hybrid.search_batch(queries)
+    batch_ms = (time.perf_counter() - batch_started) * 1000 / len(queries)
+
+    overlap = np.mean([
+        len(set(a) & set(b)) / len(set(a) | set(b)) if a or b else 1.0 for a, b in zip(old["results"], new["results"])
+    ])
+    hits = np.mean([len(r) for r in new["results"]])
+    print(f"{len(texts)} chunks x {args.dim} dims, {len(queries)} queries, embed latency {args.embed_latency * 1000:.0f} ms")
+    header = f"{'retriever':<22}{'build ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'mean ms':>9}{'embed calls/q':>15}{'texts/q':>9}"
+    print(header)
+    print("-" * len(header))
+    for label, build, stats in (("langchain ensemble", ensemble_build, old), ("HybridRetriever", hybrid_build, new)):
+        print(
+            f"{label:<22}{build * 1000:>10.1f}{stats['p50']:>9.2f}{stats['p95']:>9.2f}{stats['mean']:>9.2f}"
+            f"{stats['calls']:>15.1f}{stats['texts']:>9.1f}"
+        )
+    print(f"{'  search_batch':<22}{'':>10}{'':>9}{'':>9}{batch_ms:>9.2f}{1 / len(queries):>15.2f}{1.0:>9.1f}")
+    print(f"\nspeed-up (mean): {old['mean'] / new['mean']:.1f}x; {hits:.1f} hits per query; "
+          f"result overlap with the ensemble (Jaccard): {overlap:.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,258 @@
+"""Document state shared across API workers.
+
+Uvicorn workers (and containers mounting the same volume) each have their own
+memory, so anything that must be visible to every worker -- the "latest
+uploaded document" pointer and per-document bookkeeping -- lives in a small
+SQLite database next to the document store instead of in module globals.
+"""
+from __future__ import annotations
+
+import os
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from pathlib import Path
+from typing import Any, Dict, List, Optional
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pointers (
+    name TEXT PRIMARY KEY,
+    doc_id TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS documents (
+    doc_id TEXT PRIMARY KEY,
+    status TEXT NOT NULL DEFAULT 'uploaded',
+    created_at REAL NOT NULL,
+    last_access REAL NOT NULL,
+    access_count INTEGER NOT NULL DEFAULT 0,
+    index_mode TEXT,
+    effective_index_mode TEXT,
+    storage TEXT NOT NULL DEFAULT 'full',
+    stored_bytes INTEGER
+);
+CREATE INDEX IF NOT EXISTS documents_last_access ON documents(last_access);
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT PRIMARY KEY,
+    value INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS fingerprint_buckets (
+    bucket TEXT NOT NULL,
+    doc_id TEXT NOT NULL,
+    PRIMARY KEY (bucket, doc_id)
+);
+CREATE INDEX IF NOT EXISTS fingerprint_buckets_doc ON fingerprint_buckets(doc_id);
+"""
+
+_local = threading.local()
+
+
+def _db_path() -> Path:
+    override = os.getenv("LEASE_STATE_DB")
+    if override:
+        return Path(override)
+    temp_dir = Path(os.getenv("LEASE_STORE_DIR") or Path(__file__).resolve().parents[1] / "temp")
+    temp_dir.mkdir(parents=True, exist_ok=True)
+    return temp_dir / "state.sqlite3"
+
+
+def _connect() -> sqlite3.Connection:
+    # One connection per thread; sqlite3 connections must not be shared
+    path = str(_db_path())
+    conn = getattr(_local, "conn", None)
+    if conn is not None and getattr(_local, "path", None) == path:
+        return conn
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+    conn.row_factory = sqlite3.Row
+    # WAL lets readers in other workers proceed while one worker writes
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(_SCHEMA)
+    _migrate_schema(conn)
+    _local.conn = conn
+    _local.path = path
+    return conn
+
+
+def _migrate_schema(conn: sqlite3.Connection) -> None:
+    # Columns added after the first release; CREATE TABLE IF NOT EXISTS
+    # leaves older databases untouched
+    existing = {row["name"] for row in conn.execute("PRAGMA table_info(documents)")}
+    for column, decl in (
+        ("index_mode", "TEXT"),
+        ("effective_index_mode", "TEXT"),
+        ("storage", "TEXT NOT NULL DEFAULT 'full'"),
+        ("stored_bytes", "INTEGER"),
+    ):
+        if column not in existing:
+            try:
+                conn.execute(f"ALTER TABLE documents ADD COLUMN {column} {decl}")
+            except sqlite3.OperationalError:
+                # Another worker added it first
+                pass
+
+
+@contextmanager
+def _transaction(conn: sqlite3.Connection):
+    # Connections run in autocommit mode; group multi-statement writes
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        yield
+    except BaseException:
+        conn.execute("ROLLBACK")
+        raise
+    conn.execute("COMMIT")
+
+
+def set_latest_doc_id(doc_id: str) -> None:
+    now = time.time()
+    conn = _connect()
+    conn.execute(
+        "INSERT INTO pointers(name, doc_id, updated_at) VALUES('latest', ?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET doc_id = excluded.doc_id, updated_at = excluded.updated_at",
+        (doc_id, now),
+    )
+    touch_document(doc_id)
+
+
+def get_latest_doc_id() -> Optional[str]:
+    row = _connect().execute("SELECT doc_id FROM pointers WHERE name = 'latest'").fetchone()
+    return row["doc_id"] if row else None
+
+
+def touch_document(doc_id: str) -> None:
+    """Record an access, registering the document on first sight."""
+    now = time.time()
+    _connect().execute(
+        "INSERT INTO documents(doc_id, created_at, last_access, access_count) VALUES(?, ?, ?, 1) "
+        "ON CONFLICT(doc_id) DO UPDATE SET last_access = excluded.last_access, "
+        "access_count = documents.access_count + 1",
+        (doc_id, now, now),
+    )
+
+
+def set_document_status(doc_id: str, status: str) -> None:
+    now = time.time()
+    _connect().execute(
+        "INSERT INTO documents(doc_id, status, created_at, last_access) VALUES(?, ?, ?, ?) "
+        "ON CONFLICT(doc_id) DO UPDATE SET status = excluded.status",
+        (doc_id, status, now, now),
+    )
+
+
+def set_index_mode(doc_id: str, index_mode: str) -> None:
+    now = time.time()
+    _connect().execute(
+        "INSERT INTO documents(doc_id, created_at, last_access, index_mode) VALUES(?, ?, ?, ?) "
+        "ON CONFLICT(doc_id) DO UPDATE SET index_mode = excluded.index_mode",
+        (doc_id, now, now, index_mode),
+    )
+
+
+def set_effective_index_mode(doc_id: str, index_mode: str) -> None:
+    """Record the mode actually built, which differs from the requested
+    index_mode when pq falls back to sq8 on small documents."""
+    now = time.time()
+    _connect().execute(
+        "INSERT INTO documents(doc_id, created_at, last_access, effective_index_mode) VALUES(?, ?, ?, ?) "
+        "ON CONFLICT(doc_id) DO UPDATE SET effective_index_mode = excluded.effective_index_mode",
+        (doc_id, now, now, index_mode),
+    )
+
+
+def get_document(doc_id: str) -> Optional[Dict[str, Any]]:
+    row = _connect().execute("SELECT * FROM documents WHERE doc_id = ?", (doc_id,)).fetchone()
+    return dict(row) if row else None
+
+
+def recent_doc_ids(limit: int) -> List[str]:
+    if limit <= 0:
+        return []
+    rows = _connect().execute(
+        "SELECT doc_id FROM documents ORDER BY last_access DESC LIMIT ?", (limit,)
+    ).fetchall()
+    return [r["doc_id"] for r in rows]
+
+
+def set_storage(doc_id: str, storage: str, stored_bytes: Optional[int]) -> None:
+    """Record how much of a doc is on disk: 'full', 'compact' or 'evicted'."""
+    now = time.time()
+    _connect().execute(
+        "INSERT INTO documents(doc_id, created_at, last_access, storage, stored_bytes) VALUES(?, ?, ?, ?, ?) "
+        "ON CONFLICT(doc_id) DO UPDATE SET storage = excluded.storage, stored_bytes = excluded.stored_bytes",
+        (doc_id, now, now, storage, stored_bytes),
+    )
+
+
+def unsized_doc_ids() -> List[str]:
+    rows = _connect().execute(
+        "SELECT doc_id FROM documents WHERE stored_bytes IS NULL AND storage != 'evicted'"
+    ).fetchall()
+    return [r["doc_id"] for r in rows]
+
+
+def storage_totals() -> Dict[str, Dict[str, int]]:
+    rows = _connect().execute(
+        "SELECT storage, COUNT(*) AS docs, COALESCE(SUM(stored_bytes), 0) AS bytes FROM documents GROUP BY storage"
+    ).fetchall()
+    return {r["storage"]: {"docs": r["docs"], "bytes": r["bytes"]} for r in rows}
+
+
+def coldest_documents(storages: tuple[str, ...]) -> List[Dict[str, Any]]:
+    """Documents in the given storage states, least recently used first."""
+    marks = ", ".join("?" for _ in storages)
+    rows = _connect().execute(
+        f"SELECT doc_id, storage, stored_bytes, last_access, status FROM documents "
+        f"WHERE storage IN ({marks}) ORDER BY last_access ASC",
+        storages,
+    ).fetchall()
+    return [dict(r) for r in rows]
+
+
+def increment_counter(name: str, by: int = 1) -> None:
+    _connect().execute(
+        "INSERT INTO counters(name, value) VALUES(?, ?) "
+        "ON CONFLICT(name) DO UPDATE SET value = counters.value + excluded.value",
+        (name, by),
+    )
+
+
+def get_counters() -> Dict[str, int]:
+    return {r["name"]: r["value"] for r in _connect().execute("SELECT name, value FROM counters")}
+
+
+def set_fingerprint_buckets(doc_id: str, buckets: List[str]) -> None:
+    """Replace a document's LSH buckets (see backend.fingerprint)."""
+    conn = _connect()
+    with _transaction(conn):
+        conn.execute("DELETE FROM fingerprint_buckets WHERE doc_id = ?", (doc_id,))
+        conn.executemany(
+            "INSERT OR IGNORE INTO fingerprint_buckets(bucket, doc_id) VALUES(?, ?)",
+            [(bucket, doc_id) for bucket in buckets],
+        )
+
+
+def fingerprint_candidates(buckets: List[str], exclude: str, created_before: Optional[float] = None) -> Dict[str, int]:
+    """Documents sharing at least one bucket, with the number of buckets shared.
+
+    With created_before, only documents registered earlier than that time.
+    """
+    if not buckets:
+        return {}
+    marks = ", ".join("?" for _ in buckets)
+    params: tuple = (*buckets, exclude)
+    older = ""
+    if created_before is not None:
+        older = "AND doc_id IN (SELECT doc_id FROM documents WHERE created_at < ?) "
+        params += (created_before,)
+    rows = _connect().execute(
+        f"SELECT doc_id, COUNT(*) AS shared FROM fingerprint_buckets "
+        f"WHERE bucket IN ({marks}) AND doc_id != ? {older}GROUP BY doc_id ORDER BY shared DESC",
+        params,
+    ).fetchall()
+    return {r["doc_id"]: r["shared"] for r in rows}
+
+
+def remove_fingerprint(doc_id: str) -> None:
+    _connect().execute("DELETE FROM fingerprint_buckets WHERE doc_id = ?", (doc_id,))
@@ -0,0 +1,273 @@
+"""Disk management for the temp/ document store.
+
+Every upload gets a temp/<doc_id>/ directory. This module keeps the store
+within a byte quota:
+
+- JSON sidecars are written gzip-compressed and read back transparently,
+  whichever form is on disk (LEASE_COMPRESS_SIDECARS=0 writes plain JSON);
+- per-document sizes live in doc_state next to last-access times, so quota
+  checks and the admin report need no directory walk;
+- when the store grows past LEASE_STORE_QUOTA (e.g. "5G"; unset or 0 means
+  unlimited), the least recently used documents are evicted. In the default
+  "compact" mode a cold doc first drops down to its PDF and small derived
+  artifacts, and whole documents are deleted only if that is not enough.
+  LEASE_EVICT_MODE=full skips the compact tier.
+
+What a compact document keeps, and how to evict one, is decided by
+lease_chain, which owns the per-document build lock.
+"""
+from __future__ import annotations
+
+import atexit
+import gzip
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Optional
+
+from backend import doc_state
+
+_UNITS = {"": 1, "K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+
+_ENFORCE_LOCK = threading.Lock()
+
+
+def compression_enabled() -> bool:
+    return os.getenv("LEASE_COMPRESS_SIDECARS", "1") != "0"
+
+
+def parse_bytes(value: str) -> int:
+    """Parse "1048576", "500M", "2G" or "1.5GB" into bytes."""
+    match = re.fullmatch(r"\s*(\d+(?:\.\d+)?)\s*([KMGT]?)(?:i?B)?\s*", value or "", re.IGNORECASE)
+    if not match:
+        raise ValueError(f"Invalid byte size '{value}'")
+    return int(float(match.group(1)) * _UNITS[match.group(2).upper()])
+
+
+def quota_bytes() -> int:
+    try:
+        return parse_bytes(os.getenv("LEASE_STORE_QUOTA", "0"))
+    except ValueError as e:
+        print("Ignoring LEASE_STORE_QUOTA:", e)
+        return 0
+
+
+def evict_mode() -> str:
+    return "full" if os.getenv("LEASE_EVICT_MODE", "compact") == "full" else "compact"
+
+
+def atomic_write_bytes(path: Path, data: bytes) -> None:
+    """Write via a temp file in the same directory and rename into place."""
+    fd, tmp = tempfile.mkstemp(dir=str(path.parent), prefix=f".{path.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as fh:
+            fh.write(data)
+            fh.flush()
+            os.fsync(fh.fileno())
+        os.replace(tmp, path)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+
+def _gz_path(path: Path) -> Path:
+    return path.with_name(path.name + ".gz")
+
+
+def sidecar_file(path: Path) -> Optional[Path]:
+    """The file actually holding JSON sidecar `path` (compressed or not), if any."""
+    for candidate in (_gz_path(path), path):
+        if candidate.exists():
+            return candidate
+    return None
+
+
+def sidecar_mtime(path: Path) -> Optional[int]:
+    found = sidecar_file(path)
+    try:
+        return found.stat().st_mtime_ns if found is not None else None
+    except OSError:
+        return None
+
+
+def write_json(path: Path, obj: Any) -> None:
+    data = json.dumps(obj).encode("utf-8")
+    if compression_enabled():
+        # Low level: sidecars are mostly text and compress well even at 1
+        atomic_write_bytes(_gz_path(path), gzip.compress(data, compresslevel=1))
+        stale = path
+    else:
+        atomic_write_bytes(path, data)
+        stale = _gz_path(path)
+    stale.unlink(missing_ok=True)
+
+
+def read_json(path: Path) -> Optional[Any]:
+    """Load JSON sidecar `path`, or None if it is absent in either form."""
+    found = sidecar_file(path)
+    if found is None:
+        return None
+    data = found.read_bytes()
+    if found.suffix == ".gz":
+        data = gzip.decompress(data)
+    return json.loads(data)
+
+
+def remove_sidecar(path: Path) -> None:
+    for candidate in (path, _gz_path(path)):
+        candidate.unlink(missing_ok=True)
+
+
+def dir_bytes(folder: Path) -> int:
+    total = 0
+    try:
+        entries = list(os.scandir(folder))
+    except OSError:
+        return 0
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False):
+                total += dir_bytes(Path(entry.path))
+            else:
+                total += entry.stat(follow_symlinks=False).st_size
+        except OSError:
+            # Removed concurrently (temp files, staging dirs)
+            continue
+    return total
+
+
+def record_size(doc_id: str, folder: Path, storage: str = "full") -> int:
+    size = dir_bytes(folder)
+    try:
+        doc_state.set_storage(doc_id, storage, size)
+    except Exception as e:
+        print("Failed to record document size:", e)
+    return size
+
+
+LOOKUP_KINDS = ("memory", "disk", "build", "restore", "partial")
+# Lookups are counted in process and written to doc_state in batches (on the
+# first lookup 5 s after the last write, every 100 lookups, and at exit), so a
+# cache hit costs no SQLite write. The admin report flushes its own worker.
+_LOOKUP_FLUSH_SECONDS = 5.0
+_LOOKUP_FLUSH_COUNT = 100
+_LOOKUPS_LOCK = threading.Lock()
+_LOOKUPS_PENDING: Dict[str, int] = {}
+_LOOKUPS_FLUSHED_AT = time.monotonic()
+
+
+def record_lookup(kind: str) -> None:
+    """Count how a document lookup was served: memory, disk, build, restore
+    or partial (from a snapshot while the doc is still being ingested)."""
+    with _LOOKUPS_LOCK:
+        _LOOKUPS_PENDING[kind] = _LOOKUPS_PENDING.get(kind, 0) + 1
+        due = (
+            sum(_LOOKUPS_PENDING.values()) >= _LOOKUP_FLUSH_COUNT
+            or time.monotonic() - _LOOKUPS_FLUSHED_AT >= _LOOKUP_FLUSH_SECONDS
+        )
+    if due:
+        flush_lookups()
+
+
+def flush_lookups() -> None:
+    """Write this process's pending lookup counts to doc_state."""
+    global _LOOKUPS_FLUSHED_AT
+    with _LOOKUPS_LOCK:
+        pending = dict(_LOOKUPS_PENDING)
+        _LOOKUPS_PENDING.clear()
+        _LOOKUPS_FLUSHED_AT = time.monotonic()
+    for kind, count in pending.items():
+        try:
+            doc_state.increment_counter(f"doc_cache.{kind}", count)
+        except Exception as e:
+            print("Failed to record cache lookups:", e)
+
+
+atexit.register(flush_lookups)
+
+
+def used_bytes() -> int:
+    totals = doc_state.storage_totals()
+    return sum(t["bytes"] for storage, t in totals.items() if storage != "evicted")
+
+
+def enforce_quota(evict: Callable[[str, str], int], protect: Iterable[str] = ()) -> Dict[str, Any]:
+    """Evict least recently used documents until the store fits the quota.
+
+    `evict(doc_id, storage)` shrinks a doc to "compact" or deletes it
+    ("evicted") and returns the bytes freed. Docs in `protect` and docs
+    being built are skipped. Only one enforcement runs per process at a time.
+    """
+    quota = quota_bytes()
+    report: Dict[str, Any] = {"quota_bytes": quota, "compacted": [], "evicted": [], "bytes_freed": 0}
+    if quota <= 0 or not _ENFORCE_LOCK.acquire(blocking=False):
+        return report
+    try:
+        used = used_bytes()
+        report["used_before"] = used
+        protected = set(protect)
+        passes = [(("full",), "compact"), (("compact", "full"), "evicted")]
+        if evict_mode() == "full":
+            passes = [(("compact", "full"), "evicted")]
+        for storages, target in passes:
+            for doc in doc_state.coldest_documents(storages):
+                if used <= quota:
+                    break
+                if doc["doc_id"] in protected or doc["status"] == "building":
+                    continue
+                try:
+                    freed = evict(doc["doc_id"], target)
+                except Exception as e:
+                    print(f"Eviction of {doc['doc_id']} failed:", e)
+                    continue
+                used -= freed
+                report["bytes_freed"] += freed
+                report["compacted" if target == "compact" else "evicted"].append(doc["doc_id"])
+                doc_state.increment_counter(f"evictions.{target}")
+                doc_state.increment_counter("evictions.bytes_freed", freed)
+        report["used_after"] = used
+        if report["compacted"] or report["evicted"]:
+            print(
+                f"Store quota: compacted {len(report['compacted'])}, evicted {len(report['evicted'])}, "
+                f"freed {report['bytes_freed']} bytes"
+            )
+        return report
+    finally:
+        _ENFORCE_LOCK.release()
+
+
+def store_report() -> Dict[str, Any]:
+    quota = quota_bytes()
+    totals = doc_state.storage_totals()
+    used = sum(t["bytes"] for storage, t in totals.items() if storage != "evicted")
+    flush_lookups()
+    counters = doc_state.get_counters()
+    lookups = {kind: counters.get(f"doc_cache.{kind}", 0) for kind in LOOKUP_KINDS}
+    total = sum(lookups.values())
+    return {
+        "quota_bytes": quota or None,
+        "used_bytes": used,
+        "quota_used": round(used / quota, 4) if quota else None,
+        "evict_mode": evict_mode(),
+        "compress_sidecars": compression_enabled(),
+        "documents": totals,
+        "lookups": {
+            **lookups,
+            "total": total,
+            # memory: served from the worker's cache; store: served without a rebuild
+            "memory_hit_rate": round(lookups["memory"] / total, 4) if total else None,
+            "store_hit_rate": round((lookups["memory"] + lookups["disk"]) / total, 4) if total else None,
+        },
+        "evictions": {
+            "compacted": counters.get("evictions.compact", 0),
+            "evicted": counters.get("evictions.evicted", 0),
+            "bytes_freed": counters.get("evictions.bytes_freed", 0),
+        },
+    }
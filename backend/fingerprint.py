@@ -0,0 +1,111 @@
+"""MinHash fingerprints of cleaned page text, for near-duplicate detection.
+
+A re-saved PDF, a re-scan or an amended lease hashes to a new doc_id, but
+most of its pages say the same thing as a document we already processed.
+Each page gets a MinHash signature over word 5-gram shingles; the union of
+the page signatures (their elementwise minimum) fingerprints the document.
+Document signatures are split into LSH bands whose buckets are stored in
+doc_state, so candidates are found with one indexed query instead of
+comparing against every stored document.
+"""
+from __future__ import annotations
+
+import re
+from hashlib import blake2b, md5
+from typing import Any, Dict, List, Sequence
+
+import numpy as np
+
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+SHINGLE_WORDS = 5
+
+_PRIME = np.uint64((1 << 61) - 1)
+_rng = np.random.default_rng(0x1EA5E)
+# a < 2**31 and 32-bit shingle hashes keep a*h + b inside uint64
+_A = _rng.integers(1, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+_B = _rng.integers(0, 1 << 31, size=NUM_PERM, dtype=np.uint64)
+_EMPTY = np.full(NUM_PERM, np.iinfo(np.uint64).max, dtype=np.uint64)
+
+_NON_WORD_RE = re.compile(r"[^0-9a-z]+")
+
+
+def normalize_text(text: str) -> str:
+    """Case, punctuation and whitespace folded away, for shingling."""
+    return " ".join(_NON_WORD_RE.sub(" ", text.lower()).split())
+
+
+def text_hash(text: str) -> str:
+    # Only whitespace is ignored: "$5,000" and "$5.000" must not compare equal
+    return md5(" ".join(text.split()).encode("utf-8")).hexdigest()
+
+
+def _shingle_hashes(text: str) -> np.ndarray:
+    words = normalize_text(text).split()
+    if not words:
+        return np.empty(0, dtype=np.uint64)
+    grams = {" ".join(words[i:i + SHINGLE_WORDS]) for i in range(max(1, len(words) - SHINGLE_WORDS + 1))}
+    return np.fromiter(
+        (int.from_bytes(blake2b(g.encode("utf-8"), digest_size=4).digest(), "little") for g in grams),
+        dtype=np.uint64,
+        count=len(grams),
+    )
+
+
+def minhash(text: str) -> np.ndarray:
+    hashes = _shingle_hashes(text)
+    if hashes.size == 0:
+        return _EMPTY.copy()
+    return ((np.outer(hashes, _A) + _B) % _PRIME).min(axis=0)
+
+
+def page_signatures(texts: Sequence[str]) -> np.ndarray:
+    if not texts:
+        return np.empty((0, NUM_PERM), dtype=np.uint64)
+    return np.stack([minhash(t) for t in texts])
+
+
+def document_signature(page_sigs: np.ndarray) -> np.ndarray:
+    # MinHash of a union is the elementwise min of the parts' MinHashes
+    return page_sigs.min(axis=0) if len(page_sigs) else _EMPTY.copy()
+
+
+def similarity(sig_a: np.ndarray, sig_b: np.ndarray) -> float:
+    """Estimated Jaccard similarity of the shingle sets behind two signatures."""
+    return float(np.mean(sig_a == sig_b))
+
+
+def lsh_buckets(doc_sig: np.ndarray) -> List[str]:
+    """One bucket key per band; sharing any bucket makes two docs candidates."""
+    return [
+        f"{band}:{md5(doc_sig[band * ROWS:(band + 1) * ROWS].tobytes()).hexdigest()[:16]}"
+        for band in range(BANDS)
+    ]
+
+
+def align_pages(new_hashes: Sequence[str], new_sigs: np.ndarray, base_hashes: Sequence[str], base_sigs: np.ndarray) -> List[Dict[str, Any]]:
+    """Match every new page to a base page.
+
+    A page is unchanged only if its text equals a base page's up to
+    whitespace; MinHash similarity cannot tell an OCR difference from an
+    amended figure, so near matches are reported as changed, with their
+    closest base page and estimated similarity.
+    """
+    exact: Dict[str, int] = {}
+    for j, h in enumerate(base_hashes):
+        exact.setdefault(h, j)
+    best_j = np.zeros(len(new_hashes), dtype=np.int64)
+    best_sim = np.zeros(len(new_hashes))
+    if len(new_sigs) and len(base_sigs):
+        sims = (new_sigs[:, None, :] == base_sigs[None, :, :]).mean(axis=2)
+        best_j = sims.argmax(axis=1)
+        best_sim = sims.max(axis=1)
+    pages: List[Dict[str, Any]] = []
+    for i, h in enumerate(new_hashes):
+        if h in exact:
+            pages.append({"page": i, "base_page": exact[h], "similarity": 1.0, "changed": False})
+        else:
+            base_page = int(best_j[i]) if len(base_sigs) else None
+            pages.append({"page": i, "base_page": base_page, "similarity": round(float(best_sim[i]), 3), "changed": True})
+    return pages
@@ -0,0 +1,257 @@
+"""Hybrid (dense + BM25) retrieval over NumPy arrays of stored vectors.
+
+`HybridRetriever` serves every retrieval in lease_chain: FAISS MMR search,
+BM25 top-n, weighted reciprocal-rank fusion and an embeddings filter, the
+same pipeline langchain's EnsembleRetriever + EmbeddingsFilter ran. Dense
+and lexical search run concurrently, and MMR and filtering score against
+the vectors already stored in the index, so a query costs one embedding
+call instead of re-embedding every retrieved chunk. Only the rows being
+scored are read (at most FETCH_K + BM25_K per query), straight from the
+index or the memory-mapped `vectors.npy` of a compact index, so no
+per-document copy of the vectors is kept. Many queries can share
+one batched embedding call (`search_batch`).
+"""
+from __future__ import annotations
+
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, List, Optional, Sequence
+
+import numpy as np
+
+# The configuration lease_chain's langchain ensemble used
+DENSE_K = 12
+FETCH_K = 40
+BM25_K = 12
+WEIGHTS = (0.65, 0.35)
+RRF_C = 60
+FILTER_K = 8
+FILTER_THRESHOLD = 0.35
+MMR_LAMBDA = 0.5
+
+
+def normalize_rows(matrix: np.ndarray) -> np.ndarray:
+    matrix = np.asarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=-1, keepdims=True)
+    return matrix / np.where(norms == 0, 1.0, norms)
+
+
+def mmr_select(query_unit: np.ndarray, cand_unit: np.ndarray, k: int, lambda_mult: float = MMR_LAMBDA) -> List[int]:
+    """Maximal marginal relevance over unit vectors; returns candidate positions.
+
+    Same selection rule as langchain's `maximal_marginal_relevance`, but keeps
+    a running max-similarity vector instead of recomputing it per step.
+    """
+    n = cand_unit.shape[0]
+    if n == 0 or k <= 0:
+        return []
+    to_query = cand_unit @ query_unit
+    pairwise = cand_unit @ cand_unit.T
+    selected = [int(np.argmax(to_query))]
+    max_to_selected = pairwise[selected[0]].copy()
+    available = np.ones(n, dtype=bool)
+    available[selected[0]] = False
+    while len(selected) < min(k, n):
+        scores = lambda_mult * to_query - (1 - lambda_mult) * max_to_selected
+        scores[~available] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        available[best] = False
+        np.maximum(max_to_selected, pairwise[best], out=max_to_selected)
+    return selected
+
+
+def weighted_rrf(rank_lists: Sequence[Sequence[int]], weights: Sequence[float], c: int = RRF_C, size: int | None = None) -> tuple[np.ndarray, np.ndarray]:
+    """Weighted reciprocal-rank fusion of ranked position lists.
+
+    Returns (positions, scores) sorted by fused score, descending. Ties keep
+    first-seen order, as langchain's EnsembleRetriever does.
+    """
+    if size is None:
+        size = max((max(r) for r in rank_lists if len(r)), default=-1) + 1
+    fused = np.zeros(size, dtype=np.float64)
+    first_seen = np.full(size, np.iinfo(np.int64).max, dtype=np.int64)
+    order = 0
+    for ranks, weight in zip(rank_lists, weights):
+        ranks = np.asarray(ranks, dtype=np.int64)
+        if ranks.size == 0:
+            continue
+        np.add.at(fused, ranks, weight / (np.arange(1, ranks.size + 1) + c))
+        seen = np.arange(order, order + ranks.size)
+        np.minimum.at(first_seen, ranks, seen)
+        order += ranks.size
+    present = np.flatnonzero(first_seen != np.iinfo(np.int64).max)
+    ranked = present[np.lexsort((first_seen[present], -fused[present]))]
+    return ranked, fused[ranked]
+
+
+def bm25_top_n(bm25: Any, query_tokens: List[str], n: int) -> tuple[np.ndarray, np.ndarray]:
+    """Positions of the n best BM25 scores, best first, and those scores."""
+    scores = np.asarray(bm25.get_scores(query_tokens))
+    if scores.size == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    n = min(n, scores.size)
+    top = np.argpartition(-scores, n - 1)[:n]
+    # Stable on ties like rank_bm25.get_top_n's argsort
+    top = top[np.argsort(-scores[top], kind="stable")]
+    return top, scores[top]
+
+
+def canonical_positions(keys: Sequence[str]) -> np.ndarray:
+    """For each position, the first position holding identical text.
+
+    langchain fuses documents by page_content, so duplicate chunks (e.g.
+    repeated boilerplate) must collapse onto one position before fusion.
+    """
+    first: Dict[str, int] = {}
+    return np.asarray([first.setdefault(key, i) for i, key in enumerate(keys)], dtype=np.int64)
+
+
+def embeddings_filter(query_unit: np.ndarray, pos_unit: np.ndarray, positions: np.ndarray, k: int = FILTER_K, threshold: float = FILTER_THRESHOLD) -> tuple[np.ndarray, np.ndarray]:
+    """Keep the k most query-similar positions above threshold, like EmbeddingsFilter.
+
+    `pos_unit[i]` is the unit vector stored at `positions[i]`.
+    """
+    if positions.size == 0:
+        return positions, np.empty(0, dtype=np.float32)
+    sims = pos_unit @ query_unit
+    order = np.argsort(-sims, kind="stable")[:k]
+    keep = order[sims[order] > threshold]
+    return positions[keep], sims[keep]
+
+
+_LEXICAL_POOL: Optional[ThreadPoolExecutor] = None
+_LEXICAL_POOL_LOCK = threading.Lock()
+
+
+def index_rows(index: Any, positions: np.ndarray) -> np.ndarray:
+    """Unit vectors stored at the given index positions, in that order.
+
+    A compact index (vector_index.RerankedIndex) is read from its exact,
+    usually memory-mapped, vectors; any other index decodes its own codes.
+    """
+    from backend.vector_index import RerankedIndex
+
+    positions = np.asarray(positions, dtype=np.int64)
+    if positions.size == 0:
+        return np.empty((0, index.d), dtype=np.float32)
+    if isinstance(index, RerankedIndex):
+        # Sorted, unique ids keep reads from the mmap sequential
+        ids, inverse = np.unique(positions, return_inverse=True)
+        rows = np.asarray(index.vectors[ids], dtype=np.float32)[inverse]
+    else:
+        rows = index.reconstruct_batch(positions)
+    return normalize_rows(rows)
+
+
+def _lexical_pool() -> ThreadPoolExecutor:
+    global _LEXICAL_POOL
+    with _LEXICAL_POOL_LOCK:
+        if _LEXICAL_POOL is None:
+            _LEXICAL_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="bm25")
+        return _LEXICAL_POOL
+
+
+class HybridRetriever:
+    """Dense MMR + BM25, fused by weighted RRF and filtered by similarity.
+
+    Rows follow index positions: `docs[i]` is the chunk stored at FAISS
+    position i. `invoke` returns documents like a langchain retriever;
+    `search` also returns each hit's score breakdown.
+    """
+
+    def __init__(self, index: Any, docs: List[Any], embeddings: Any):
+        from rank_bm25 import BM25Okapi
+
+        self.index = index
+        self.docs = docs
+        self.embeddings = embeddings
+        n = len(docs)
+        self.canonical = canonical_positions([d.page_content for d in docs])
+        # Same tokenization as langchain's BM25Retriever default
+        self.bm25 = BM25Okapi([d.page_content.split() for d in docs]) if n else None
+
+    @classmethod
+    def from_vectorstore(cls, vs: Any, embeddings: Any) -> "HybridRetriever":
+        n = vs.index.ntotal
+        docs = [vs.docstore.search(vs.index_to_docstore_id[i]) for i in range(n)]
+        return cls(vs.index, docs, embeddings)
+
+    def _lexical(self, query: str) -> tuple[np.ndarray, np.ndarray]:
+        return bm25_top_n(self.bm25, query.split(), BM25_K)
+
+    def _rank(self, query_vec: np.ndarray, fetched: np.ndarray, lexical: tuple[np.ndarray, np.ndarray]) -> List[Dict[str, Any]]:
+        query_unit = normalize_rows(query_vec)
+        candidates = fetched[fetched >= 0]
+        bm25_positions, bm25_scores = lexical
+        # One read covers MMR's candidates and every position fusion can return
+        needed = np.union1d(np.union1d(candidates, self.canonical[candidates]), self.canonical[bm25_positions])
+        rows = index_rows(self.index, needed)
+        dense = candidates[mmr_select(query_unit, rows[np.searchsorted(needed, candidates)], DENSE_K)]
+        fused, rrf_scores = weighted_rrf(
+            [self.canonical[dense], self.canonical[bm25_positions]], WEIGHTS, size=len(self.docs)
+        )
+        kept, sims = embeddings_filter(query_unit, rows[np.searchsorted(needed, fused)], fused)
+        dense_rank = {int(p): r for r, p in enumerate(self.canonical[dense], 1)}
+        bm25_rank = {int(p): r for r, p in enumerate(self.canonical[bm25_positions], 1)}
+        bm25_score = {int(p): float(s) for p, s in zip(self.canonical[bm25_positions], bm25_scores)}
+        rrf = dict(zip(fused.tolist(), rrf_scores.tolist()))
+        return [
+            {
+                "document": self.docs[p],
+                "position": int(p),
+                "similarity": float(sim),
+                "rrf_score": rrf[int(p)],
+                "dense_rank": dense_rank.get(int(p)),
+                "bm25_rank": bm25_rank.get(int(p)),
+                "bm25_score": bm25_score.get(int(p)),
+            }
+            for p, sim in zip(kept, sims)
+        ]
+
+    def search(self, query: str) -> List[Dict[str, Any]]:
+        """Top hits for one query, most similar first, with their score breakdown."""
+        if not self.docs:
+            return []
+        # BM25 needs no embedding, so it runs while the query is embedded
+        lexical = _lexical_pool().submit(self._lexical, query)
+        query_vec = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        _, fetched = self.index.search(query_vec[None, :], min(FETCH_K, len(self.docs)))
+        return self._rank(query_vec, fetched[0], lexical.result())
+
+    def search_batch(self, queries: Sequence[str]) -> List[List[Dict[str, Any]]]:
+        """`search` for many queries, from one batched embedding call and one FAISS call."""
+        if not self.docs or not queries:
+            return [[] for _ in queries]
+        lexical = [_lexical_pool().submit(self._lexical, q) for q in queries]
+        query_vecs = np.asarray(self.embeddings.embed_documents(list(queries)), dtype=np.float32)
+        _, fetched = self.index.search(query_vecs, min(FETCH_K, len(self.docs)))
+        return [self._rank(query_vecs[i], fetched[i], lexical[i].result()) for i in range(len(queries))]
+
+    def similar(self, query: str, threshold: float, min_hits: int = 3) -> List[int]:
+        """Positions whose cosine similarity to the query reaches threshold, in index order.
+
+        Falls back to the min_hits most similar positions, best first. The
+        index is searched with a growing k until its last hit falls below
+        threshold, so only those rows are scored.
+        """
+        n = len(self.docs)
+        if not n:
+            return []
+        query_vec = np.asarray(self.embeddings.embed_query(query), dtype=np.float32)
+        query_unit = normalize_rows(query_vec)
+        k = min(n, FETCH_K)
+        while True:
+            _, fetched = self.index.search(query_vec[None, :], k)
+            positions = fetched[0][fetched[0] >= 0]
+            sims = index_rows(self.index, positions) @ query_unit
+            if k >= n or sims.size == 0 or sims.min() < threshold:
+                break
+            k = min(n, k * 4)
+        above = positions[sims >= threshold]
+        if above.size:
+            return sorted(int(p) for p in above)
+        return [int(p) for p in positions[np.argsort(-sims, kind="stable")[:min_hits]]]
+
+    def invoke(self, query: str) -> List[Any]:
+        return [hit["document"] for hit in self.search(query)]
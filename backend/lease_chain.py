@@ -1,34 +1,68 @@
-from langchain_community.document_loaders import UnstructuredPDFLoader, PyPDFLoader, PyMuPDFLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain_openai import OpenAIEmbeddings, ChatOpenAI
-from langchain_community.vectorstores import FAISS
-from langchain_community.retrievers import BM25Retriever
-from langchain.retrievers.ensemble import EnsembleRetriever
-from langchain.retrievers.document_compressors import EmbeddingsFilter
-from langchain.retrievers.contextual_compression import ContextualCompressionRetriever
-from langchain.prompts import ChatPromptTemplate
-from langchain_core.runnables import RunnablePassthrough
-from langchain_core.output_parsers import StrOutputParser
-from langchain.schema import Document
-from typing import List, Dict, Any
+from __future__ import annotations
+
+from typing import TYPE_CHECKING, List, Dict, Any, Sequence
+import os
 import re
 import json
- 
+import time
+import queue
+import shutil
+import tempfile
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
 
 from pathlib import Path
 from hashlib import md5
 from typing import Optional
 
-# Tracks the most recently uploaded document id so that endpoints can
-# default to operating on the latest document without an explicit id.
-_LATEST_DOC_ID: Optional[str] = None
+from backend import doc_state, doc_store
+
+if TYPE_CHECKING:
+    from langchain.schema import Document
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    from langchain_community.vectorstores import FAISS
+    from backend.hybrid_retrieval import HybridRetriever
+
+# Heavy third-party modules are imported on first use rather than at module
+# load so that worker processes start quickly. `preload_heavy_modules` pulls
+# them in ahead of time (see `run_startup_warmup`).
+_HEAVY_MODULES: Dict[str, tuple[str, ...]] = {
+    "core": (
+        "langchain.schema",
+        "langchain.text_splitter",
+        "langchain.prompts",
+        "langchain_core.output_parsers",
+        "langchain_community.document_loaders",
+        "langchain_community.vectorstores",
+        "langchain_openai",
+        "faiss",
+        "rank_bm25",
+        "numpy",
+        "backend.hybrid_retrieval",
+        "backend.llm_dispatch",
+    ),
+    "layout": ("unstructured.partition.pdf",),
+    "ocr": ("pdf2image", "pytesseract", "cv2"),
+}
+
+# Per-process cache of loaded indexes and retrievers. Anything that must be
+# visible to all workers (e.g. the latest uploaded doc) lives in doc_state.
 _DOC_CACHE: Dict[str, Dict[str, Any]] = {}
+# In-process single-flight registry: concurrent callers for the same doc_id
+# wait on one build instead of each parsing and embedding the PDF.
+_BUILDS_IN_FLIGHT: Dict[str, Future] = {}
+_BUILDS_LOCK = threading.Lock()
+_STARTUP_REPORT: Dict[str, Any] = {}
+_EMBEDDINGS = None
 
 def _project_root() -> Path:
     return Path(__file__).resolve().parents[1]
 
 def _temp_root() -> Path:
-    temp_dir = _project_root() / "temp"
+    # LEASE_STORE_DIR moves the document store, e.g. onto a shared volume
+    temp_dir = Path(os.getenv("LEASE_STORE_DIR") or _project_root() / "temp")
     temp_dir.mkdir(parents=True, exist_ok=True)
     return temp_dir
 
@@ -38,21 +72,77 @@ def _doc_dir(doc_id: str) -> Path:
     return directory
 
 def _compute_doc_id_for_file(file_path: str | Path) -> str:
-    global _LATEST_DOC_ID
     file_path = Path(file_path)
     with file_path.open("rb") as f:
         content = f.read()
     # Use MD5 to match existing 32-hex folder names in temp/
     doc_id = md5(content).hexdigest()
-    _LATEST_DOC_ID = doc_id
     # Ensure directory exists for downstream operations
     _doc_dir(doc_id)
+    # Shared pointer so endpoints in any worker can default to the latest upload
+    doc_state.set_latest_doc_id(doc_id)
     return doc_id
 
+def get_latest_doc_id() -> Optional[str]:
+    return doc_state.get_latest_doc_id()
+
 
 def _doc_id_from_pdf_path(pdf_path: str | Path) -> str:
     return Path(pdf_path).resolve().parent.name
 
+def _atomic_write_text(path: Path, text: str) -> None:
+    """Write via a temp file in the same directory and rename into place,
+    so readers never observe a partially written sidecar."""
+    doc_store.atomic_write_bytes(path, text.encode("utf-8"))
+
+def _atomic_copy_file(src: str | Path, dest: Path) -> None:
+    fd, tmp = tempfile.mkstemp(dir=str(dest.parent), prefix=f".{dest.name}.", suffix=".tmp")
+    os.close(fd)
+    try:
+        shutil.copyfile(src, tmp)
+        os.replace(tmp, dest)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except OSError:
+            pass
+        raise
+
+@contextmanager
+def _doc_build_lock(doc_id: str):
+    """Exclusive cross-process lock on `temp/<doc_id>/.build.lock`.
+
+    Held while a document is parsed, embedded and written so that other
+    workers wait for the build instead of racing on the same files.
+    """
+    lock_path = _doc_dir(doc_id) / ".build.lock"
+    try:
+        import fcntl
+    except ImportError:
+        fcntl = None
+    with open(lock_path, "a+b") as fh:
+        if fcntl is not None:
+            fcntl.flock(fh.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(fh.fileno(), fcntl.LOCK_UN)
+            return
+        # Windows: msvcrt.locking gives up after ~10s, so keep retrying
+        import msvcrt
+        fh.seek(0)
+        while True:
+            try:
+                msvcrt.locking(fh.fileno(), msvcrt.LK_LOCK, 1)
+                break
+            except OSError:
+                continue
+        try:
+            yield
+        finally:
+            fh.seek(0)
+            msvcrt.locking(fh.fileno(), msvcrt.LK_UNLCK, 1)
+
 def _chunks_path(doc_id: str) -> Path:
     return _doc_dir(doc_id) / "chunks.json"
 
@@ -61,48 +151,879 @@ def _save_chunks_json(doc_id: str, docs: List[Document]) -> None:
         {"page_content": d.page_content, "metadata": d.metadata}
         for d in docs
     ]
-    _chunks_path(doc_id).write_text(json.dumps(data), encoding="utf-8")
+    doc_store.write_json(_chunks_path(doc_id), data)
 
 def _load_chunks_json(doc_id: str) -> Optional[List[Document]]:
-    cp = _chunks_path(doc_id)
-    if not cp.exists():
-        return None
+    from langchain.schema import Document
     try:
-        raw = json.loads(cp.read_text(encoding="utf-8"))
+        raw = doc_store.read_json(_chunks_path(doc_id))
+        if raw is None:
+            return None
         return [Document(page_content=it.get("page_content", ""), metadata=it.get("metadata", {})) for it in raw]
     except Exception as e:
         print("Failed to load chunks.json:", e)
         return None
 
+def _index_stamp(doc_id: str) -> Optional[int]:
+    # index.faiss is replaced atomically on every (re)build, so its mtime
+    # identifies the artifact generation a cache entry was loaded from
+    try:
+        return (_temp_root() / doc_id / "index.faiss").stat().st_mtime_ns
+    except OSError:
+        return None
+
+def _fresh_cache_entry(doc_id: str) -> Optional[Dict[str, Any]]:
+    """Return the cached entry for doc_id unless its index was rebuilt since.
+
+    Another worker (or the background migrator) may have upgraded the
+    artifacts on disk; in that case the stale entry is dropped and reloaded.
+    """
+    cached = _DOC_CACHE.get(doc_id)
+    if cached is None:
+        return None
+    if cached.get("stamp") != _index_stamp(doc_id):
+        _DOC_CACHE.pop(doc_id, None)
+        return None
+    return cached
+
 def _get_or_build_vectorstore_for_doc(doc_id: str) -> tuple[FAISS, List[Document]]:
-    if doc_id in _DOC_CACHE:
-        cached = _DOC_CACHE[doc_id]
+    cached = _fresh_cache_entry(doc_id)
+    if cached is not None:
+        doc_store.record_lookup("memory")
         return cached["vectorstore"], cached["docs"]
 
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-    folder = str(_doc_dir(doc_id))
+    with _BUILDS_LOCK:
+        cached = _fresh_cache_entry(doc_id)
+        if cached is not None:
+            doc_store.record_lookup("memory")
+            return cached["vectorstore"], cached["docs"]
+        future = _BUILDS_IN_FLIGHT.get(doc_id)
+        is_owner = future is None
+        if is_owner:
+            future = Future()
+            _BUILDS_IN_FLIGHT[doc_id] = future
+
+    if not is_owner:
+        return future.result()
 
-    # Try load from disk first for speed
     try:
-        vs = FAISS.load_local(folder, embeddings, allow_dangerous_deserialization=True)
-        docs = _load_chunks_json(doc_id)
-        if docs is None:
-            # Fallback: reconstruct docs from docstore
-            docs = list(vs.docstore._dict.values())  # type: ignore[attr-defined]
-        _DOC_CACHE[doc_id] = {"vectorstore": vs, "docs": docs}
+        vs, docs = _load_or_build_vectorstore(doc_id)
+        _DOC_CACHE[doc_id] = {"vectorstore": vs, "docs": docs, "stamp": _index_stamp(doc_id)}
+        future.set_result((vs, docs))
         return vs, docs
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _BUILDS_LOCK:
+            _BUILDS_IN_FLIGHT.pop(doc_id, None)
+
+def _get_embeddings():
+    """Shared embeddings client; calls are paced and retried by the dispatcher."""
+    global _EMBEDDINGS
+    if _EMBEDDINGS is None:
+        from langchain_openai import OpenAIEmbeddings
+        from backend.llm_dispatch import DispatchedEmbeddings
+        # The client splits inputs longer than the model's context (a long
+        # question or topic) using tiktoken, whose encoding is downloaded on
+        # first use. LEASE_EMBED_CHECK_CTX=0 skips that for offline runs
+        # against the mock server; over-long inputs then fail.
+        check_ctx = os.getenv("LEASE_EMBED_CHECK_CTX", "1") != "0"
+        _EMBEDDINGS = DispatchedEmbeddings(
+            OpenAIEmbeddings(model=_EMBEDDING_MODEL, max_retries=0, check_embedding_ctx_length=check_ctx),
+            _EMBEDDING_MODEL,
+        )
+    return _EMBEDDINGS
+
+def _load_vectorstore_from_disk(doc_id: str, embeddings) -> Optional[tuple[FAISS, List[Document]]]:
+    from langchain_community.vectorstores import FAISS
+
+    folder = _doc_dir(doc_id)
+    # index.faiss is renamed into place last, so its presence marks a complete build
+    if not (folder / "index.faiss").exists():
+        return None
+    try:
+        index, docstore, index_to_docstore_id = _read_saved_index(folder)
+        vs = FAISS(embeddings, index, docstore, index_to_docstore_id)
     except Exception as e:
-        print("No saved FAISS index for doc; building new one:", e)
-
-    # Build from PDF
-    pdf_path = str(_doc_dir(doc_id) / "lease.pdf")
-    docs = load_lease_docs(pdf_path)
-    vs = FAISS.from_documents(docs, embeddings)
-    vs.save_local(folder)
-    _save_chunks_json(doc_id, docs)
-    _DOC_CACHE[doc_id] = {"vectorstore": vs, "docs": docs}
+        print("Failed to load saved FAISS index:", e)
+        return None
+    docs = _load_chunks_json(doc_id)
+    if docs is None:
+        # Fallback: reconstruct docs from docstore
+        docs = list(vs.docstore._dict.values())  # type: ignore[attr-defined]
     return vs, docs
 
+def _read_faiss_index(path: Path):
+    """Read a FAISS index memory-mapped and read-only where supported.
+
+    Indexes are never mutated after they are written, so mapping them lets
+    all workers share one copy through the OS page cache. Set
+    LEASE_FAISS_MMAP=0 to load fully into process memory instead.
+    """
+    import faiss
+
+    if os.getenv("LEASE_FAISS_MMAP", "1") != "0":
+        # IO_FLAG_MMAP_IFC (newer faiss) maps flat code arrays; IO_FLAG_MMAP
+        # covers inverted lists on older releases.
+        flags = getattr(faiss, "IO_FLAG_MMAP_IFC", None) or getattr(faiss, "IO_FLAG_MMAP", 0)
+        flags |= getattr(faiss, "IO_FLAG_READ_ONLY", 0)
+        try:
+            return faiss.read_index(str(path), flags)
+        except Exception as e:
+            print("mmap read of FAISS index failed; loading into memory:", e)
+    return faiss.read_index(str(path))
+
+def _read_saved_index(folder: Path) -> tuple[Any, Any, Dict[int, str]]:
+    """Load index.faiss/index.pkl; compact indexes get their exact vectors attached."""
+    import pickle
+    from backend.vector_index import attach_exact_vectors
+
+    index = attach_exact_vectors(_read_faiss_index(folder / "index.faiss"), folder / "vectors.npy")
+    # Same layout FAISS.save_local writes: (docstore, index_to_docstore_id)
+    with open(folder / "index.pkl", "rb") as f:
+        docstore, index_to_docstore_id = pickle.load(f)
+    return index, docstore, index_to_docstore_id
+
+def _save_vectorstore_atomic(doc_id: str, vs: FAISS, folder: Optional[Path] = None) -> None:
+    import faiss
+    import pickle
+    import numpy as np
+    from backend.vector_index import RerankedIndex
+
+    folder = folder or _doc_dir(doc_id)
+    staging = Path(tempfile.mkdtemp(dir=str(folder), prefix=".faiss-"))
+    try:
+        # Written by hand rather than FAISS.save_local so compact indexes can
+        # store their quantized codes and exact vectors separately
+        index = vs.index
+        if isinstance(index, RerankedIndex):
+            np.save(staging / "vectors.npy", np.asarray(index.vectors, dtype=np.float32))
+            index = index.base
+        faiss.write_index(index, str(staging / "index.faiss"))
+        with open(staging / "index.pkl", "wb") as f:
+            pickle.dump((vs.docstore, vs.index_to_docstore_id), f)
+        if (staging / "vectors.npy").exists():
+            os.replace(staging / "vectors.npy", folder / "vectors.npy")
+        else:
+            (folder / "vectors.npy").unlink(missing_ok=True)
+        os.replace(staging / "index.pkl", folder / "index.pkl")
+        os.replace(staging / "index.faiss", folder / "index.faiss")
+    finally:
+        shutil.rmtree(staging, ignore_errors=True)
+
+def _load_or_build_vectorstore(doc_id: str) -> tuple[FAISS, List[Document]]:
+    embeddings = _get_embeddings()
+
+    # Try load from disk first for speed. Artifacts from an older pipeline
+    # are still served while the migrator upgrades them in the background,
+    # unless the embedding model changed (old vectors are then unusable).
+    loaded = _load_vectorstore_from_disk(doc_id, embeddings)
+    if loaded is not None:
+        if not _needs_migration(doc_id):
+            doc_store.record_lookup("disk")
+            return loaded
+        if _embedding_model_matches(doc_id):
+            schedule_migration(doc_id)
+            doc_store.record_lookup("disk")
+            return loaded
+
+    with _doc_build_lock(doc_id):
+        # Another worker may have finished the build while we waited
+        if not _needs_migration(doc_id):
+            loaded = _load_vectorstore_from_disk(doc_id, embeddings)
+            if loaded is not None:
+                doc_store.record_lookup("disk")
+                return loaded
+
+        print("Building or upgrading FAISS index for doc:", doc_id)
+        doc_store.record_lookup("restore" if _is_compacted(doc_id) else "build")
+        doc_state.set_document_status(doc_id, "building")
+        try:
+            vs, docs = _run_ingest_pipeline(doc_id, embeddings)
+        except BaseException:
+            doc_state.set_document_status(doc_id, "failed")
+            raise
+        doc_state.set_document_status(doc_id, "ready")
+    schedule_quota_check(protect=(doc_id,))
+    return vs, docs
+
+# --- Versioned ingest pipeline ---------------------------------------------
+#
+# Each doc directory carries a manifest.json recording which version of every
+# pipeline stage produced its artifacts:
+#
+#   extraction -> pages.json          (raw page text + layout titles)
+#   cleaning   -> cleaned_pages.json  (header/footer removal, de-hyphenation)
+#   chunking   -> chunks.json
+#   embedding  -> index.faiss / index.pkl
+#   clauses    -> clauses.json        (structural clause index)
+#
+# JSON sidecars are stored gzip-compressed (see doc_store), so on disk they
+# usually appear as <name>.json.gz.
+#
+# Bump a stage version below when its behaviour changes. Only that stage and
+# the ones after it are recomputed, and chunks whose text is unchanged keep
+# their previous embedding.
+
+_EMBEDDING_MODEL = "text-embedding-3-small"
+_EXTRACTION_VERSION = "1"
+# 2: raw-mode documents are split at clause headers (fixed header check)
+_CLEANING_VERSION = "2"
+# 2: chunks record char_start
+_CHUNKING_VERSION = "2"
+_CLAUSE_INDEX_VERSION = "1"
+_SPLITTER_PARAMS: Dict[str, Any] = {
+    "chunk_size": 1500,
+    "chunk_overlap": 200,
+    "separators": ["\n\n", "\n", ". ", " "],
+}
+# "clauses" only depends on cleaning; it runs last so bumping its version
+# never rebuilds the vector index
+_PIPELINE_STAGES = ("extraction", "cleaning", "chunking", "embedding", "clauses")
+
+def _current_stage_versions() -> Dict[str, str]:
+    # Splitter parameters are folded into the chunking version so tuning them
+    # invalidates chunks without a manual bump
+    splitter_fp = md5(json.dumps(_SPLITTER_PARAMS, sort_keys=True).encode("utf-8")).hexdigest()[:8]
+    return {
+        "extraction": _EXTRACTION_VERSION,
+        "cleaning": _CLEANING_VERSION,
+        "chunking": f"{_CHUNKING_VERSION}-{splitter_fp}",
+        "embedding": _EMBEDDING_MODEL,
+        "clauses": _CLAUSE_INDEX_VERSION,
+    }
+
+def _clause_index_path(doc_id: str) -> Path:
+    return _doc_dir(doc_id) / "clauses.json"
+
+def _manifest_path(doc_id: str) -> Path:
+    return _doc_dir(doc_id) / "manifest.json"
+
+def _load_manifest(doc_id: str) -> Dict[str, Any]:
+    path = _manifest_path(doc_id)
+    if path.exists():
+        try:
+            return json.loads(path.read_text(encoding="utf-8"))
+        except Exception as e:
+            print("Failed to load manifest.json:", e)
+    if (_doc_dir(doc_id) / "index.faiss").exists():
+        # Built before manifests existed: only the embedding model is known,
+        # which is enough to reuse vectors for unchanged chunks
+        return {"stages": {"embedding": {"version": _EMBEDDING_MODEL}}}
+    return {"stages": {}}
+
+def _index_mode_for(doc_id: str) -> str:
+    """Index mode chosen at upload, else LEASE_INDEX_MODE (default "flat")."""
+    from backend.vector_index import INDEX_MODES
+
+    mode = None
+    try:
+        mode = (doc_state.get_document(doc_id) or {}).get("index_mode")
+    except Exception as e:
+        print("Failed to read index mode:", e)
+    mode = mode or os.getenv("LEASE_INDEX_MODE", "flat")
+    return mode if mode in INDEX_MODES else "flat"
+
+def set_doc_index_mode(doc_id: str, index_mode: str) -> None:
+    """Choose the index mode for a doc; an existing index is converted in the background."""
+    from backend.vector_index import INDEX_MODES
+
+    if index_mode not in INDEX_MODES:
+        raise ValueError(f"Unsupported index_mode '{index_mode}'. Use one of: {', '.join(INDEX_MODES)}.")
+    doc_state.set_index_mode(doc_id, index_mode)
+    if _manifest_path(doc_id).exists() and _needs_migration(doc_id):
+        schedule_migration(doc_id)
+
+def _first_stale_stage(doc_id: str, manifest: Dict[str, Any]) -> Optional[str]:
+    current = _current_stage_versions()
+    recorded = manifest.get("stages", {})
+    for stage in _PIPELINE_STAGES:
+        if recorded.get(stage, {}).get("version") != current[stage]:
+            return stage
+    # Switching index mode re-indexes from the stored vectors; nothing is re-embedded
+    if recorded.get("embedding", {}).get("index_mode", "flat") != _index_mode_for(doc_id):
+        return "embedding"
+    return None
+
+def _needs_migration(doc_id: str) -> bool:
+    return _first_stale_stage(doc_id, _load_manifest(doc_id)) is not None
+
+def _embedding_model_matches(doc_id: str) -> bool:
+    recorded = _load_manifest(doc_id).get("stages", {}).get("embedding", {})
+    return recorded.get("version") == _EMBEDDING_MODEL
+
+def _read_json_artifact(path: Path) -> Optional[Any]:
+    try:
+        return doc_store.read_json(path)
+    except Exception as e:
+        print(f"Failed to load {path.name}:", e)
+        return None
+
+def _text_key(text: str) -> str:
+    return md5(text.encode("utf-8")).hexdigest()
+
+def _previous_vectors_by_key(doc_id: str) -> Dict[str, Any]:
+    """Map `_text_key(chunk text)` -> vector from the index currently on disk,
+    or from the fp16 copy kept when the doc was compacted."""
+    folder = _doc_dir(doc_id)
+    if not (folder / "index.faiss").exists():
+        return _read_compact_vectors(folder)
+    try:
+        index, docstore, index_to_docstore_id = _read_saved_index(folder)
+        vectors: Dict[str, Any] = {}
+        for position, store_id in index_to_docstore_id.items():
+            doc = docstore.search(store_id)
+            if hasattr(doc, "page_content"):
+                vectors[_text_key(doc.page_content)] = index.reconstruct(int(position))
+        return vectors
+    except Exception as e:
+        print("Could not read previous embeddings for reuse:", e)
+        return {}
+
+# Progressive first builds: chunks are embedded in page-order batches and a
+# partial index is published under partial/ after each one, so /ask can
+# answer from the pages indexed so far. Batches start small and double up to
+# LEASE_INGEST_BATCH_PAGES to keep time-to-first-answer low.
+_FIRST_BATCH_PAGES = 4
+
+def _page_of(doc: Document) -> int:
+    # Raw-text docs have no pages; their text sections stand in for them
+    page = doc.metadata.get("page", doc.metadata.get("para_index"))
+    return int(page) if page is not None else 0
+
+def _page_batches(docs: List[Document]) -> List[tuple[int, int]]:
+    """Split page-ordered chunks into batches: (end position, pages covered)."""
+    max_pages = max(1, int(os.getenv("LEASE_INGEST_BATCH_PAGES", "32")))
+    size = min(_FIRST_BATCH_PAGES, max_pages)
+    bounds: List[tuple[int, int]] = []
+    batch_first_page: Optional[int] = None
+    for i, doc in enumerate(docs):
+        page = _page_of(doc)
+        if batch_first_page is None:
+            batch_first_page = page
+        elif page - batch_first_page >= size:
+            bounds.append((i, page))
+            batch_first_page = page
+            size = min(size * 2, max_pages)
+    bounds.append((len(docs), _page_of(docs[-1]) + 1 if docs else 0))
+    return bounds
+
+def _partial_root(doc_id: str) -> Path:
+    return _temp_root() / doc_id / "partial"
+
+def _publish_partial_index(doc_id: str, builder: Optional[FAISS], batch: List[Document], known: Dict[str, Any], pages_indexed: int, pages_total: int, embeddings) -> FAISS:
+    """Add a batch to the growing index and publish a snapshot of it.
+
+    Each snapshot goes to its own directory and progress.json is switched to
+    it last, so readers in any worker never see a half-written index.
+    """
+    from langchain_community.vectorstores import FAISS
+
+    pairs = [(d.page_content, known[_text_key(d.page_content)]) for d in batch]
+    metadatas = [d.metadata for d in batch]
+    if builder is None:
+        builder = FAISS.from_embeddings(pairs, embeddings, metadatas=metadatas)
+    else:
+        builder.add_embeddings(pairs, metadatas=metadatas)
+    root = _partial_root(doc_id)
+    name = f"{pages_indexed:06d}"
+    (root / name).mkdir(parents=True, exist_ok=True)
+    _save_vectorstore_atomic(doc_id, builder, folder=root / name)
+    _atomic_write_text(root / "progress.json", json.dumps({
+        "snapshot": name, "pages_indexed": pages_indexed, "pages_total": pages_total,
+    }))
+    # Keep the previous snapshot for readers that are still loading it
+    for old in sorted(p for p in root.iterdir() if p.is_dir() and p.name < name)[:-1]:
+        shutil.rmtree(old, ignore_errors=True)
+    print(f"Partial index for {doc_id}: {pages_indexed}/{pages_total} pages")
+    return builder
+
+def _embed_chunks(doc_id: str, docs: List[Document], embeddings, reuse: bool, pages_total: Optional[int] = None, reuse_from: Sequence[str] = ()) -> Dict[str, Any]:
+    """Vectors for every chunk keyed by `_text_key`, embedding only new texts.
+
+    Vectors are also taken from the docs in `reuse_from` when they were
+    embedded with the current model. When the doc has no index yet and
+    `pages_total` is given, embedding is progressive (see
+    `_publish_partial_index`).
+    """
+    known = _previous_vectors_by_key(doc_id) if reuse else {}
+    texts = [d.page_content for d in docs]
+    wanted = {_text_key(t) for t in texts}
+    for other in reuse_from:
+        if (_temp_root() / other).exists() and _embedding_model_matches(other):
+            for key, vector in _previous_vectors_by_key(other).items():
+                if key in wanted:
+                    known.setdefault(key, vector)
+    missing = [t for t in dict.fromkeys(texts) if _text_key(t) not in known]
+    batches = [(len(docs), 0)]
+    if missing and pages_total and not (_doc_dir(doc_id) / "index.faiss").exists():
+        batches = _page_batches(docs)
+        shutil.rmtree(_partial_root(doc_id), ignore_errors=True)
+    builder = None
+    start = 0
+    for end, pages_indexed in batches:
+        batch = docs[start:end]
+        new = [t for t in dict.fromkeys(d.page_content for d in batch) if _text_key(t) not in known]
+        if new:
+            known.update(zip(map(_text_key, new), embeddings.embed_documents(new)))
+        # The last batch completes the doc; the full index replaces the snapshots
+        if end < len(docs):
+            builder = _publish_partial_index(doc_id, builder, batch, known, pages_indexed, pages_total or 0, embeddings)
+        start = end
+    print(f"Embedding: reused {len(texts) - len(missing)} of {len(texts)} chunks")
+    return known
+
+def _build_vectorstore(docs: List[Document], known: Dict[str, Any], embeddings, index_mode: str = "flat") -> FAISS:
+    import numpy as np
+    from langchain_community.vectorstores import FAISS
+    from backend.vector_index import make_index
+
+    texts = [d.page_content for d in docs]
+    keys = [_text_key(t) for t in texts]
+    vs = FAISS.from_embeddings(
+        [(t, known[k]) for t, k in zip(texts, keys)],
+        embeddings,
+        metadatas=[d.metadata for d in docs],
+    )
+    if index_mode != "flat":
+        # Same row order as the flat index, so index_to_docstore_id still holds
+        vs.index = make_index(np.asarray([known[k] for k in keys], dtype=np.float32), index_mode)
+    return vs
+
+def _run_ingest_pipeline(doc_id: str, embeddings) -> tuple[FAISS, List[Document]]:
+    """(Re)build a doc's artifacts, recomputing only stages that are stale.
+
+    Callers must hold `_doc_build_lock(doc_id)`.
+    """
+    from backend.vector_index import index_mode_of
+
+    folder = _doc_dir(doc_id)
+    pdf_path = str(folder / "lease.pdf")
+    recorded = _load_manifest(doc_id).get("stages", {})
+    current = _current_stage_versions()
+    index_mode = _index_mode_for(doc_id)
+    stages: Dict[str, Dict[str, Any]] = {}
+    # Once a stage is recomputed, every later stage must be recomputed too
+    upstream_changed = False
+
+    def reusable(stage: str) -> bool:
+        return not upstream_changed and recorded.get(stage, {}).get("version") == current[stage]
+
+    def record(stage: str, recomputed: bool) -> None:
+        built_at = time.time() if recomputed else recorded.get(stage, {}).get("built_at")
+        stages[stage] = {"version": current[stage], "built_at": built_at}
+
+    layout_future: Optional[Future] = None
+    extracted = _read_json_artifact(folder / "pages.json") if reusable("extraction") else None
+    extraction_recomputed = extracted is None
+    if extracted is None:
+        upstream_changed = True
+        # Layout detection is slow on long leases and only feeds chunk
+        # metadata, so it runs alongside chunking and embedding
+        extracted = _extract_pages(pdf_path, with_layout=False)
+        if extracted.get("mode") == "pages":
+            layout_future = _start_layout_titles(doc_id, pdf_path)
+    record("extraction", upstream_changed)
+
+    units = _read_json_artifact(folder / "cleaned_pages.json") if reusable("cleaning") else None
+    if units is None:
+        upstream_changed = True
+        units = _clean_extracted(extracted)
+        lineage = _match_prior_document(doc_id, units)
+        doc_store.write_json(folder / "cleaned_pages.json", units)
+    else:
+        lineage = get_document_lineage(doc_id)
+    record("cleaning", upstream_changed)
+
+    docs = _load_chunks_json(doc_id) if reusable("chunking") else None
+    chunks_recomputed = docs is None
+    if docs is None:
+        upstream_changed = True
+        docs = _chunk_units(units, extracted.get("layout_titles", []))
+        if not docs and extracted.get("mode") == "pages":
+            # Cleaning removed everything; redo extraction from raw text
+            extracted = {"mode": "raw", "text": extract_text_from_pdf(pdf_path)}
+            extraction_recomputed = True
+            layout_future = None
+            units = _clean_extracted(extracted)
+            lineage = _match_prior_document(doc_id, units)
+            doc_store.write_json(folder / "cleaned_pages.json", units)
+            docs = _chunk_units(units, [])
+    record("chunking", upstream_changed)
+
+    same_mode = recorded.get("embedding", {}).get("index_mode", "flat") == index_mode
+    loaded = _load_vectorstore_from_disk(doc_id, embeddings) if reusable("embedding") and same_mode else None
+    known: Dict[str, Any] = {}
+    if loaded is None:
+        same_model = recorded.get("embedding", {}).get("version") == current["embedding"]
+        # A near-duplicate's unchanged pages chunk exactly like its base doc's
+        reuse_from = (lineage["base_doc_id"],) if lineage else ()
+        known = _embed_chunks(doc_id, docs, embeddings, reuse=same_model, pages_total=len(units), reuse_from=reuse_from)
+    if layout_future is not None:
+        # Titles only add chunk metadata; the chunk texts just embedded are unchanged
+        extracted["layout_titles"] = layout_future.result()
+        docs = _chunk_units(units, extracted["layout_titles"])
+    if extraction_recomputed:
+        doc_store.write_json(folder / "pages.json", extracted)
+    if chunks_recomputed:
+        _save_chunks_json(doc_id, docs)
+
+    if loaded is not None:
+        vs = loaded[0]
+        record("embedding", False)
+    else:
+        vs = _build_vectorstore(docs, known, embeddings, index_mode)
+        _save_vectorstore_atomic(doc_id, vs)
+        # The index holds the vectors again; drop the copy kept by compaction
+        # and the partial snapshots published while embedding
+        (folder / _COMPACT_VECTORS).unlink(missing_ok=True)
+        shutil.rmtree(_partial_root(doc_id), ignore_errors=True)
+        record("embedding", True)
+    # index_mode is what was requested and what staleness is judged by; the
+    # mode built can differ (pq falls back to sq8 on small docs)
+    effective_mode = index_mode_of(vs.index)
+    stages["embedding"]["index_mode"] = index_mode
+    stages["embedding"]["effective_index_mode"] = effective_mode
+    if effective_mode != index_mode and loaded is None:
+        print(f"Index mode {index_mode} needs more chunks than {len(docs)}; built {effective_mode}")
+    try:
+        doc_state.set_effective_index_mode(doc_id, effective_mode)
+    except Exception as e:
+        print("Failed to record index mode:", e)
+
+    clause_index = _read_json_artifact(_clause_index_path(doc_id)) if reusable("clauses") else None
+    if clause_index is None:
+        clause_index = _build_clause_index(units, extracted.get("layout_titles", []))
+        doc_store.write_json(_clause_index_path(doc_id), clause_index)
+        record("clauses", True)
+    else:
+        record("clauses", False)
+
+    # Manifest last: a crash mid-pipeline leaves the doc marked stale
+    manifest = {"doc_id": doc_id, "pages": len(units), "stages": stages}
+    _atomic_write_text(_manifest_path(doc_id), json.dumps(manifest, indent=2))
+    doc_store.record_size(doc_id, folder)
+    return vs, docs
+
+# Background migrator: upgrades stale documents one at a time so a pipeline
+# change never requires wiping and re-embedding the whole store at once.
+_MIGRATION_QUEUE: "queue.Queue[str]" = queue.Queue()
+_MIGRATION_PENDING: set[str] = set()
+_MIGRATOR_THREAD: Optional[threading.Thread] = None
+
+def _stored_doc_ids() -> list[str]:
+    return sorted(
+        entry.name for entry in _temp_root().iterdir()
+        if entry.is_dir() and re.fullmatch(r"[0-9a-f]{32}", entry.name) and (entry / "lease.pdf").exists()
+    )
+
+def migrate_document(doc_id: str) -> bool:
+    """Upgrade one document's artifacts to the current pipeline versions.
+
+    Returns True if anything was recomputed.
+    """
+    with _doc_build_lock(doc_id):
+        stale = _first_stale_stage(doc_id, _load_manifest(doc_id))
+        if stale is None:
+            return False
+        print(f"⬆️ Migrating {doc_id} from stage '{stale}'")
+        from backend.llm_dispatch import priority as llm_priority, BACKGROUND
+        with llm_priority(BACKGROUND):
+            _run_ingest_pipeline(doc_id, _get_embeddings())
+    with _BUILDS_LOCK:
+        _DOC_CACHE.pop(doc_id, None)
+    return True
+
+def _migration_worker() -> None:
+    while True:
+        doc_id = _MIGRATION_QUEUE.get()
+        try:
+            migrate_document(doc_id)
+        except Exception as e:
+            print(f"Migration of {doc_id} failed:", e)
+        finally:
+            with _BUILDS_LOCK:
+                _MIGRATION_PENDING.discard(doc_id)
+
+def _ensure_migrator_running() -> None:
+    global _MIGRATOR_THREAD
+    with _BUILDS_LOCK:
+        if _MIGRATOR_THREAD is None or not _MIGRATOR_THREAD.is_alive():
+            _MIGRATOR_THREAD = threading.Thread(target=_migration_worker, name="ingest-migrator", daemon=True)
+            _MIGRATOR_THREAD.start()
+
+def schedule_migration(doc_id: str) -> None:
+    with _BUILDS_LOCK:
+        if doc_id in _MIGRATION_PENDING:
+            return
+        _MIGRATION_PENDING.add(doc_id)
+    _MIGRATION_QUEUE.put(doc_id)
+    _ensure_migrator_running()
+
+def start_background_migration() -> int:
+    """Queue every stored document whose manifest is out of date.
+
+    Returns the number of documents queued.
+    """
+    queued = 0
+    for doc_id in _stored_doc_ids():
+        # Compacted docs are rebuilt on their next use anyway
+        if _needs_migration(doc_id) and not _is_compacted(doc_id):
+            schedule_migration(doc_id)
+            queued += 1
+    if queued:
+        print(f"Queued {queued} document(s) for background migration")
+    return queued
+
+# Store quota: cold documents are compacted or evicted by doc_store's LRU
+# policy. A compact doc keeps lease.pdf, the manifest, the small sidecars
+# (cleaned pages, chunks, clauses, layout titles) and an fp16 copy of its
+# vectors; the index and raw page text are rebuilt from those on next use
+# without any model call.
+_COMPACT_VECTORS = "compact_vectors.npz"
+_COMPACT_DROPPED = ("index.faiss", "index.pkl", "vectors.npy")
+# cleaned_pages.json stays: near-duplicates of this doc copy its page text
+_COMPACT_DROPPED_SIDECARS = ("pages.json",)
+_QUOTA_CHECK_PENDING = threading.Event()
+
+def _is_compacted(doc_id: str) -> bool:
+    folder = _temp_root() / doc_id
+    return not (folder / "index.faiss").exists() and (folder / _COMPACT_VECTORS).exists()
+
+def _read_compact_vectors(folder: Path) -> Dict[str, Any]:
+    import numpy as np
+
+    path = folder / _COMPACT_VECTORS
+    if not path.exists():
+        return {}
+    try:
+        with np.load(path) as data:
+            keys, vectors = data["keys"], data["vectors"].astype(np.float32)
+        return {key.decode("ascii"): vec for key, vec in zip(keys, vectors)}
+    except Exception as e:
+        print("Could not read compacted embeddings:", e)
+        return {}
+
+def _compact_document(doc_id: str, folder: Path) -> None:
+    import io
+    import numpy as np
+
+    if not (folder / "index.faiss").exists():
+        return
+    index, docstore, index_to_docstore_id = _read_saved_index(folder)
+    positions = sorted(index_to_docstore_id)
+    keys = [_text_key(docstore.search(index_to_docstore_id[p]).page_content) for p in positions]
+    vectors = np.asarray([index.reconstruct(int(p)) for p in positions], dtype=np.float16)
+    buf = io.BytesIO()
+    np.savez(buf, keys=np.asarray(keys, dtype="S32"), vectors=vectors)
+    doc_store.atomic_write_bytes(folder / _COMPACT_VECTORS, buf.getvalue())
+    # index.faiss first: its absence is what marks the doc as needing a build
+    for name in _COMPACT_DROPPED:
+        (folder / name).unlink(missing_ok=True)
+    for name in _COMPACT_DROPPED_SIDECARS:
+        doc_store.remove_sidecar(folder / name)
+
+def evict_document(doc_id: str, storage: str) -> int:
+    """Shrink a doc to "compact" or delete it ("evicted"); returns bytes freed."""
+    folder = _temp_root() / doc_id
+    if not folder.exists():
+        doc_state.set_storage(doc_id, "evicted", 0)
+        return 0
+    before = doc_store.dir_bytes(folder)
+    with _doc_build_lock(doc_id):
+        if storage == "compact":
+            _compact_document(doc_id, folder)
+        else:
+            for entry in folder.iterdir():
+                if entry.name == ".build.lock":
+                    continue
+                if entry.is_dir():
+                    shutil.rmtree(entry, ignore_errors=True)
+                else:
+                    entry.unlink(missing_ok=True)
+    with _BUILDS_LOCK:
+        _DOC_CACHE.pop(doc_id, None)
+    if storage == "compact":
+        return before - doc_store.record_size(doc_id, folder, "compact")
+    shutil.rmtree(folder, ignore_errors=True)
+    doc_state.set_storage(doc_id, "evicted", 0)
+    doc_state.remove_fingerprint(doc_id)
+    return before
+
+def enforce_store_quota(protect: tuple[str, ...] = ()) -> Dict[str, Any]:
+    """Apply LEASE_STORE_QUOTA now. The latest upload is never evicted."""
+    latest = get_latest_doc_id()
+    return doc_store.enforce_quota(evict_document, protect=set(protect) | ({latest} if latest else set()))
+
+def schedule_quota_check(protect: tuple[str, ...] = ()) -> None:
+    """Run `enforce_store_quota` in the background; coalesces while one is queued."""
+    if doc_store.quota_bytes() <= 0 or _QUOTA_CHECK_PENDING.is_set():
+        return
+    _QUOTA_CHECK_PENDING.set()
+
+    def _run() -> None:
+        _QUOTA_CHECK_PENDING.clear()
+        try:
+            enforce_store_quota(protect)
+        except Exception as e:
+            print("Store quota check failed:", e)
+
+    threading.Thread(target=_run, name="store-quota", daemon=True).start()
+
+def maintain_document_store() -> Dict[str, Any]:
+    """Size documents the store has not measured yet, then apply the quota.
+
+    Only docs without a recorded size are walked, so this stays cheap on
+    large stores after the first run.
+    """
+    unsized = set(doc_state.unsized_doc_ids())
+    measured = 0
+    for doc_id in _stored_doc_ids():
+        if doc_id in unsized or doc_state.get_document(doc_id) is None:
+            storage = "compact" if _is_compacted(doc_id) else "full"
+            doc_store.record_size(doc_id, _temp_root() / doc_id, storage)
+            measured += 1
+    fingerprinted = _backfill_fingerprints()
+    return {"measured": measured, "fingerprinted": fingerprinted, **enforce_store_quota()}
+
+# Near-duplicate detection: a re-saved, re-scanned or amended lease hashes to
+# a new doc_id. After cleaning, each page is MinHashed (backend.fingerprint)
+# and LSH buckets in doc_state find prior documents with similar text. Pages
+# identical to the closest prior doc take its cleaned text, so their chunks
+# and vectors are reused as-is; lineage.json records which pages changed.
+_FINGERPRINT = "fingerprint.npz"
+_LINEAGE = "lineage.json"
+
+def _near_duplicate_threshold() -> float:
+    return float(os.getenv("LEASE_NEAR_DUP_THRESHOLD", "0.5"))
+
+def _write_fingerprint(doc_id: str, units: List[Dict[str, Any]]) -> tuple[List[str], Any]:
+    import io
+    import numpy as np
+    from backend import fingerprint
+
+    texts = [u["text"] for u in units]
+    hashes = [fingerprint.text_hash(t) for t in texts]
+    sigs = fingerprint.page_signatures(texts)
+    buf = io.BytesIO()
+    np.savez(buf, hashes=np.asarray(hashes, dtype="S32"), signatures=sigs)
+    doc_store.atomic_write_bytes(_doc_dir(doc_id) / _FINGERPRINT, buf.getvalue())
+    doc_state.set_fingerprint_buckets(doc_id, fingerprint.lsh_buckets(fingerprint.document_signature(sigs)))
+    return hashes, sigs
+
+def _read_fingerprint(doc_id: str) -> Optional[tuple[List[str], Any]]:
+    import numpy as np
+
+    path = _temp_root() / doc_id / _FINGERPRINT
+    if not path.exists():
+        return None
+    try:
+        with np.load(path) as data:
+            return [h.decode("ascii") for h in data["hashes"]], data["signatures"]
+    except Exception as e:
+        print("Could not read fingerprint:", e)
+        return None
+
+def _find_near_duplicate(doc_id: str, sigs: Any) -> Optional[tuple[str, float, List[str], Any]]:
+    """Most similar prior document above the threshold: (doc_id, similarity, hashes, sigs).
+
+    A doc matched at first ingest stays matched to the same base when its
+    cleaning is recomputed (restore from compact, migration). Otherwise only
+    docs registered before this one qualify, so an original is never matched
+    against its own later amendment.
+    """
+    from backend import fingerprint
+
+    doc_sig = fingerprint.document_signature(sigs)
+    previous = get_document_lineage(doc_id)
+    if previous is not None:
+        candidates = [previous["base_doc_id"]]
+    else:
+        row = doc_state.get_document(doc_id)
+        created_before = row["created_at"] if row else None
+        candidates = doc_state.fingerprint_candidates(fingerprint.lsh_buckets(doc_sig), exclude=doc_id, created_before=created_before)
+    best = None
+    for candidate in candidates:
+        found = _read_fingerprint(candidate)
+        if found is None:
+            continue
+        score = fingerprint.similarity(doc_sig, fingerprint.document_signature(found[1]))
+        if score >= _near_duplicate_threshold() and (best is None or score > best[1]):
+            best = (candidate, score, *found)
+    return best
+
+def _match_prior_document(doc_id: str, units: List[Dict[str, Any]]) -> Optional[Dict[str, Any]]:
+    """Fingerprint a freshly cleaned doc and compare it with its closest prior doc.
+
+    Unchanged pages are rewritten in place with the prior doc's cleaned text
+    (they differ at most in whitespace). Returns the lineage record, or None.
+    """
+    from backend import fingerprint
+
+    folder = _doc_dir(doc_id)
+    try:
+        hashes, sigs = _write_fingerprint(doc_id, units)
+        match = _find_near_duplicate(doc_id, sigs)
+    except Exception as e:
+        print("Near-duplicate check failed:", e)
+        match = None
+    if match is None:
+        previous = get_document_lineage(doc_id)
+        if previous is not None and _read_fingerprint(previous["base_doc_id"]) is None:
+            # The base has been evicted since; what changed from it still holds
+            return previous
+        doc_store.remove_sidecar(folder / _LINEAGE)
+        return None
+    base_id, score, base_hashes, base_sigs = match
+    pages = fingerprint.align_pages(hashes, sigs, base_hashes, base_sigs)
+    base_units = _read_json_artifact(_temp_root() / base_id / "cleaned_pages.json")
+    if base_units is not None and len(base_units) == len(base_hashes):
+        for unit, page in zip(units, pages):
+            if not page["changed"]:
+                unit["text"] = base_units[page["base_page"]]["text"]
+    matched = {p["base_page"] for p in pages if p["similarity"] > 0}
+    changed = [p for p in pages if p["changed"]]
+    lineage = {
+        "base_doc_id": base_id,
+        "similarity": round(score, 3),
+        "pages_total": len(pages),
+        "unchanged_pages": len(pages) - len(changed),
+        # 1-based, as printed on the page
+        "changed_pages": [
+            {
+                "page": p["page"] + 1,
+                "closest_base_page": p["base_page"] + 1 if p["similarity"] > 0 else None,
+                "similarity": p["similarity"],
+            }
+            for p in changed
+        ],
+        # Base pages with no counterpart: removed, or rewritten beyond recognition
+        "unmatched_base_pages": [j + 1 for j in range(len(base_hashes)) if j not in matched],
+    }
+    doc_store.write_json(folder / _LINEAGE, lineage)
+    print(f"Near-duplicate of {base_id} (similarity {lineage['similarity']}); {len(changed)} of {len(pages)} pages changed")
+    return lineage
+
+def get_document_lineage(doc_id: str) -> Optional[Dict[str, Any]]:
+    """The prior document this one was matched to at ingest, and what changed."""
+    return _read_json_artifact(_temp_root() / doc_id / _LINEAGE)
+
+def _backfill_fingerprints() -> int:
+    """Fingerprint docs ingested before fingerprints existed, so they can be matched."""
+    done = 0
+    for doc_id in _stored_doc_ids():
+        folder = _temp_root() / doc_id
+        if (folder / _FINGERPRINT).exists() or doc_store.sidecar_file(folder / "cleaned_pages.json") is None:
+            continue
+        units = _read_json_artifact(folder / "cleaned_pages.json")
+        if units:
+            try:
+                _write_fingerprint(doc_id, units)
+                done += 1
+            except Exception as e:
+                print(f"Fingerprinting {doc_id} failed:", e)
+    return done
 
 
 def extract_text_from_pdf(pdf_path: str) -> str:
@@ -197,6 +1118,7 @@ def extract_text_from_pdf(pdf_path: str) -> str:
     # 3) Unstructured as a last resort (may try to fetch NLTK if missing)
     def _unstructured(path: str) -> str:
         try:
+            from langchain_community.document_loaders import UnstructuredPDFLoader
             loader = UnstructuredPDFLoader(path, mode="elements")
             docs = loader.load()
             return "\n".join(doc.page_content for doc in docs if getattr(doc, "page_content", None))
@@ -220,6 +1142,7 @@ def extract_text_from_pdf(pdf_path: str) -> str:
 
     # If still too short, try PyPDFLoader (page-level parsing)
     try:
+        from langchain_community.document_loaders import PyPDFLoader
         pypdf_loader = PyPDFLoader(pdf_path)
         docs = pypdf_loader.load()
         combined = "\n".join(doc.page_content for doc in docs if getattr(doc, "page_content", None))
@@ -237,96 +1160,203 @@ def extract_text_from_pdf(pdf_path: str) -> str:
     raise RuntimeError("All PDF extraction methods failed or produced empty text.")
 
 
-def split_into_paragraphs_or_clauses(text: str) -> List[str]:
-    # Normalize common OCR issues first (e.g., comma used as decimal separator between digits)
-    norm = re.sub(r"(\d),(\d)", r"\1.\2", text)
-    # Normalize weird dashes
-    norm = norm.replace("–", "-")
-
-    # Helper to decide if a header token is a real clause header or a cross-reference
-    def is_real_header(full_text: str, m: re.Match) -> bool:
-        start = m.start(2) if m.lastindex and m.lastindex >= 2 else m.start()
-        # Check preceding context for boundary like start, newline, or period + space
-        pre = full_text[max(0, start - 3):start]
-        boundary_ok = bool(re.search(r"(^|\n|[\.!?]\s)$", pre))
-        # If preceded by 'Section ' but not at start of line, likely a reference
-        pre_window = full_text[max(0, start - 12):start]
-        preceded_section = bool(re.search(r"Section\s*$", pre_window, re.IGNORECASE))
-        at_line_start = (start == 0) or full_text[start - 1] == "\n"
-        if preceded_section and not at_line_start:
+# Clause structure. The patterns below run over whole documents at ingest
+# (clause index) and over single chunks when a doc has no clause index yet,
+# so they are compiled once here rather than per call.
+_CLAUSE_LABEL = r"(?:Section|Clause|Article)"
+_CLAUSE_NUMBER = r"\d{1,2}(?:\.\d{1,2})?"
+# Candidate headers: boundary + optional label + number + optional punctuation + Title starting with a letter.
+# Disallow immediate subsection markers like "(b)" after the number to avoid cross-references like "24.05(b)"
+_CLAUSE_HEADER_RE = re.compile(
+    r"(?:(?:^|\n|[\.!?]\s))"                 # safe boundary
+    rf"{_CLAUSE_LABEL}?\s*"                    # optional label
+    rf"({_CLAUSE_NUMBER})\s*"                  # clause number
+    r"(?:[:\-\.]\s+)?"                        # optional punctuation then space
+    r"(?!\()"                                   # do not allow immediate '(' (subsection refs)
+    r"([A-Z][^\n]{0,80})?",                    # optional title starting with capital
+    re.IGNORECASE
+)
+_CROSS_REF_WORDS_RE = re.compile(r"\b(below|above|pursuant|provided|as defined|per|see)\b", re.IGNORECASE)
+_HEADER_BOUNDARY_RE = re.compile(r"(^|\n|[\.!?]\s)$")
+_TRAILING_SECTION_RE = re.compile(r"Section\s*$", re.IGNORECASE)
+_TRAILING_LABEL_RE = re.compile(rf"{_CLAUSE_LABEL}\s*$", re.IGNORECASE)
+_CLAUSE_HEADING_RE = re.compile(rf"^{_CLAUSE_LABEL}?\s*({_CLAUSE_NUMBER})\s*[-:.)]?\s*(.*)$", re.IGNORECASE)
+_LEADING_CLAUSE_NUMBER_RE = re.compile(rf"^{_CLAUSE_LABEL}?\s*({_CLAUSE_NUMBER})\b", re.IGNORECASE)
+_ANY_CLAUSE_NUMBER_RE = re.compile(rf"({_CLAUSE_NUMBER})")
+# Boundary: start, newline, or punctuation+space; avoid subsection like (b)
+_INLINE_HEADER_RE = re.compile(
+    rf"(?:(?<=^)|(?<=\n)|(?<=[\.!?]\s))(?={_CLAUSE_LABEL}?\s*{_CLAUSE_NUMBER}\s*(?:[:\-\.]\s+)?(?!\())",
+    re.IGNORECASE,
+)
+# A bare clause reference such as "23.02", "Section 23.02" or "Article 12"
+_CLAUSE_REFERENCE_RE = re.compile(
+    r"^\s*(?:(?:Section|Clause|Article|§)\s*)?(\d{1,2}(?:[.,]\d{1,2})?)\s*[.:]?\s*$", re.IGNORECASE
+)
+
+def _normalize_clause_text(text: str) -> str:
+    # Normalize common OCR issues (e.g., comma used as decimal separator between
+    # digits) and weird dashes. Both keep the length, so offsets still match `text`.
+    return re.sub(r"(\d),(\d)", r"\1.\2", text).replace("–", "-")
+
+def _clause_header_start(full_text: str, m: re.Match) -> int:
+    """Where a header match's own text begins: its label if any, else the number."""
+    label = _TRAILING_LABEL_RE.search(full_text, m.start(), m.start(1))
+    return label.start() if label else m.start(1)
+
+def _is_clause_header(full_text: str, m: re.Match) -> bool:
+    """Decide if a header token is a real clause header or a cross-reference."""
+    start = _clause_header_start(full_text, m)
+    # Check preceding context for boundary like start, newline, or period + space
+    pre = full_text[max(0, start - 3):start]
+    boundary_ok = bool(_HEADER_BOUNDARY_RE.search(pre))
+    # If preceded by 'Section ' but not at start of line, likely a reference
+    pre_window = full_text[max(0, start - 12):start]
+    preceded_section = bool(_TRAILING_SECTION_RE.search(pre_window))
+    # Indented headers still start their line
+    at_line_start = not full_text[full_text.rfind("\n", 0, start) + 1:start].strip()
+    if preceded_section and not at_line_start:
+        return False
+    # Following context: if immediately followed by subsection like (b) within a reference phrase, likely not header
+    if _CROSS_REF_WORDS_RE.search(full_text[max(0, start - 40): m.end() + 40]):
+        # Allow line-start real headers despite these words
+        if not at_line_start and not boundary_ok:
             return False
-        # Following context: if immediately followed by subsection like (b) within a reference phrase, likely not header
-        post = full_text[m.end(): m.end() + 40]
-        ref_words = re.compile(r"\b(below|above|pursuant|provided|as defined|per|see)\b", re.IGNORECASE)
-        if ref_words.search(full_text[max(0, start - 40): m.end() + 40]):
-            # Allow line-start real headers despite these words
-            if not at_line_start and not boundary_ok:
-                return False
-        # Heuristic: title length should be reasonable and should not be empty if punctuation suggests title
-        title = (m.group(3) if m.lastindex and m.lastindex >= 3 else m.group(2)) or ""
-        if len(title) > 100:
-            return False
-        return boundary_ok or at_line_start
-
-    # Regex to find candidate headers: boundary + optional label + number + optional punctuation + Title starting with a letter
-    # Disallow immediate subsection markers like "(b)" after the number to avoid cross-references like "24.05(b)"
-    header_regex = re.compile(
-        r"(?:(?:^|\n|[\.!?]\s))"                 # safe boundary
-        r"(?:Section|Clause|Article)?\s*"           # optional label
-        r"(\d{1,2}(?:\.\d{1,2})?)\s*"           # clause number
-        r"(?:[:\-\.]\s+)?"                        # optional punctuation then space
-        r"(?!\()"                                   # do not allow immediate '(' (subsection refs)
-        r"([A-Z][^\n]{0,80})?",                    # optional title starting with capital
-        re.IGNORECASE
-    )
-
-    # Scan for headers and build clause slices
-    candidates = []
-    for m in header_regex.finditer(norm):
-        candidates.append(m)
-
-    headers = []
-    for m in candidates:
-        if is_real_header(norm, m):
-            headers.append((m.start(1), m.group(1)))
-
+    # Heuristic: title length should be reasonable and should not be empty if punctuation suggests title
+    title = m.group(2) or ""
+    if len(title) > 100:
+        return False
+    return boundary_ok or at_line_start
+
+def _clause_spans(norm: str) -> List[tuple[int, int, str]]:
+    """(start, end, number) of each clause found in normalized text."""
+    headers = [
+        (_clause_header_start(norm, m), m.group(1))
+        for m in _CLAUSE_HEADER_RE.finditer(norm) if _is_clause_header(norm, m)
+    ]
     headers.sort(key=lambda x: x[0])
 
-    clauses: List[str] = []
-    if headers:
-        # Merge same-number headers if noisy duplicates (e.g., line breaks or repeated number)
-        merged = []
-        for pos, num in headers:
-            if merged and merged[-1][1] == num and pos - merged[-1][0] < 40:
-                # Skip duplicate header very near the previous
-                continue
-            merged.append((pos, num))
+    # Merge same-number headers if noisy duplicates (e.g., line breaks or repeated number)
+    merged: List[tuple[int, str]] = []
+    for pos, num in headers:
+        if merged and merged[-1][1] == num and pos - merged[-1][0] < 40:
+            # Skip duplicate header very near the previous
+            continue
+        merged.append((pos, num))
+
+    spans: List[tuple[int, int, str]] = []
+    for i, (pos, num) in enumerate(merged):
+        end = merged[i + 1][0] if i + 1 < len(merged) else len(norm)
+        # Extend start to the nearest line start unless the header follows
+        # text on its line, then trim surrounding whitespace
+        start = norm.rfind("\n", 0, pos) + 1
+        if norm[start:pos].strip():
+            start = pos
+        segment = norm[start:end]
+        stripped = segment.strip()
+        if stripped:
+            start += len(segment) - len(segment.lstrip())
+            spans.append((start, start + len(stripped), num))
+    return spans
+
+def _plausible_clause_count(count: int, total_chars: int) -> bool:
+    return 3 <= count <= max(150, total_chars // 150)
 
-        for i, (pos, num) in enumerate(merged):
-            end = merged[i + 1][0] if i + 1 < len(merged) else len(norm)
-            # Extend start to the nearest line start
-            start_line = norm.rfind("\n", 0, pos) + 1
-            chunk = norm[start_line:end].strip()
-            if chunk:
-                clauses.append(chunk)
+def split_into_paragraphs_or_clauses(text: str) -> List[str]:
+    norm = _normalize_clause_text(text)
+    clauses = [norm[start:end] for start, end, _num in _clause_spans(norm)]
 
     # Fallback if results look unreasonable
-    total_chars = len(norm)
-    if len(clauses) < 3 or len(clauses) > max(150, total_chars // 150):
+    if not _plausible_clause_count(len(clauses), len(norm)):
         print("⚠️ Smart clause split fallback to paragraphs.")
         paragraphs = [p.strip() for p in re.split(r"\n{2,}", norm) if len(p.strip()) > 40]
         return paragraphs
 
     return clauses
 
+def _describe_clause(raw_text: str, layout_titles: Sequence[str] = ()) -> tuple[str, str, str]:
+    """(clause number, title, display text) for one clause's raw text."""
+    text = raw_text.strip()
+    lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
+    header_line = lines[0] if lines else ""
+
+    # Try to extract clause number and optional title from the first line
+    # Patterns like: "Section 5.2 Title", "5.2 Title", "Clause 7 - Title", "Article 12: Title"
+    header_match = _CLAUSE_HEADING_RE.match(header_line)
+    # Heuristics: treat as a real header only if the line is short and not a cross-reference
+    looks_short = len(header_line) <= 80
+    not_cross_ref = not _CROSS_REF_WORDS_RE.search(header_line)
+
+    is_real_header = bool(header_match) and looks_short and not_cross_ref
+
+    if is_real_header:
+        clause_no = header_match.group(1)
+        clause_title = header_match.group(2).strip()
+    else:
+        # Fallback: try to find a leading number anywhere
+        any_num = _ANY_CLAUSE_NUMBER_RE.search(header_line)
+        clause_no = any_num.group(1) if any_num else ""
+        clause_title = ""
+
+    # Use ML layout titles (if present) to boost heading detection deterministically
+    titles = [t.strip() for t in layout_titles if isinstance(t, str)]
+    if not is_real_header and titles:
+        def _norm(s: str) -> str:
+            return " ".join((s or "").split()).lower()
+        norm_header = _norm(header_line)
+        norm_text = _norm(text)
+        for t in titles:
+            nt = _norm(t)
+            starts_with_title = norm_text.startswith(nt)
+            header_eq_title = norm_header.startswith(nt) or nt.startswith(norm_header)
+            if len(nt) > 4 and (starts_with_title or header_eq_title):
+                clause_title = t
+                num_match = _LEADING_CLAUSE_NUMBER_RE.match(text)
+                if num_match:
+                    clause_no = num_match.group(1)
+                is_real_header = True
+                break
+
+    # Body paragraphs: split by blank lines; ensure each paragraph is one line
+    body_text = text
+    # Remove the header line from body only if we confidently detected a header
+    if is_real_header and header_line and len(lines) > 1:
+        body_text = "\n".join(lines[1:])
+    paragraphs = [p.strip() for p in re.split(r"\n{2,}", body_text) if p.strip()]
+    # Normalize each paragraph to a single line (replace internal newlines with spaces)
+    normalized_paragraphs = [" ".join(p.split()) for p in paragraphs] or [" ".join(body_text.split())]
+
+    heading = " ".join(part for part in (clause_no, clause_title) if part).strip()
+    body = "\n".join("  " + para for para in normalized_paragraphs)
+    # If we couldn't confidently detect a header, avoid misleading header text
+    formatted = f"{heading}:\n{body}" if heading else body
+    return clause_no, clause_title, formatted.strip()
+
+def _format_clause(raw_text: str, meta: dict | None = None) -> str:
+    layout_titles = meta.get("layout_titles", []) if isinstance(meta, dict) else []
+    return _describe_clause(raw_text, layout_titles)[2]
+
+def _split_inline_headers(text: str) -> list[str]:
+    """Split a chunk holding several headers inline (e.g., "23.02 ... 23.03 ...")."""
+    # Normalize 23,03 -> 23.03
+    t = re.sub(r"(\d),(\d)", r"\1.\2", text)
+    parts: list[str] = []
+    last = 0
+    for m in _INLINE_HEADER_RE.finditer(t):
+        idx = m.start()
+        if idx > last:
+            seg = t[last:idx].strip()
+            if seg:
+                parts.append(seg)
+        last = idx
+    tail = t[last:].strip()
+    if tail:
+        parts.append(tail)
+    return parts or [text]
+
 
 def _build_text_splitter() -> RecursiveCharacterTextSplitter:
-    return RecursiveCharacterTextSplitter(
-        chunk_size=1500,
-        chunk_overlap=200,
-        length_function=len,
-        separators=["\n\n", "\n", ". ", " "]
-    )
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
+    return RecursiveCharacterTextSplitter(length_function=len, add_start_index=True, **_SPLITTER_PARAMS)
 
 def _layout_titles_path(doc_id: str) -> Path:
     return _doc_dir(doc_id) / "layout_titles.json"
@@ -336,11 +1366,12 @@ def _get_or_build_layout_titles(doc_id: str, pdf_path: str) -> list[dict]:
     Falls back to empty list if the model or deps are unavailable.
     """
     path = _layout_titles_path(doc_id)
-    if path.exists():
-        try:
-            return json.loads(path.read_text(encoding="utf-8"))
-        except Exception:
-            pass
+    try:
+        cached = doc_store.read_json(path)
+        if cached is not None:
+            return cached
+    except Exception:
+        pass
     try:
         from unstructured.partition.pdf import partition_pdf
         elements = partition_pdf(filename=pdf_path, strategy="hi_res", infer_table_structure=False)
@@ -359,7 +1390,7 @@ def _get_or_build_layout_titles(doc_id: str, pdf_path: str) -> list[dict]:
                 })
         # Save sidecar
         try:
-            path.write_text(json.dumps(titles), encoding="utf-8")
+            doc_store.write_json(path, titles)
         except Exception:
             pass
         return titles
@@ -367,6 +1398,19 @@ def _get_or_build_layout_titles(doc_id: str, pdf_path: str) -> list[dict]:
         print("Layout title extraction unavailable:", e)
         return []
 
+def _start_layout_titles(doc_id: str, pdf_path: str) -> Future:
+    """Run `_get_or_build_layout_titles` on its own thread."""
+    future: Future = Future()
+
+    def _run() -> None:
+        try:
+            future.set_result(_get_or_build_layout_titles(doc_id, pdf_path))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=_run, name=f"layout-{doc_id[:8]}", daemon=True).start()
+    return future
+
 def _normalize_line(line: str) -> str:
     # Collapse whitespace and remove stray artifacts for comparison
     return " ".join(line.strip().split())
@@ -460,125 +1504,236 @@ def _clean_page_text(text: str, header_set: set[str], footer_set: set[str]) -> s
     cleaned = [" ".join(ln.split()) for ln in sliced]
     return "\n".join(cleaned).strip()
 
-def load_lease_docs(pdf_path: str) -> List[Document]:
+def _extract_pages(pdf_path: str, with_layout: bool = True) -> Dict[str, Any]:
+    """Extraction stage: page texts (or raw text for scanned PDFs) plus layout titles.
+
+    With `with_layout=False` the titles are left empty for the caller to
+    fill in (see `_start_layout_titles`).
+    """
+    from langchain_community.document_loaders import PyMuPDFLoader, PyPDFLoader
+
     # Prefer PyMuPDF for higher-fidelity page extraction
-    try:
-        page_docs = PyMuPDFLoader(pdf_path).load()
+    for loader_cls in (PyMuPDFLoader, PyPDFLoader):
+        try:
+            page_docs = loader_cls(pdf_path).load()
+        except Exception as e:
+            print(f"{loader_cls.__name__} page-aware load failed:", e)
+            continue
+        if not any(d.page_content.strip() for d in page_docs):
+            break
         # Title detection via ML layout model to refine headers
-        doc_id = _doc_id_from_pdf_path(pdf_path)
-        layout_titles = _get_or_build_layout_titles(doc_id, pdf_path)
-        titles_by_page = {}
-        for t in layout_titles:
-            p = t.get("page")
-            if p is not None:
-                titles_by_page.setdefault(int(p), []).append(t.get("text", "").strip())
-        # Remove headers/footers/page numbers using cross-page frequency
-        page_texts = [d.page_content for d in page_docs]
-        header_set, footer_set = _find_common_header_footer_lines(page_texts)
-        cleaned_pages = [_clean_page_text(t, header_set, footer_set) for t in page_texts]
-        splitter = _build_text_splitter()
-        split_docs: List[Document] = []
-        for d, cleaned in zip(page_docs, cleaned_pages):
-            parts = splitter.split_text(cleaned)
-            for idx, part in enumerate(parts):
-                meta = dict(getattr(d, "metadata", {}))
+        layout_titles: list[dict] = []
+        if with_layout:
+            layout_titles = _get_or_build_layout_titles(_doc_id_from_pdf_path(pdf_path), pdf_path)
+        return {
+            "mode": "pages",
+            "pages": [
+                {"page_content": d.page_content, "metadata": dict(getattr(d, "metadata", {}))}
+                for d in page_docs
+            ],
+            "layout_titles": layout_titles,
+        }
+
+    print("Page-aware load produced no text; falling back to raw text")
+    return {"mode": "raw", "text": extract_text_from_pdf(pdf_path)}
+
+def _clean_extracted(extracted: Dict[str, Any]) -> List[Dict[str, Any]]:
+    """Cleaning stage: returns text units ({"text", "metadata"}) ready to chunk."""
+    if extracted.get("mode") != "pages":
+        paragraphs = split_into_paragraphs_or_clauses(extracted.get("text", ""))
+        return [{"text": para, "metadata": {"para_index": i}} for i, para in enumerate(paragraphs)]
+    pages = extracted.get("pages", [])
+    # Remove headers/footers/page numbers using cross-page frequency
+    page_texts = [p["page_content"] for p in pages]
+    header_set, footer_set = _find_common_header_footer_lines(page_texts)
+    return [
+        {"text": _clean_page_text(p["page_content"], header_set, footer_set), "metadata": p["metadata"]}
+        for p in pages
+    ]
+
+def _titles_by_page(layout_titles: list[dict]) -> Dict[int, list[str]]:
+    titles_by_page: Dict[int, list[str]] = {}
+    for t in layout_titles:
+        p = t.get("page")
+        if p is not None:
+            titles_by_page.setdefault(int(p), []).append(t.get("text", "").strip())
+    return titles_by_page
+
+# Cleaned units joined with this form the "document text" that chunk
+# `char_start` and clause index spans both point into
+_UNIT_SEPARATOR = "\n\n"
+
+def _unit_offsets(units: List[Dict[str, Any]]) -> List[int]:
+    offsets: List[int] = []
+    pos = 0
+    for unit in units:
+        offsets.append(pos)
+        pos += len(unit["text"]) + len(_UNIT_SEPARATOR)
+    return offsets
+
+def _chunk_units(units: List[Dict[str, Any]], layout_titles: list[dict]) -> List[Document]:
+    """Chunking stage."""
+    from langchain.schema import Document
+
+    titles_by_page = _titles_by_page(layout_titles)
+    splitter = _build_text_splitter()
+    split_docs: List[Document] = []
+    for unit, offset in zip(units, _unit_offsets(units)):
+        for idx, piece in enumerate(splitter.create_documents([unit["text"]])):
+            part = piece.page_content
+            meta = dict(unit["metadata"])
+            if piece.metadata.get("start_index", -1) >= 0:
+                meta["char_start"] = offset + piece.metadata["start_index"]
+            if "para_index" in meta:
+                meta["chunk"] = idx
+            else:
                 meta.update({"page": meta.get("page", meta.get("page_number")), "chunk": idx})
                 # Attach ML-detected titles for the page if available (helps downstream heuristics)
                 page_num = meta.get("page")
                 if page_num in titles_by_page:
                     meta["layout_titles"] = titles_by_page[page_num]
-                split_docs.append(Document(page_content=part, metadata=meta))
-        if split_docs:
-            return split_docs
-    except Exception as e:
-        print("PyMuPDF page-aware load failed; trying PyPDFLoader:", e)
-        try:
-            pypdf_loader = PyPDFLoader(pdf_path)
-            page_docs = pypdf_loader.load()
-            doc_id = _doc_id_from_pdf_path(pdf_path)
-            layout_titles = _get_or_build_layout_titles(doc_id, pdf_path)
-            titles_by_page = {}
-            for t in layout_titles:
-                p = t.get("page")
-                if p is not None:
-                    titles_by_page.setdefault(int(p), []).append(t.get("text", "").strip())
-            page_texts = [d.page_content for d in page_docs]
-            header_set, footer_set = _find_common_header_footer_lines(page_texts)
-            cleaned_pages = [_clean_page_text(t, header_set, footer_set) for t in page_texts]
-            splitter = _build_text_splitter()
-            split_docs: List[Document] = []
-            for d, cleaned in zip(page_docs, cleaned_pages):
-                parts = splitter.split_text(cleaned)
-                for idx, part in enumerate(parts):
-                    meta = dict(getattr(d, "metadata", {}))
-                    meta.update({"page": meta.get("page", meta.get("page_number")), "chunk": idx})
-                    page_num = meta.get("page")
-                    if page_num in titles_by_page:
-                        meta["layout_titles"] = titles_by_page[page_num]
-                    split_docs.append(Document(page_content=part, metadata=meta))
-            if split_docs:
-                return split_docs
-        except Exception as e2:
-            print("PyPDFLoader page-aware load failed; falling back to raw text:", e2)
-
-    text = extract_text_from_pdf(pdf_path)
-    paragraphs = split_into_paragraphs_or_clauses(text)
-    splitter = _build_text_splitter()
-    split_docs = []
-    for i, para in enumerate(paragraphs):
-        for j, part in enumerate(splitter.split_text(para)):
-            split_docs.append(Document(page_content=part, metadata={"para_index": i, "chunk": j}))
+            split_docs.append(Document(page_content=part, metadata=meta))
     return split_docs
 
+def _build_clause_index(units: List[Dict[str, Any]], layout_titles: list[dict]) -> Dict[str, Any]:
+    """Clause stage: number, title, page, span and display text of every clause.
+
+    Spans are offsets into the units joined by `_UNIT_SEPARATOR`, the same
+    coordinates as chunk `char_start`. Documents without a plausible clause
+    structure get an empty index and are served by similarity search alone.
+    """
+    import bisect
+
+    norm = _normalize_clause_text(_UNIT_SEPARATOR.join(u["text"] for u in units))
+    spans = _clause_spans(norm)
+    if not _plausible_clause_count(len(spans), len(norm)):
+        return {"clauses": []}
+    offsets = _unit_offsets(units)
+    titles_by_page = _titles_by_page(layout_titles)
+    clauses: List[Dict[str, Any]] = []
+    for start, end, number in spans:
+        meta = units[bisect.bisect_right(offsets, start) - 1]["metadata"]
+        page = meta.get("page", meta.get("page_number"))
+        _no, title, text = _describe_clause(norm[start:end], titles_by_page.get(page, []))
+        clauses.append({"number": number, "title": title, "page": page, "start": start, "end": end, "text": text})
+    return {"clauses": clauses}
 
-def _get_retriever(doc_id: str):
-    if doc_id in _DOC_CACHE and "retriever" in _DOC_CACHE[doc_id]:
-        return _DOC_CACHE[doc_id]["retriever"]
+def load_lease_docs(pdf_path: str) -> List[Document]:
+    extracted = _extract_pages(pdf_path)
+    docs = _chunk_units(_clean_extracted(extracted), extracted.get("layout_titles", []))
+    if not docs and extracted.get("mode") == "pages":
+        # Cleaning removed everything (e.g. only headers/page numbers survived)
+        extracted = {"mode": "raw", "text": extract_text_from_pdf(pdf_path)}
+        docs = _chunk_units(_clean_extracted(extracted), [])
+    return docs
+
+
+def _build_retriever(vs: FAISS, docs: List[Document]) -> HybridRetriever:
+    # Scores come from the vectors in `vs`, whose docstore holds the same chunks as `docs`
+    from backend.hybrid_retrieval import HybridRetriever
+    return HybridRetriever.from_vectorstore(vs, _get_embeddings())
+
+def _cached_retriever(doc_id: str) -> HybridRetriever:
+    cached = _fresh_cache_entry(doc_id)
+    if cached is not None and "retriever" in cached:
+        doc_store.record_lookup("memory")
+        return cached["retriever"]
     vs, docs = _get_or_build_vectorstore_for_doc(doc_id)
-    emb_retriever = vs.as_retriever(search_type="mmr", search_kwargs={"k": 12, "fetch_k": 40})
-    bm25 = BM25Retriever.from_documents(docs)
-    bm25.k = 12
-    ensemble = EnsembleRetriever(retrievers=[emb_retriever, bm25], weights=[0.65, 0.35])
-    filter = EmbeddingsFilter(embeddings=OpenAIEmbeddings(model="text-embedding-3-small"), k=8, similarity_threshold=0.35)
-    retriever = ContextualCompressionRetriever(base_compressor=filter, base_retriever=ensemble)
-    _DOC_CACHE[doc_id]["retriever"] = retriever
+    retriever = _build_retriever(vs, docs)
+    entry = _DOC_CACHE.get(doc_id)
+    if entry is not None and entry.get("vectorstore") is vs:
+        entry["retriever"] = retriever
     return retriever
 
-def run_rag_pipeline(pdf_path: str, question: str):
-    doc_id = _doc_id_from_pdf_path(pdf_path)
-    retriever = _get_retriever(doc_id)
-
-    SYSTEM = """
-    You are a contract analyst reviewing a commercial lease agreement. Based on the provided context,
-    answer the user's question. Return your answer in plain English.
-    """
+def _get_retriever(doc_id: str) -> HybridRetriever:
+    _mark_doc_used(doc_id)
+    return _cached_retriever(doc_id)
 
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", SYSTEM.strip()),
-        ("human", "Context:\n{context}\n\nQuestion: {question}")
-    ])
+# Partial indexes published by a progressive build, per doc:
+# {"progress": <progress.json>, "retriever": ...}
+_PARTIAL_CACHE: Dict[str, Dict[str, Any]] = {}
 
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
+def _load_partial_index(doc_id: str) -> Optional[Dict[str, Any]]:
+    """Latest partial snapshot of a doc still being built, from any worker."""
+    from langchain_community.vectorstores import FAISS
 
-    llm = ChatOpenAI(model="gpt-4o", temperature=0)
+    root = _partial_root(doc_id)
+    progress = _read_json_artifact(root / "progress.json")
+    cached = _PARTIAL_CACHE.get(doc_id)
+    if progress is None or (cached is not None and cached["progress"] == progress):
+        return cached
+    try:
+        index, docstore, index_to_docstore_id = _read_saved_index(root / progress["snapshot"])
+    except Exception as e:
+        # Superseded and removed while we read it; the next call sees the newer one
+        print("Could not load partial index:", e)
+        return cached
+    vs = FAISS(_get_embeddings(), index, docstore, index_to_docstore_id)
+    docs = [docstore.search(index_to_docstore_id[i]) for i in range(index.ntotal)]
+    entry = {"progress": progress, "retriever": _build_retriever(vs, docs)}
+    _PARTIAL_CACHE[doc_id] = entry
+    return entry
+
+def _full_coverage(doc_id: str) -> Dict[str, Any]:
+    pages = _load_manifest(doc_id).get("pages")
+    return {"complete": True, "pages_indexed": pages, "pages_total": pages}
+
+def _build_in_background(doc_id: str) -> Future:
+    """Future for the doc's index, joining an in-flight build if there is one."""
+    with _BUILDS_LOCK:
+        future = _BUILDS_IN_FLIGHT.get(doc_id)
+    if future is not None:
+        return future
+    future = Future()
+
+    def _run() -> None:
+        try:
+            future.set_result(_get_or_build_vectorstore_for_doc(doc_id))
+        except BaseException as e:
+            future.set_exception(e)
 
-    rag_chain = (
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
+    threading.Thread(target=_run, name=f"build-{doc_id[:8]}", daemon=True).start()
+    return future
 
-    return rag_chain.invoke(question)
+def _get_serving_retriever(doc_id: str) -> tuple[Any, Dict[str, Any]]:
+    """Retriever for answering now, plus how much of the doc it covers.
 
+    Uses the full index when it is ready; while a first build is running
+    (in this or another worker) it serves the newest partial snapshot.
+    """
+    from concurrent.futures import TimeoutError as FutureTimeout
 
-def evaluate_general_risks(pdf_path: str):
-    print("🔍 Starting risk evaluation...")
-    doc_id = _doc_id_from_pdf_path(pdf_path)
-    retriever = _get_retriever(doc_id)
+    if _fresh_cache_entry(doc_id) is None:
+        future = _build_in_background(doc_id)
+        while True:
+            try:
+                future.result(timeout=0.25)
+                break
+            except FutureTimeout:
+                partial = _load_partial_index(doc_id)
+                if partial is not None:
+                    _mark_doc_used(doc_id)
+                    doc_store.record_lookup("partial")
+                    progress = partial["progress"]
+                    return partial["retriever"], {
+                        "complete": False,
+                        "pages_indexed": progress["pages_indexed"],
+                        "pages_total": progress["pages_total"],
+                    }
+    _PARTIAL_CACHE.pop(doc_id, None)
+    return _get_retriever(doc_id), _full_coverage(doc_id)
+
+# Prompts. Each system prompt is a fixed string sent ahead of the per-call
+# context, so the request prefix stays byte-identical across calls and can
+# be served from the provider's prompt cache. Bump a prompt's version when
+# its text changes; chains are compiled once per (model, prompt version).
+_RAG_SYSTEM = """
+    You are a contract analyst reviewing a commercial lease agreement. Based on the provided context,
+    answer the user's question. Return your answer in plain English.
+    """
+_RAG_HUMAN = "Context:\n{context}\n\nQuestion: {question}"
 
-    SYSTEM = """
+_RISK_SYSTEM = """
     You are a risk analyst evaluating a lease document. You are an analyst for a firm that is purchasing or puttng together commercial real-estate deals, so the risk should be from the perspective of the lessor. Based on the following context, score the lease across the following general risk categories from 1 (high risk) to 10 (low risk) and explain each score:
 
     - Cash Flow Adjustments:
@@ -645,25 +1800,162 @@ def evaluate_general_risks(pdf_path: str):
 
     Do not include any commentary or markdown — only valid JSON.
     """
+_RISK_HUMAN = "Context:\n{context}\n\nEvaluate the lease risks."
 
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", SYSTEM.strip()),
-        ("human", "Context:\n{context}\n\nEvaluate the lease risks.")
-    ])
+_ABNORMALITY_SYSTEM = """
+    You are an expert lease reviewer. Identify any unusual, uncommon, or non-standard clauses in this lease.
+    For each item, assess whether it is beneficial to the landlord/lessor or harmful to the landlord/lessor.
+    Only return items that deviate from common practice. If everything is normal, return an empty list.
 
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
+    Return strictly JSON as a list of objects with fields:
+    [
+      {{"text": str, "impact": "beneficial" | "harmful" | "neutral"}}
+    ]
+    Do not include any markdown or commentary outside JSON.
+    """
+_ABNORMALITY_HUMAN = "Context:\n{context}\n\nIdentify abnormalities with impact for landlord."
+
+# name -> (version, system, human)
+_PROMPTS: Dict[str, tuple[str, str, str]] = {
+    "rag": ("1", _RAG_SYSTEM, _RAG_HUMAN),
+    "risks": ("1", _RISK_SYSTEM, _RISK_HUMAN),
+    "abnormalities": ("1", _ABNORMALITY_SYSTEM, _ABNORMALITY_HUMAN),
+}
+_CHAINS: Dict[tuple[str, str, str], Any] = {}
+_CHAINS_LOCK = threading.Lock()
+
+def _get_chain(name: str, model: str = "gpt-4o"):
+    """The compiled prompt | model | parser chain for a named prompt."""
+    version, system, human = _PROMPTS[name]
+    key = (name, model, version)
+    chain = _CHAINS.get(key)
+    if chain is not None:
+        return chain
+    with _CHAINS_LOCK:
+        chain = _CHAINS.get(key)
+        if chain is None:
+            from langchain.prompts import ChatPromptTemplate
+            from langchain_openai import ChatOpenAI
+            from backend.llm_dispatch import DispatchedChatChain
+
+            prompt = ChatPromptTemplate.from_messages([("system", system.strip()), ("human", human)])
+            llm = ChatOpenAI(model=model, temperature=0, max_retries=0)
+            chain = DispatchedChatChain(f"{name}@{version}", prompt, llm, model)
+            _CHAINS[key] = chain
+    return chain
+
+def _format_context(docs: List[Document]) -> str:
+    return "\n\n".join(doc.page_content for doc in docs)
 
-    llm = ChatOpenAI(model="gpt-4o", temperature=0)
+def run_rag_pipeline(pdf_path: str, question: str):
+    return answer_question(pdf_path, question)["answer"]
 
-    chain = (
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
+def answer_question(pdf_path: str, question: str) -> Dict[str, Any]:
+    """Answer a question, from the partial index if the doc is still being built.
+
+    Returns {"answer": str, "coverage": {"complete", "pages_indexed", "pages_total"}}.
+    """
+    from backend.llm_dispatch import priority as llm_priority, INTERACTIVE
+
+    doc_id = _doc_id_from_pdf_path(pdf_path)
+    retriever, coverage = _get_serving_retriever(doc_id)
+    chain = _get_chain("rag")
+
+    with llm_priority(INTERACTIVE):
+        context = _format_context(retriever.invoke(question))
+        return {"answer": chain.invoke({"context": context, "question": question}), "coverage": coverage}
+
+
+def _batch_retrieve(doc_id: str, questions: List[str]) -> List[List[Document]]:
+    """Hybrid retrieval for many questions from one batched embedding call."""
+    return [
+        [hit["document"] for hit in hits]
+        for hits in _cached_retriever(doc_id).search_batch(questions)
+    ]
+
+def iter_batch_answers(pdf_path: str, questions: List[str], max_concurrency: Optional[int] = None):
+    """Answer many questions about one doc, yielding (index, answer) as each completes.
+
+    Retrieval is batched (see `_batch_retrieve`); the LLM calls run
+    concurrently, bounded by max_concurrency (LEASE_BATCH_CONCURRENCY,
+    default 4) and by the chat dispatcher's own budgets.
+    """
+    import contextvars
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    from backend.llm_dispatch import priority as llm_priority, INTERACTIVE
+
+    doc_id = _doc_id_from_pdf_path(pdf_path)
+    _mark_doc_used(doc_id)
+    if max_concurrency is None:
+        max_concurrency = int(os.getenv("LEASE_BATCH_CONCURRENCY", "4"))
+    chain = _get_chain("rag")
+
+    def _answer(question: str, context_docs: List[Document]) -> str:
+        context = _format_context(context_docs)
+        try:
+            return chain.invoke({"context": context, "question": question})
+        except Exception as e:
+            print("Batch question failed:", e)
+            return "Could not answer this question right now. Please try again."
+
+    with ThreadPoolExecutor(max_workers=max(1, max_concurrency)) as pool:
+        # The priority must not be held across `yield`: a streaming response
+        # resumes this generator in a fresh context each time, and resetting
+        # the var there fails. Worker threads don't inherit contextvars, so
+        # each submission carries a copy taken while the priority is set.
+        with llm_priority(INTERACTIVE):
+            contexts = _batch_retrieve(doc_id, questions)
+            futures = {
+                pool.submit(contextvars.copy_context().run, _answer, q, ctx): i
+                for i, (q, ctx) in enumerate(zip(questions, contexts))
+            }
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+def answer_questions_batch(pdf_path: str, questions: List[str], max_concurrency: Optional[int] = None) -> List[str]:
+    answers: List[str] = [""] * len(questions)
+    for index, answer in iter_batch_answers(pdf_path, questions, max_concurrency):
+        answers[index] = answer
+    return answers
+
+
+# LLM analyses are cached per doc, keyed by their exact prompt input. A
+# near-duplicate first looks in its base doc's cache: when its changed pages
+# do not reach the retrieved context, the prompt is identical and the base's
+# answer is reused without a model call.
+def _analysis_path(doc_id: str, kind: str) -> Path:
+    return _temp_root() / doc_id / f"analysis_{kind}.json"
+
+def _cached_analysis(doc_id: str, kind: str, system: str, context: str, run) -> str:
+    key = md5(f"{system}\0{context}".encode("utf-8")).hexdigest()
+    lineage = get_document_lineage(doc_id)
+    sources = [doc_id] + ([lineage["base_doc_id"]] if lineage else [])
+    for source in sources:
+        cached = _read_json_artifact(_analysis_path(source, kind))
+        if cached is not None and cached.get("key") == key:
+            if source != doc_id:
+                print(f"Reusing {kind} analysis of {source}; changed pages do not affect it")
+                doc_store.write_json(_analysis_path(doc_id, kind), cached)
+            return cached["output"]
+    output = run()
+    doc_store.write_json(_analysis_path(doc_id, kind), {"key": key, "output": output})
+    return output
+
+def _forget_analysis(doc_id: str, kind: str) -> None:
+    # Unparseable output is not worth keeping; the next call asks again
+    doc_store.remove_sidecar(_analysis_path(doc_id, kind))
 
-    raw_output = chain.invoke("Evaluate the lease risks.")
+def evaluate_general_risks(pdf_path: str):
+    from backend.llm_dispatch import priority as llm_priority, BACKGROUND
+
+    print("🔍 Starting risk evaluation...")
+    doc_id = _doc_id_from_pdf_path(pdf_path)
+    retriever = _get_retriever(doc_id)
+    chain = _get_chain("risks")
+
+    with llm_priority(BACKGROUND):
+        context = _format_context(retriever.invoke("Evaluate the lease risks."))
+        raw_output = _cached_analysis(doc_id, "risks", _RISK_SYSTEM, context, lambda: chain.invoke({"context": context}))
 
     try:
         cleaned = raw_output.strip()
@@ -675,6 +1967,7 @@ def evaluate_general_risks(pdf_path: str):
         return result
     except Exception as e:
         print("⚠️ LLM returned invalid JSON:\n", raw_output)
+        _forget_analysis(doc_id, "risks")
         return {
             "termination_risk": {"score": None, "explanation": "Could not parse response."},
             "financial_exposure": {"score": None, "explanation": "Could not parse response."},
@@ -685,38 +1978,15 @@ def evaluate_general_risks(pdf_path: str):
         }
         
 def detect_abnormalities(pdf_path: str):
+    from backend.llm_dispatch import priority as llm_priority, BACKGROUND
+
     doc_id = _doc_id_from_pdf_path(pdf_path)
     retriever = _get_retriever(doc_id)
+    chain = _get_chain("abnormalities")
 
-    SYSTEM = """
-    You are an expert lease reviewer. Identify any unusual, uncommon, or non-standard clauses in this lease.
-    For each item, assess whether it is beneficial to the landlord/lessor or harmful to the landlord/lessor.
-    Only return items that deviate from common practice. If everything is normal, return an empty list.
-
-    Return strictly JSON as a list of objects with fields:
-    [
-      {{"text": str, "impact": "beneficial" | "harmful" | "neutral"}}
-    ]
-    Do not include any markdown or commentary outside JSON.
-    """
-
-    prompt = ChatPromptTemplate.from_messages([
-        ("system", SYSTEM.strip()),
-        ("human", "Context:\n{context}\n\nIdentify abnormalities with impact for landlord.")
-    ])
-
-    def format_docs(docs):
-        return "\n\n".join(doc.page_content for doc in docs)
-
-    llm = ChatOpenAI(model="gpt-4o", temperature=0)
-    chain = (
-        {"context": retriever | format_docs, "question": RunnablePassthrough()}
-        | prompt
-        | llm
-        | StrOutputParser()
-    )
-
-    result = chain.invoke("Identify abnormalities with impact for landlord.")
+    with llm_priority(BACKGROUND):
+        context = _format_context(retriever.invoke("Identify abnormalities with impact for landlord."))
+        result = _cached_analysis(doc_id, "abnormalities", _ABNORMALITY_SYSTEM, context, lambda: chain.invoke({"context": context}))
     print(result)
     def _robust_parse(text: str):
         cleaned = text.strip()
@@ -766,127 +2036,183 @@ def detect_abnormalities(pdf_path: str):
             return [{"text": parsed.get("text", ""), "impact": impact}]
         return [{"text": "No abnormalities found.", "impact": "beneficial"}]
     except Exception:
+        _forget_analysis(doc_id, "abnormalities")
         return [{"text": "Could not parse LLM response.", "impact": "harmful"}]
 
 
-def get_clauses_for_topic(pdf_path: str, topic: str):
-    from sklearn.metrics.pairwise import cosine_similarity
-    import numpy as np
-
-    doc_id = _doc_id_from_pdf_path(pdf_path)
-    vectorstore, docs = _get_or_build_vectorstore_for_doc(doc_id)
-    embeddings = OpenAIEmbeddings(model="text-embedding-3-small")
-
-    topic_embedding = embeddings.embed_query(topic)
-    stored_embeddings = vectorstore.index.reconstruct_n(0, vectorstore.index.ntotal)
-    stored_docs = list(vectorstore.docstore._dict.values())
-
-    similarities = cosine_similarity([topic_embedding], stored_embeddings)[0]
-    doc_scores = list(zip(stored_docs, similarities))
-
-    threshold = 0.65
-    filtered = [(doc, score) for doc, score in doc_scores if score >= threshold]
-    if not filtered:
-        filtered = sorted(doc_scores, key=lambda x: x[1], reverse=True)[:3]
+def _clause_key(number: str) -> tuple[int, ...]:
+    # "23.02", "23.2" and "23,02" name the same clause
+    return tuple(int(part) for part in number.replace(",", ".").split("."))
+
+def _get_clause_index(doc_id: str) -> Dict[str, Any]:
+    """A doc's clause index, cached per doc and reloaded when clauses.json changes."""
+    _get_or_build_vectorstore_for_doc(doc_id)
+    path = _clause_index_path(doc_id)
+    stamp = doc_store.sidecar_mtime(path)
+    if stamp is None:
+        # Built before the clause stage existed; the migrator will add it
+        return {"clauses": [], "starts": [], "by_key": {}}
+    entry = _fresh_cache_entry(doc_id)
+    if entry is not None and entry.get("clauses", {}).get("stamp") == stamp:
+        return entry["clauses"]
+    clauses = (_read_json_artifact(path) or {}).get("clauses", [])
+    by_key: Dict[tuple[int, ...], List[int]] = {}
+    for i, clause in enumerate(clauses):
+        by_key.setdefault(_clause_key(clause["number"]), []).append(i)
+    index = {"stamp": stamp, "clauses": clauses, "starts": [c["start"] for c in clauses], "by_key": by_key}
+    if entry is not None:
+        entry["clauses"] = index
+    return index
+
+def _lookup_clause_reference(index: Dict[str, Any], topic: str) -> Optional[List[str]]:
+    """Answer "Section 23.02"-style topics from the clause index.
+
+    A whole number ("Article 12") also returns its sub-clauses (12.01, ...).
+    Returns None when the topic is not a reference or names no known clause.
+    """
+    match = _CLAUSE_REFERENCE_RE.match(topic)
+    if not match or not index["clauses"]:
+        return None
+    key = _clause_key(match.group(1))
+    positions = list(index["by_key"].get(key, []))
+    if len(key) == 1:
+        positions += [i for k, ids in index["by_key"].items() if len(k) == 2 and k[0] == key[0] for i in ids]
+    if not positions:
+        return None
+    return [index["clauses"][i]["text"] for i in sorted(set(positions))]
 
-    def _format_clause(raw_text: str, meta: dict | None = None) -> str:
-        import re as _re
+def _clauses_overlapping(index: Dict[str, Any], start: int, end: int) -> List[Dict[str, Any]]:
+    import bisect
 
-        text = raw_text.strip()
-        lines = [ln.strip() for ln in text.splitlines() if ln.strip()]
-        header_line = lines[0] if lines else ""
+    clauses = index["clauses"]
+    # Clauses are sorted and disjoint, so ends increase with starts
+    i = bisect.bisect_left(index["starts"], end) - 1
+    hits: List[Dict[str, Any]] = []
+    while i >= 0 and clauses[i]["end"] > start:
+        hits.append(clauses[i])
+        i -= 1
+    return hits[::-1]
 
-        # Try to extract clause number and optional title from the first line
-        # Patterns like: "Section 5.2 Title", "5.2 Title", "Clause 7 - Title", "Article 12: Title"
-        header_match = _re.match(r"^(?:Section|Clause|Article)?\s*(\d{1,2}(?:\.\d{1,2})?)\s*[-:.)]?\s*(.*)$", header_line, _re.IGNORECASE)
-        # Heuristics: treat as a real header only if the line is short and not a cross-reference
-        forbidden_words = r"\b(below|above|pursuant|provided|as defined|per|see)\b"
-        looks_short = len(header_line) <= 80
-        not_cross_ref = not _re.search(forbidden_words, header_line, _re.IGNORECASE)
+def get_clauses_for_topic(pdf_path: str, topic: str):
+    doc_id = _doc_id_from_pdf_path(pdf_path)
+    _mark_doc_used(doc_id)
+    index = _get_clause_index(doc_id)
 
-        is_real_header = bool(header_match) and looks_short and not_cross_ref
+    # Exact references need no embedding call
+    exact = _lookup_clause_reference(index, topic)
+    if exact is not None:
+        return exact
 
-        if is_real_header:
-            clause_no = header_match.group(1)
-            clause_title = header_match.group(2).strip()
-        else:
-            # Fallback: try to find a leading number anywhere
-            any_num = _re.search(r"(\d{1,2}(?:\.\d{1,2})?)", header_line)
-            clause_no = any_num.group(1) if any_num else ""
-            clause_title = header_line if is_real_header else ""
-
-        # Use ML layout titles (if present in metadata) to boost heading detection deterministically
-        layout_titles = []
-        if isinstance(meta, dict):
-            layout_titles = [t.strip() for t in meta.get("layout_titles", []) if isinstance(t, str)]
-        def _norm(s: str) -> str:
-            return _re.sub(r"\s+", " ", s or "").strip().lower()
-        norm_header = _norm(header_line)
-        if not is_real_header and layout_titles:
-            for t in layout_titles:
-                nt = _norm(t)
-                starts_with_title = _norm(text).startswith(nt)
-                header_eq_title = norm_header.startswith(nt) or nt.startswith(norm_header)
-                if len(nt) > 4 and (starts_with_title or header_eq_title):
-                    clause_title = t.strip()
-                    num_match = _re.match(r"^(?:Section|Clause|Article)?\s*(\d{1,2}(?:\.\d{1,2})?)\b", text, _re.IGNORECASE)
-                    if num_match:
-                        clause_no = num_match.group(1)
-                    is_real_header = True
-                    break
-
-        # Body paragraphs: split by blank lines; ensure each paragraph is one line
-        body_text = text
-        # Remove the header line from body only if we confidently detected a header
-        if is_real_header and header_line and len(lines) > 1:
-            body_text = "\n".join(lines[1:])
-        paragraphs = [p.strip() for p in _re.split(r"\n{2,}", body_text) if p.strip()]
-        # Normalize each paragraph to a single line (replace internal newlines with spaces)
-        normalized_paragraphs = [" ".join(p.split()) for p in paragraphs] or [" ".join(body_text.split())]
-
-        # Compose heading and paragraphs
-        heading_parts = []
-        if clause_no:
-            heading_parts.append(clause_no)
-        if clause_title:
-            heading_parts.append(clause_title)
-        heading = " ".join(heading_parts).strip()
-        # If ML layout titles exist for the page, and the clause title is empty, try to use the first title
-        # Note: this function formats text only; we do not have metadata here, so this fallback is limited.
-        if not heading:
-            # If we couldn't confidently detect a header, avoid misleading header text
-            formatted = "\n".join(["  " + para for para in normalized_paragraphs])
-        else:
-            formatted = heading + ":\n" + "\n".join(["  " + para for para in normalized_paragraphs])
-        return formatted.strip()
-
-    # Further split within a single chunk if multiple headers exist inline (e.g., "23.02 ... 23.03 ...")
-    def _split_inline_headers(text: str) -> list[str]:
-        import re as _re
-        # Normalize 23,03 -> 23.03
-        t = _re.sub(r"(\d),(\d)", r"\\1.\\2", text)
-        # Boundary: start, newline, or punctuation+space; avoid subsection like (b)
-        pattern = _re.compile(
-            r"(?:(?<=^)|(?<=\n)|(?<=[\.!?]\s))(?=(?:Section|Clause|Article)?\s*\d{1,2}(?:\.\d{1,2})?\s*(?:[:\-\.]\s+)?(?!\())",
-            _re.IGNORECASE,
-        )
-        parts: list[str] = []
-        last = 0
-        for m in pattern.finditer(t):
-            idx = m.start()
-            if idx > last:
-                seg = t[last:idx].strip()
-                if seg:
-                    parts.append(seg)
-            last = idx
-        tail = t[last:].strip()
-        if tail:
-            parts.append(tail)
-        return parts or [text]
+    retriever = _cached_retriever(doc_id)
+    positions = retriever.similar(topic, threshold=0.65)
 
     formatted: list[str] = []
-    for doc, _score in filtered:
+    seen: set[int] = set()
+    for pos in positions:
+        doc = retriever.docs[int(pos)]
         meta = getattr(doc, "metadata", {})
+        start = meta.get("char_start")
+        hits = _clauses_overlapping(index, start, start + len(doc.page_content)) if start is not None else []
+        if hits:
+            # Pre-formatted at ingest; a clause spanning several hit chunks is returned once
+            for clause in hits:
+                if clause["start"] not in seen:
+                    seen.add(clause["start"])
+                    formatted.append(clause["text"])
+            continue
         for segment in _split_inline_headers(doc.page_content):
             formatted.append(_format_clause(segment, meta))
     return formatted
+
+
+def _mark_doc_used(doc_id: str) -> None:
+    try:
+        doc_state.touch_document(doc_id)
+    except Exception as e:
+        print("Failed to record document access:", e)
+
+
+def _recent_doc_ids(limit: int) -> list[str]:
+    try:
+        recent = doc_state.recent_doc_ids(limit)
+    except Exception as e:
+        print("Failed to read recent documents:", e)
+        return []
+    return [d for d in recent if (_temp_root() / d / "lease.pdf").exists()]
+
+
+def preload_heavy_modules(groups: tuple[str, ...] = ("core",)) -> Dict[str, float]:
+    """Import the deferred third-party modules for the given groups.
+
+    Returns the seconds spent per group. Missing optional modules are
+    reported and skipped so that warm-up never prevents the app from starting.
+    """
+    import importlib
+
+    timings: Dict[str, float] = {}
+    for group in groups:
+        started = time.perf_counter()
+        for name in _HEAVY_MODULES.get(group, ()):
+            try:
+                importlib.import_module(name)
+            except Exception as e:
+                print(f"Preload of {name} failed:", e)
+        timings[group] = round(time.perf_counter() - started, 3)
+    return timings
+
+
+def warm_doc_cache(doc_ids: list[str]) -> Dict[str, Any]:
+    """Load FAISS index, chunks and retriever for each doc into `_DOC_CACHE`."""
+    warmed: list[str] = []
+    failed: Dict[str, str] = {}
+    started = time.perf_counter()
+    for doc_id in doc_ids:
+        if not (_temp_root() / doc_id / "lease.pdf").exists():
+            failed[doc_id] = "not found"
+            continue
+        try:
+            _get_retriever(doc_id)
+            warmed.append(doc_id)
+        except Exception as e:
+            failed[doc_id] = str(e)
+    return {"warmed": warmed, "failed": failed, "seconds": round(time.perf_counter() - started, 3)}
+
+
+def run_startup_warmup() -> Dict[str, Any]:
+    """Preload heavy imports and warm recently used documents.
+
+    Configured via environment variables:
+      LEASE_PRELOAD_GROUPS  comma-separated import groups (default "core";
+                            "layout" and "ocr" are also available)
+      LEASE_WARM_DOC_IDS    comma-separated doc ids to warm explicitly
+      LEASE_WARM_RECENT     number of most recently used docs to warm (default 3)
+    """
+    groups = tuple(g.strip() for g in os.getenv("LEASE_PRELOAD_GROUPS", "core").split(",") if g.strip())
+    explicit = [d.strip() for d in os.getenv("LEASE_WARM_DOC_IDS", "").split(",") if d.strip()]
+    try:
+        recent_limit = int(os.getenv("LEASE_WARM_RECENT", "3"))
+    except ValueError:
+        recent_limit = 3
+
+    started = time.perf_counter()
+    import_timings = preload_heavy_modules(groups)
+    chains_started = time.perf_counter()
+    for name in _PROMPTS:
+        try:
+            _get_chain(name)
+        except Exception as e:
+            print(f"Compiling the {name} chain failed:", e)
+    import_timings["chains"] = round(time.perf_counter() - chains_started, 3)
+    doc_ids = list(dict.fromkeys(explicit + _recent_doc_ids(recent_limit)))
+    warm = warm_doc_cache(doc_ids)
+
+    _STARTUP_REPORT.clear()
+    _STARTUP_REPORT.update({
+        "import_seconds": import_timings,
+        "warm_seconds": warm["seconds"],
+        "warmed_doc_ids": warm["warmed"],
+        "failed_doc_ids": warm["failed"],
+        "total_seconds": round(time.perf_counter() - started, 3),
+    })
+    print("🚀 Startup warm-up:", _STARTUP_REPORT)
+    return dict(_STARTUP_REPORT)
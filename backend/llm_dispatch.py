@@ -0,0 +1,446 @@
+"""Rate-limit-aware dispatcher for OpenAI chat and embedding calls.
+
+Every model call in lease_chain goes through a dispatcher, which:
+
+- keeps requests-per-minute and tokens-per-minute under configured budgets
+  (token buckets), so bursts queue locally instead of hitting 429s;
+- coalesces identical in-flight requests: when many users open the same
+  lease, one `detect_abnormalities` prompt is sent and shared;
+- retries 429/5xx/connection errors with jittered exponential backoff,
+  honouring Retry-After when the server sends it;
+- serves waiting callers by priority, so interactive /ask traffic overtakes
+  background risk and abnormality analysis.
+
+Budgets are per dispatcher ("chat", "embedding") because OpenAI enforces
+limits per model. Configure with LEASE_<NAME>_RPM, LEASE_<NAME>_TPM and
+LEASE_<NAME>_CONCURRENCY, plus LEASE_LLM_MAX_RETRIES.
+"""
+from __future__ import annotations
+
+import contextvars
+import heapq
+import itertools
+import os
+import random
+import threading
+import time
+from concurrent.futures import Future
+from contextlib import contextmanager
+from hashlib import sha256
+from typing import Any, Callable, Dict, List, Optional, TypeVar
+
+from langchain_core.embeddings import Embeddings
+
+T = TypeVar("T")
+
+INTERACTIVE = 0
+BACKGROUND = 1
+
+_PRIORITY: contextvars.ContextVar[int] = contextvars.ContextVar("llm_priority", default=INTERACTIVE)
+
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+@contextmanager
+def priority(level: int):
+    """Run model calls made inside the block (including from langchain's
+    worker threads, which copy the context) at the given priority."""
+    token = _PRIORITY.set(level)
+    try:
+        yield
+    finally:
+        _PRIORITY.reset(token)
+
+
+def estimate_tokens(text: str) -> int:
+    # ~4 characters per token for English; exact counts aren't needed for pacing
+    return max(1, len(text) // 4)
+
+
+def request_key(*parts: Any) -> str:
+    return sha256(repr(parts).encode("utf-8")).hexdigest()
+
+
+class _TokenBucket:
+    """Refills `per_minute` units evenly over 60s; 0 disables the limit."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60.0)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        if self.capacity <= 0:
+            return 0.0
+        self._refill()
+        # A single oversized request may use the whole bucket rather than wait forever
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60.0 / self.capacity
+
+    def consume(self, amount: float) -> None:
+        if self.capacity > 0:
+            self.level -= min(amount, self.capacity)
+
+
+def _is_retryable(exc: BaseException) -> bool:
+    status = getattr(exc, "status_code", None)
+    if status is None:
+        status = getattr(getattr(exc, "response", None), "status_code", None)
+    if status is not None:
+        return status in _RETRYABLE_STATUS
+    # openai.APIConnectionError / APITimeoutError carry no status
+    return type(exc).__name__ in ("APIConnectionError", "APITimeoutError", "RateLimitError")
+
+
+def _retry_after(exc: BaseException) -> Optional[float]:
+    headers = getattr(getattr(exc, "response", None), "headers", None) or {}
+    for name in ("retry-after-ms", "retry-after"):
+        value = headers.get(name)
+        if value is None:
+            continue
+        try:
+            seconds = float(value)
+        except ValueError:
+            continue
+        return seconds / 1000.0 if name.endswith("-ms") else seconds
+    return None
+
+
+class LLMDispatcher:
+    def __init__(
+        self,
+        name: str,
+        rpm: int,
+        tpm: int,
+        max_concurrency: int,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 30.0,
+    ):
+        self.name = name
+        self.max_concurrency = max(1, max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._requests = _TokenBucket(rpm)
+        self._tokens = _TokenBucket(tpm)
+        self._cond = threading.Condition()
+        self._waiters: List[tuple[int, int]] = []
+        self._seq = itertools.count()
+        self._active = 0
+        # key -> (shared result, owner's wait slot; see _acquire)
+        self._inflight: Dict[str, tuple[Future, Dict[str, Any]]] = {}
+        self._stats = {
+            "calls": 0, "coalesced": 0, "boosted": 0, "attempts": 0, "retries": 0, "throttled_seconds": 0.0, "failures": 0,
+        }
+
+    def call(self, fn: Callable[[], T], *, key: Optional[str] = None, tokens: int = 1) -> T:
+        """Run `fn` under the budgets. Calls sharing `key` while one is in
+        flight wait for and share its result instead of issuing their own;
+        a higher-priority caller joining raises the shared call's priority."""
+        if key is None:
+            return self._run(fn, tokens)
+        level = _PRIORITY.get()
+        with self._cond:
+            self._stats["calls"] += 1
+            inflight = self._inflight.get(key)
+            is_owner = inflight is None
+            if is_owner:
+                future, slot = Future(), {"level": level, "ticket": None}
+                self._inflight[key] = (future, slot)
+            else:
+                future, slot = inflight
+                self._stats["coalesced"] += 1
+                if level < slot["level"]:
+                    self._boost(slot, level)
+        if not is_owner:
+            return future.result()
+        try:
+            result = self._run(fn, tokens, counted=True, slot=slot)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._cond:
+                self._inflight.pop(key, None)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                **self._stats,
+                "throttled_seconds": round(self._stats["throttled_seconds"], 3),
+                "active": self._active,
+                "waiting": len(self._waiters),
+                "in_flight_keys": len(self._inflight),
+            }
+
+    def _run(self, fn: Callable[[], T], tokens: int, counted: bool = False, slot: Optional[Dict[str, Any]] = None) -> T:
+        if not counted:
+            with self._cond:
+                self._stats["calls"] += 1
+        if slot is None:
+            slot = {"level": _PRIORITY.get(), "ticket": None}
+        for attempt in range(self.max_retries + 1):
+            self._acquire(slot, tokens)
+            try:
+                with self._cond:
+                    self._stats["attempts"] += 1
+                return fn()
+            except Exception as e:
+                if attempt >= self.max_retries or not _is_retryable(e):
+                    with self._cond:
+                        self._stats["failures"] += 1
+                    raise
+                # Full jitter keeps synchronized callers from retrying in lockstep
+                delay = _retry_after(e)
+                if delay is None:
+                    delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                print(f"{self.name} call failed ({type(e).__name__}); retry {attempt + 1} in {delay:.1f}s")
+                with self._cond:
+                    self._stats["retries"] += 1
+            finally:
+                self._release()
+            time.sleep(delay)
+        raise RuntimeError("unreachable")
+
+    def _boost(self, slot: Dict[str, Any], level: int) -> None:
+        # Caller holds self._cond. A queued owner keeps its place among
+        # equals (same sequence number) but moves up to the new level.
+        slot["level"] = level
+        self._stats["boosted"] += 1
+        ticket = slot["ticket"]
+        if ticket is not None:
+            self._waiters.remove(ticket)
+            slot["ticket"] = (level, ticket[1])
+            self._waiters.append(slot["ticket"])
+            heapq.heapify(self._waiters)
+            self._cond.notify_all()
+
+    def _acquire(self, slot: Dict[str, Any], tokens: int) -> None:
+        """Wait for a turn; `slot` holds the waiter's level and its heap ticket,
+        which `_boost` may replace while it waits."""
+        started = time.monotonic()
+        with self._cond:
+            slot["ticket"] = (slot["level"], next(self._seq))
+            heapq.heappush(self._waiters, slot["ticket"])
+            try:
+                while True:
+                    if self._waiters[0] == slot["ticket"] and self._active < self.max_concurrency:
+                        wait = max(self._requests.wait_time(1), self._tokens.wait_time(tokens))
+                        if wait <= 0:
+                            self._requests.consume(1)
+                            self._tokens.consume(tokens)
+                            heapq.heappop(self._waiters)
+                            slot["ticket"] = None
+                            self._active += 1
+                            self._stats["throttled_seconds"] += time.monotonic() - started
+                            # The next waiter may be able to go too
+                            self._cond.notify_all()
+                            return
+                        self._cond.wait(timeout=wait)
+                    else:
+                        self._cond.wait()
+            except BaseException:
+                self._waiters.remove(slot["ticket"])
+                slot["ticket"] = None
+                heapq.heapify(self._waiters)
+                self._cond.notify_all()
+                raise
+
+    def _release(self) -> None:
+        with self._cond:
+            self._active -= 1
+            self._cond.notify_all()
+
+
+_DEFAULTS = {
+    "chat": {"rpm": 500, "tpm": 150_000, "concurrency": 8},
+    "embedding": {"rpm": 3_000, "tpm": 1_000_000, "concurrency": 4},
+}
+_DISPATCHERS: Dict[str, LLMDispatcher] = {}
+_DISPATCHERS_LOCK = threading.Lock()
+
+
+def get_dispatcher(name: str) -> LLMDispatcher:
+    with _DISPATCHERS_LOCK:
+        dispatcher = _DISPATCHERS.get(name)
+        if dispatcher is None:
+            defaults = _DEFAULTS.get(name, _DEFAULTS["chat"])
+            prefix = f"LEASE_{name.upper()}_"
+            dispatcher = LLMDispatcher(
+                name,
+                rpm=int(os.getenv(prefix + "RPM", defaults["rpm"])),
+                tpm=int(os.getenv(prefix + "TPM", defaults["tpm"])),
+                max_concurrency=int(os.getenv(prefix + "CONCURRENCY", defaults["concurrency"])),
+                max_retries=int(os.getenv("LEASE_LLM_MAX_RETRIES", "6")),
+            )
+            _DISPATCHERS[name] = dispatcher
+        return dispatcher
+
+
+def dispatch_stats() -> Dict[str, Dict[str, Any]]:
+    with _DISPATCHERS_LOCK:
+        dispatchers = dict(_DISPATCHERS)
+    return {name: d.stats() for name, d in dispatchers.items()}
+
+
+class DispatchedEmbeddings(Embeddings):
+    """Embeddings wrapper that sends every call through the "embedding" dispatcher.
+
+    The wrapped client should be created with max_retries=0 so retries are
+    not stacked on top of the dispatcher's own.
+    """
+
+    def __init__(self, inner: Embeddings, model: str):
+        self.inner = inner
+        self.model = model
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        if not texts:
+            return []
+        return get_dispatcher("embedding").call(
+            lambda: self.inner.embed_documents(texts),
+            key=request_key("embed_documents", self.model, tuple(texts)),
+            tokens=sum(estimate_tokens(t) for t in texts),
+        )
+
+    def embed_query(self, text: str) -> List[float]:
+        return get_dispatcher("embedding").call(
+            lambda: self.inner.embed_query(text),
+            key=request_key("embed_query", self.model, text),
+            tokens=estimate_tokens(text),
+        )
+
+
+# Per-chain usage, keyed by label: how often each chain ran, what it cost in
+# tokens (and how much of the prompt the provider served from its prompt
+# cache), and how long calls spent outside the model
+_CHAIN_STATS: Dict[str, Dict[str, float]] = {}
+_CHAIN_STATS_LOCK = threading.Lock()
+
+
+def _add_chain_stats(label: str, **amounts: float) -> None:
+    with _CHAIN_STATS_LOCK:
+        stats = _CHAIN_STATS.setdefault(label, {
+            "calls": 0, "model_calls": 0, "input_tokens": 0, "cached_input_tokens": 0, "output_tokens": 0,
+            "overhead_seconds": 0.0, "queue_seconds": 0.0, "model_seconds": 0.0,
+        })
+        for name, amount in amounts.items():
+            stats[name] += amount
+
+
+def _record_usage(label: str, message: Any, seconds: float) -> None:
+    usage = getattr(message, "usage_metadata", None) or {}
+    _add_chain_stats(
+        label,
+        model_calls=1,
+        model_seconds=seconds,
+        input_tokens=usage.get("input_tokens", 0),
+        cached_input_tokens=(usage.get("input_token_details") or {}).get("cache_read", 0) or 0,
+        output_tokens=usage.get("output_tokens", 0),
+    )
+
+
+def chain_stats() -> Dict[str, Dict[str, Any]]:
+    """Usage per chain label, with cached-token ratio and mean per-call times.
+
+    overhead_ms is client-side work per call (formatting the prompt, keying
+    it, parsing the reply); queue_ms is time spent waiting on the dispatcher,
+    including retries.
+    """
+    with _CHAIN_STATS_LOCK:
+        snapshot = {label: dict(stats) for label, stats in _CHAIN_STATS.items()}
+    report: Dict[str, Dict[str, Any]] = {}
+    for label, s in snapshot.items():
+        calls, model_calls = max(1, s["calls"]), max(1, s["model_calls"])
+        report[label] = {
+            "calls": int(s["calls"]),
+            "model_calls": int(s["model_calls"]),
+            "input_tokens": int(s["input_tokens"]),
+            "cached_input_tokens": int(s["cached_input_tokens"]),
+            "cached_ratio": round(s["cached_input_tokens"] / s["input_tokens"], 4) if s["input_tokens"] else None,
+            "output_tokens": int(s["output_tokens"]),
+            "overhead_ms": round(1000 * s["overhead_seconds"] / calls, 3),
+            "queue_ms": round(1000 * s["queue_seconds"] / calls, 3),
+            "model_ms": round(1000 * s["model_seconds"] / model_calls, 3),
+        }
+    return report
+
+
+class DispatchedChatChain:
+    """prompt | chat model | output parser, sent through the "chat" dispatcher.
+
+    Meant to be built once per (model, prompt version) and shared: the
+    template, client and parser are reused, and a fixed system prompt ahead
+    of the per-call messages keeps the request prefix byte-identical, which
+    is what provider-side prompt caching matches on. Usage is recorded under
+    `label` (see `chain_stats`).
+    """
+
+    def __init__(self, label: str, prompt: Any, llm: Any, model: str, parser: Any = None, max_output_tokens: int = 1024):
+        from langchain_core.output_parsers import StrOutputParser
+
+        self.label = label
+        self.prompt = prompt
+        self.llm = llm
+        self.model = model
+        self.parser = parser if parser is not None else StrOutputParser()
+        self.max_output_tokens = max_output_tokens
+
+    def invoke(self, inputs: Dict[str, Any]) -> Any:
+        started = time.perf_counter()
+        prompt_value = self.prompt.invoke(inputs)
+        text = prompt_value.to_string()
+        key = request_key("chat", self.model, text)
+        tokens = estimate_tokens(text) + self.max_output_tokens
+        timing = {"model": 0.0}
+
+        def _call():
+            call_started = time.perf_counter()
+            message = self.llm.invoke(prompt_value)
+            elapsed = time.perf_counter() - call_started
+            timing["model"] += elapsed
+            _record_usage(self.label, message, elapsed)
+            return message
+
+        dispatched = time.perf_counter()
+        message = get_dispatcher("chat").call(_call, key=key, tokens=tokens)
+        returned = time.perf_counter()
+        result = self.parser.invoke(message)
+        finished = time.perf_counter()
+        _add_chain_stats(
+            self.label,
+            calls=1,
+            overhead_seconds=(dispatched - started) + (finished - returned),
+            # Coalesced callers wait for another caller's model call
+            queue_seconds=max(0.0, returned - dispatched - timing["model"]),
+        )
+        return result
+
+
+def dispatched_chat(llm: Any, model: str, max_output_tokens: int = 1024):
+    """Runnable that invokes `llm` on a prompt value through the "chat" dispatcher.
+
+    Usage is not recorded; use `DispatchedChatChain` for chains whose usage
+    should show up in `chain_stats`.
+    """
+    from langchain_core.runnables import RunnableLambda
+
+    def _invoke(prompt_value):
+        text = prompt_value.to_string()
+        return get_dispatcher("chat").call(
+            lambda: llm.invoke(prompt_value),
+            key=request_key("chat", model, text),
+            tokens=estimate_tokens(text) + max_output_tokens,
+        )
+
+    return RunnableLambda(_invoke)
@@ -0,0 +1,149 @@
+"""Compact FAISS index modes for per-document vector stores.
+
+Every chunk embedding is 1536 float32 values (6 KiB). With thousands of
+leases cached per worker, the flat indexes dominate memory. The compact
+modes keep a quantized copy of the vectors in RAM for the first search pass.
+They store the exact float32 vectors in `vectors.npy`, memory-mapped from
+disk, so the shortlist can be re-scored exactly.
+
+Modes:
+  flat  IndexFlatL2, exact (the original behaviour)
+  fp16  scalar quantizer, 2 bytes per dimension
+  sq8   scalar quantizer, 1 byte per dimension
+  pq    product quantizer, ~1 byte per 16 dimensions
+"""
+from __future__ import annotations
+
+import math
+from pathlib import Path
+from typing import Any
+
+import faiss
+import numpy as np
+
+INDEX_MODES = ("flat", "fp16", "sq8", "pq")
+DEFAULT_OVERSAMPLE = 4
+# Dimensions per PQ sub-quantizer; 1536 dims -> 96 bytes per vector
+_PQ_DIMS_PER_SUBQUANTIZER = 16
+_PQ_POINTS_PER_CENTROID = 39
+
+
+def _pq_params(n: int, d: int) -> tuple[int, int] | None:
+    m = d // _PQ_DIMS_PER_SUBQUANTIZER
+    while m > 1 and d % m:
+        m -= 1
+    # Each sub-quantizer trains 2**nbits centroids, and FAISS's k-means wants
+    # at least 39 training points per centroid. Below 4 bits (624 chunks)
+    # the codebooks would outweigh the data, so build_index falls back to sq8.
+    nbits = min(8, int(math.log2(n / _PQ_POINTS_PER_CENTROID))) if n >= _PQ_POINTS_PER_CENTROID else 0
+    if m < 1 or nbits < 4:
+        return None
+    return m, nbits
+
+
+def build_index(vectors: np.ndarray, mode: str) -> Any:
+    """Train (if needed) and fill a FAISS index of the given mode.
+
+    "pq" falls back to "sq8" when there are too few vectors to train it;
+    `index_mode_of` tells which mode was actually built.
+    """
+    vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+    n, d = vectors.shape
+    if mode == "fp16":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_fp16, faiss.METRIC_L2)
+    elif mode == "sq8":
+        index = faiss.IndexScalarQuantizer(d, faiss.ScalarQuantizer.QT_8bit, faiss.METRIC_L2)
+    elif mode == "pq":
+        params = _pq_params(n, d)
+        if params is None:
+            # Too few chunks to train a codebook; sq8 is the next most compact
+            return build_index(vectors, "sq8")
+        index = faiss.IndexPQ(d, params[0], params[1], faiss.METRIC_L2)
+    else:
+        index = faiss.IndexFlatL2(d)
+    if not index.is_trained:
+        index.train(vectors)
+    index.add(vectors)
+    return index
+
+
+class RerankedIndex:
+    """A compact FAISS index whose shortlist is re-scored against exact vectors.
+
+    Implements the subset of the faiss.Index interface used by langchain's
+    FAISS wrapper (`search`, `reconstruct`, `ntotal`, `d`), so it can be
+    assigned to `FAISS.index` directly.
+    """
+
+    def __init__(self, base: Any, vectors: np.ndarray, oversample: int = DEFAULT_OVERSAMPLE):
+        self.base = base
+        self.vectors = vectors
+        self.oversample = max(1, oversample)
+
+    @property
+    def ntotal(self) -> int:
+        return self.base.ntotal
+
+    @property
+    def d(self) -> int:
+        return self.base.d
+
+    def search(self, x: np.ndarray, k: int) -> tuple[np.ndarray, np.ndarray]:
+        x = np.ascontiguousarray(np.atleast_2d(x), dtype=np.float32)
+        shortlist = min(self.ntotal, k * self.oversample)
+        distances = np.full((x.shape[0], k), np.inf, dtype=np.float32)
+        labels = np.full((x.shape[0], k), -1, dtype=np.int64)
+        if shortlist <= 0:
+            return distances, labels
+        _, candidates = self.base.search(x, shortlist)
+        for row, query in enumerate(x):
+            # Sorted ids keep reads from the mmap sequential; fancy indexing
+            # copies only the shortlisted rows
+            ids = np.sort(candidates[row][candidates[row] >= 0])
+            exact = np.asarray(self.vectors[ids], dtype=np.float32)
+            scores = ((exact - query) ** 2).sum(axis=1)
+            top = np.argsort(scores)[:k]
+            distances[row, : len(top)] = scores[top]
+            labels[row, : len(top)] = ids[top]
+        return distances, labels
+
+    def reconstruct(self, i: int) -> np.ndarray:
+        return np.asarray(self.vectors[int(i)], dtype=np.float32)
+
+    def reconstruct_n(self, i0: int, n: int) -> np.ndarray:
+        return np.asarray(self.vectors[i0 : i0 + n], dtype=np.float32)
+
+
+def index_mode_of(index: Any) -> str:
+    base = index.base if isinstance(index, RerankedIndex) else index
+    if isinstance(base, faiss.IndexPQ):
+        return "pq"
+    if isinstance(base, faiss.IndexScalarQuantizer):
+        return "fp16" if base.sq.qtype == faiss.ScalarQuantizer.QT_fp16 else "sq8"
+    return "flat"
+
+
+def make_index(vectors: np.ndarray, mode: str) -> Any:
+    """Index for a freshly embedded doc; compact modes come wrapped for rerank."""
+    index = build_index(vectors, mode)
+    if index_mode_of(index) == "flat":
+        return index
+    return RerankedIndex(index, np.ascontiguousarray(vectors, dtype=np.float32))
+
+
+def attach_exact_vectors(index: Any, vectors_path: Path) -> Any:
+    """Wrap a compact index loaded from disk with its mmapped exact vectors."""
+    if index_mode_of(index) == "flat" or not vectors_path.exists():
+        return index
+    vectors = np.load(vectors_path, mmap_mode="r")
+    if vectors.shape[0] != index.ntotal:
+        # vectors.npy belongs to a different build; search without rerank
+        print("vectors.npy does not match index; skipping exact rerank")
+        return index
+    return RerankedIndex(index, vectors)
+
+
+def resident_bytes(index: Any) -> int:
+    """Bytes the index keeps in process memory (exact vectors are mmapped)."""
+    base = index.base if isinstance(index, RerankedIndex) else index
+    return int(faiss.serialize_index(base).nbytes)